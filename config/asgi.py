@@ -21,11 +21,14 @@ django_asgi_app = get_asgi_application()
 
 # Import routing after Django is initialized
 import messenger.routing
+from messenger.drain import LifespanApp
 
 # For development: AllowedHostsOriginValidator will respect ALLOWED_HOSTS = ['*']
 # For production: Use specific ALLOWED_HOSTS and keep AllowedHostsOriginValidator
+# Lifespan (uvicorn) drains open WebSockets on shutdown; daphne ignores it
 application = ProtocolTypeRouter({
     "http": django_asgi_app,
+    "lifespan": LifespanApp(),
     "websocket": AllowedHostsOriginValidator(
         AuthMiddlewareStack(
             URLRouter(
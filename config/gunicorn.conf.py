@@ -0,0 +1,21 @@
+"""
+Gunicorn configuration for multi-process serving with uvicorn workers:
+
+    gunicorn -c config/gunicorn.conf.py config.asgi:application
+
+Workers share the listening socket, so WebSockets and REST spread over all of
+them. Several workers need the Redis channel layer (REDIS_URL or REDIS_URLS),
+a shared cache (CACHE_REDIS_URL) and a shared METRICS_DIR.
+On SIGTERM each worker drains its WebSockets (messenger.drain) before it exits.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_class = 'uvicorn_worker.UvicornWorker'
+# Time a worker gets after SIGTERM before it is killed; covers DRAIN_TIMEOUT
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+keepalive = 5
+accesslog = '-'
@@ -16,8 +16,10 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
+from messenger.admin import profiles_view
 
 urlpatterns = [
+    path('admin/profiles/', admin.site.admin_view(profiles_view), name='messenger_profiles'),
     path('admin/', admin.site.urls),
     path('', include('messenger.urls')),
 ]
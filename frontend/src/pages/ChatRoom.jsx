@@ -71,11 +71,22 @@ function ChatRoom() {
       handleWebSocketError,
       handleWebSocketClose
     );
+    ws.onResync = reloadMessages;
     
     ws.connect();
     setWsService(ws);
   };
 
+  const reloadMessages = async () => {
+    // Some messages after the last one delivered were not sent to this socket
+    try {
+      const messagesData = await apiService.getRoomMessages(roomCode);
+      setMessages(messagesData.results.reverse());
+    } catch (err) {
+      setError(err.response?.data?.error || 'Failed to reload messages');
+    }
+  };
+
   const handleNewMessage = (messageData) => {
     setMessages((prev) => [...prev, messageData]);
   };
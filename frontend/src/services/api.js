@@ -76,8 +76,9 @@ export const apiService = {
     return response.data;
   },
 
-  async reportMessage(messageId, reason = '') {
-    const response = await api.post(`/messages/${messageId}/report/`, { reason });
+  async reportMessage(roomCode, messageId, reason = '') {
+    // Message ids are only unique within a room's shard
+    const response = await api.post(`/messages/${messageId}/report/`, { room_code: roomCode, reason });
     return response.data;
   },
 
@@ -2,6 +2,37 @@
  * WebSocket service for real-time messaging
  */
 
+// Subprotocols offered to the server, most preferred first (see messenger/protocol.py)
+const COMPACT_PROTOCOL = 'messenger.compact.v1';
+const PROTOCOLS = [COMPACT_PROTOCOL, 'messenger.json'];
+
+// Compact type code -> [verbose type, short key -> verbose key, whether fields go under `data`]
+const COMPACT_FRAMES = {
+  m: ['chat_message', { i: 'id', p: 'participant_id', c: 'content', ts: 'timestamp' }, true],
+  y: ['typing', { p: 'participant_id', y: 'is_typing' }, false],
+  p: ['roster', { i: 'participant_id', l: 'participants' }, false],
+  pj: ['participant_joined', { i: 'participant_id', n: 'nickname' }, false],
+  pl: ['participant_left', { i: 'participant_id' }, false],
+  e: ['error', { m: 'message' }, false],
+  r: ['resync', { r: 'reason', l: 'last_message_id' }, false],
+  rc: ['reconnect', { r: 'reason', d: 'retry_after_ms' }, false],
+};
+
+function fromCompact(wire) {
+  const spec = COMPACT_FRAMES[wire.t];
+  if (!spec) {
+    return wire;
+  }
+  const [type, keys, nested] = spec;
+  const fields = {};
+  Object.keys(wire).forEach((key) => {
+    if (key !== 't') {
+      fields[keys[key] || key] = wire[key];
+    }
+  });
+  return nested ? { type, data: fields } : { type, ...fields };
+}
+
 export class WebSocketService {
   constructor(roomCode, sessionToken, onMessage, onError, onClose) {
     this.roomCode = roomCode;
@@ -14,6 +45,11 @@ export class WebSocketService {
     this.maxReconnectAttempts = 5;
     this.reconnectDelay = 1000;
     this.isManualClose = false;
+    this.restartDelay = null;
+    // Participant id -> nickname for this room; frames received before the roster wait in `pending`
+    this.participants = new Map();
+    this.participantId = null;
+    this.pending = null;
   }
 
   connect() {
@@ -21,7 +57,8 @@ export class WebSocketService {
     const wsUrl = `${protocol}//${window.location.host}/ws/chat/${this.roomCode}/?token=${this.sessionToken}`;
     
     try {
-      this.ws = new WebSocket(wsUrl);
+      this.ws = new WebSocket(wsUrl, PROTOCOLS);
+      this.pending = [];
       
       this.ws.onopen = () => {
         console.log('WebSocket connected');
@@ -30,16 +67,7 @@ export class WebSocketService {
 
       this.ws.onmessage = (event) => {
         try {
-          const data = JSON.parse(event.data);
-          if (data.type === 'chat_message' && this.onMessage) {
-            this.onMessage(data.data);
-          } else if (data.type === 'typing' && this.onTyping) {
-            this.onTyping(data);
-          } else if (data.type === 'error') {
-            if (this.onError) {
-              this.onError(data.message);
-            }
-          }
+          this.handleFrame(this.decode(event.data));
         } catch (error) {
           console.error('Error parsing WebSocket message:', error);
         }
@@ -58,6 +86,14 @@ export class WebSocketService {
           this.onClose();
         }
         
+        if (!this.isManualClose && this.restartDelay !== null) {
+          const delay = this.restartDelay;
+          this.restartDelay = null;
+          console.log(`Server restarting, reconnecting in ${delay}ms...`);
+          setTimeout(() => this.connect(), delay);
+          return;
+        }
+
         // Auto-reconnect if not manually closed
         if (!this.isManualClose && this.reconnectAttempts < this.maxReconnectAttempts) {
           this.reconnectAttempts++;
@@ -74,12 +110,60 @@ export class WebSocketService {
     }
   }
 
+  handleFrame(data) {
+    if (data.type === 'roster') {
+      this.participants = new Map(data.participants);
+      this.participantId = data.participant_id;
+      const pending = this.pending || [];
+      this.pending = null;
+      pending.forEach((frame) => this.handleFrame(frame));
+      return;
+    }
+    if (this.pending && data.type !== 'error' && data.type !== 'reconnect') {
+      // Room frames refer to participants by id; hold them until the roster arrives
+      this.pending.push(data);
+      return;
+    }
+    if (data.type === 'participant_joined') {
+      this.participants.set(data.participant_id, data.nickname);
+    } else if (data.type === 'participant_left') {
+      this.participants.delete(data.participant_id);
+    } else if (data.type === 'chat_message' && this.onMessage) {
+      this.onMessage({ ...data.data, session_nickname: this.nicknameFor(data.data) });
+    } else if (data.type === 'typing' && this.onTyping) {
+      this.onTyping({ ...data, nickname: this.nicknameFor(data) });
+    } else if (data.type === 'reconnect') {
+      // The server is restarting; reconnect after its (jittered) delay, not as a failure
+      this.restartDelay = data.retry_after_ms;
+    } else if (data.type === 'resync' && this.onResync) {
+      // This socket fell behind and lost messages; after a slow_consumer resync it is also closed and reconnects
+      this.onResync(data);
+    } else if (data.type === 'error') {
+      if (this.onError) {
+        this.onError(data.message);
+      }
+    }
+  }
+
+  nicknameFor(data) {
+    // Verbose frames still carry the nickname; compact ones only the participant id
+    return data.session_nickname || data.nickname || this.participants.get(data.participant_id) || 'Anonymous';
+  }
+
+  isCompact() {
+    return this.ws && this.ws.protocol === COMPACT_PROTOCOL;
+  }
+
+  decode(text) {
+    const wire = JSON.parse(text);
+    return this.isCompact() ? fromCompact(wire) : wire;
+  }
+
   sendMessage(content) {
     if (this.ws && this.ws.readyState === WebSocket.OPEN) {
-      this.ws.send(JSON.stringify({
-        type: 'chat_message',
-        content: content,
-      }));
+      this.ws.send(JSON.stringify(this.isCompact()
+        ? { t: 'm', c: content }
+        : { type: 'chat_message', content: content }));
       return true;
     }
     return false;
@@ -87,10 +171,9 @@ export class WebSocketService {
 
   sendTyping(isTyping) {
     if (this.ws && this.ws.readyState === WebSocket.OPEN) {
-      this.ws.send(JSON.stringify({
-        type: 'typing',
-        is_typing: isTyping,
-      }));
+      this.ws.send(JSON.stringify(this.isCompact()
+        ? { t: 'y', y: isTyping }
+        : { type: 'typing', is_typing: isTyping }));
     }
   }
 
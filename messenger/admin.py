@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.contrib import admin
 from django.utils.html import format_html
 from django.urls import path, reverse
@@ -7,7 +8,13 @@ from django.http import JsonResponse
 from django.db.models import Count, Q
 from django.utils import timezone
 from datetime import timedelta
-from .models import Session, Room, Message, AuditLog, BannedSession
+from .models import Session, Room, Message, MessageReport, AuditLog, BannedSession, IPBan, ArchivedRoom
+from .routers import read_from_replica
+from .sharding import message_databases, sharding_enabled
+from .moderation import bulk_ban_sessions, bulk_unban_sessions
+from . import profiling
+from .search import search_message_ids
+from .utils import invalidate_cached_rooms
 
 
 @admin.register(Session)
@@ -20,29 +27,13 @@ class SessionAdmin(admin.ModelAdmin):
     
     def ban_sessions(self, request, queryset):
         """Ban selected sessions."""
-        count = 0
-        for session in queryset:
-            if not session.is_banned:
-                session.is_banned = True
-                session.save()
-                BannedSession.objects.create(
-                    session=session,
-                    reason='Banned by admin',
-                    banned_by=request.user.username
-                )
-                count += 1
+        count = bulk_ban_sessions(queryset, reason='Banned by admin', banned_by=request.user.username)
         self.message_user(request, f'{count} session(s) banned successfully.')
     ban_sessions.short_description = "Ban selected sessions"
     
     def unban_sessions(self, request, queryset):
         """Unban selected sessions."""
-        count = 0
-        for session in queryset:
-            if session.is_banned:
-                session.is_banned = False
-                session.banned_until = None
-                session.save()
-                count += 1
+        count = bulk_unban_sessions(queryset, unbanned_by=request.user.username)
         self.message_user(request, f'{count} session(s) unbanned successfully.')
     unban_sessions.short_description = "Unban selected sessions"
 
@@ -50,10 +41,10 @@ class SessionAdmin(admin.ModelAdmin):
 @admin.register(Room)
 class RoomAdmin(admin.ModelAdmin):
     list_display = ['code', 'name', 'owner_nickname', 'message_count', 'participant_count', 
-                   'is_active', 'created_at']
-    list_filter = ['is_active', 'created_at']
+                   'is_active', 'is_archived', 'created_at']
+    list_filter = ['is_active', 'is_archived', 'created_at']
     search_fields = ['code', 'name']
-    readonly_fields = ['code', 'created_at']
+    readonly_fields = ['code', 'is_archived', 'created_at']
     actions = ['deactivate_rooms', 'activate_rooms']
     
     def owner_nickname(self, obj):
@@ -70,7 +61,9 @@ class RoomAdmin(admin.ModelAdmin):
     
     def deactivate_rooms(self, request, queryset):
         """Deactivate selected rooms."""
+        codes = list(queryset.values_list('code', flat=True))
         count = queryset.update(is_active=False)
+        invalidate_cached_rooms(codes)
         self.message_user(request, f'{count} room(s) deactivated successfully.')
     deactivate_rooms.short_description = "Deactivate selected rooms"
     
@@ -86,9 +79,16 @@ class MessageAdmin(admin.ModelAdmin):
     list_display = ['id', 'room_code', 'session_nickname', 'content_preview', 
                    'reported_count', 'is_deleted', 'timestamp']
     list_filter = ['is_deleted', 'reported_count', 'timestamp']
-    search_fields = ['content', 'room__code', 'session__nickname']
+    # Content is matched through the full-text index in get_search_results
+    search_fields = ['room__code', 'session__nickname']
     readonly_fields = ['timestamp']
     actions = ['delete_messages', 'restore_messages', 'clear_reports']
+
+    def get_search_results(self, request, queryset, search_term):
+        results, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        if search_term:
+            results |= queryset.filter(id__in=search_message_ids(search_term, using=queryset.db))
+        return results, may_have_duplicates
     
     def room_code(self, obj):
         return obj.room.code
@@ -117,11 +117,24 @@ class MessageAdmin(admin.ModelAdmin):
     
     def clear_reports(self, request, queryset):
         """Clear report counts for selected messages."""
+        MessageReport.objects.filter(message__in=queryset).delete()
         count = queryset.update(reported_count=0)
         self.message_user(request, f'{count} message(s) report counts cleared.')
     clear_reports.short_description = "Clear report counts"
 
 
+@admin.register(MessageReport)
+class MessageReportAdmin(admin.ModelAdmin):
+    list_display = ['message_id', 'reporter_nickname', 'reason', 'created_at']
+    list_filter = ['created_at']
+    search_fields = ['reason', 'reporter__nickname']
+    readonly_fields = ['message', 'reporter', 'created_at']
+    
+    def reporter_nickname(self, obj):
+        return obj.reporter.nickname if obj.reporter else 'N/A'
+    reporter_nickname.short_description = 'Reporter'
+
+
 @admin.register(AuditLog)
 class AuditLogAdmin(admin.ModelAdmin):
     list_display = ['event_type', 'session_nickname', 'room_code', 'ip_address', 'timestamp']
@@ -163,6 +176,40 @@ class BannedSessionAdmin(admin.ModelAdmin):
     is_active.short_description = 'Active'
 
 
+@admin.register(IPBan)
+class IPBanAdmin(admin.ModelAdmin):
+    list_display = ['network', 'reason', 'banned_by', 'created_at', 'expires_at', 'is_active']
+    list_filter = ['created_at', 'expires_at']
+    search_fields = ['network', 'banned_by', 'reason']
+    readonly_fields = ['created_at']
+    
+    def save_model(self, request, obj, form, change):
+        if not obj.banned_by:
+            obj.banned_by = request.user.username
+        super().save_model(request, obj, form, change)
+    
+    def is_active(self, obj):
+        return obj.is_active()
+    is_active.boolean = True
+    is_active.short_description = 'Active'
+
+
+@admin.register(ArchivedRoom)
+class ArchivedRoomAdmin(admin.ModelAdmin):
+    list_display = ['room', 'message_count', 'visible_count', 'size_bytes', 'codec', 'last_message_at', 'archived_at']
+    list_filter = ['codec', 'archived_at']
+    search_fields = ['room__code', 'path']
+    readonly_fields = ['room', 'path', 'codec', 'message_count', 'visible_count', 'size_bytes',
+                       'last_message_at', 'archived_at']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        # Rooms still point at their archive; restore with archive_rooms --restore
+        return False
+
+
 # Custom Admin Dashboard View
 class MessengerAdminSite(admin.AdminSite):
     site_header = "Anonymous Messenger Administration"
@@ -174,6 +221,7 @@ class MessengerAdminSite(admin.AdminSite):
         custom_urls = [
             path('dashboard/', self.admin_view(self.dashboard_view), name='messenger_dashboard'),
             path('dashboard/stats/', self.admin_view(self.stats_api), name='messenger_stats'),
+            path('profiles/', self.admin_view(profiles_view), name='messenger_profiles'),
         ]
         return custom_urls + urls
     
@@ -191,15 +239,27 @@ class MessengerAdminSite(admin.AdminSite):
         last_24h = now - timedelta(hours=24)
         last_7d = now - timedelta(days=7)
         
-        stats = {
+        with read_from_replica():
+            stats = self.collect_stats(last_24h)
+        return JsonResponse(stats)
+    
+    def count_messages(self, **filters):
+        """Count messages matching filters across every message shard."""
+        if not sharding_enabled():
+            return Message.objects.filter(**filters).count()
+        return sum(Message.objects.using(alias).filter(**filters).count() for alias in message_databases())
+    
+    def collect_stats(self, last_24h):
+        """Gather dashboard counters and recent activity."""
+        return {
             'total_sessions': Session.objects.count(),
             'active_sessions_24h': Session.objects.filter(last_active__gte=last_24h).count(),
             'banned_sessions': Session.objects.filter(is_banned=True).count(),
             'total_rooms': Room.objects.count(),
             'active_rooms': Room.objects.filter(is_active=True).count(),
-            'total_messages': Message.objects.filter(is_deleted=False).count(),
-            'messages_24h': Message.objects.filter(timestamp__gte=last_24h, is_deleted=False).count(),
-            'reported_messages': Message.objects.filter(reported_count__gt=0, is_deleted=False).count(),
+            'total_messages': self.count_messages(is_deleted=False),
+            'messages_24h': self.count_messages(timestamp__gte=last_24h, is_deleted=False),
+            'reported_messages': self.count_messages(reported_count__gt=0, is_deleted=False),
             'audit_logs_24h': AuditLog.objects.filter(timestamp__gte=last_24h).count(),
             'rate_limit_hits_24h': AuditLog.objects.filter(
                 event_type='rate_limit',
@@ -213,7 +273,26 @@ class MessengerAdminSite(admin.AdminSite):
                                      .values('event_type', 'timestamp', 'ip_address',
                                             'session__nickname', 'room__code')),
         }
-        return JsonResponse(stats)
+
+
+def profiles_view(request):
+    """Recent request profiles and slow queries of this worker process."""
+    recent = sorted(profiling.profiles, key=lambda profile: profile.id, reverse=True)
+    selected = None
+    if request.GET.get('id'):
+        selected = next((profile for profile in recent if str(profile.id) == request.GET['id']), None)
+    context = {
+        **admin.site.each_context(request),
+        'title': 'Request profiles',
+        'profiles': recent,
+        'selected': selected,
+        'slow_queries': list(reversed(profiling.slow_queries)),
+        'profiling_enabled': settings.PROFILING_ENABLED,
+        'threshold_ms': settings.PROFILING_THRESHOLD_MS,
+        'slow_query_ms': settings.SLOW_QUERY_MS,
+        'header': settings.PROFILING_HEADER,
+    }
+    return render(request, 'admin/messenger_profiles.html', context)
 
 
 # Use custom admin site (optional - can use default admin.site instead)
@@ -1,6 +1,30 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_migrate, post_save
 
 
 class MessengerConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'messenger'
+
+    def ready(self):
+        from .db import apply_sqlite_pragmas
+        connection_created.connect(apply_sqlite_pragmas, dispatch_uid='messenger_sqlite_pragmas')
+
+        if settings.METRICS_ENABLED:
+            from .metrics import instrument_connection
+            connection_created.connect(instrument_connection, dispatch_uid='messenger_db_metrics')
+
+        if settings.PROFILING_ENABLED or settings.SLOW_QUERY_MS:
+            from .profiling import instrument_connection as profile_connection
+            connection_created.connect(profile_connection, dispatch_uid='messenger_db_profiling')
+
+        from .models import IPBan
+        from .moderation import publish_ip_bans
+        post_save.connect(publish_ip_bans, sender=IPBan, dispatch_uid='messenger_ip_bans_saved')
+        post_delete.connect(publish_ip_bans, sender=IPBan, dispatch_uid='messenger_ip_bans_deleted')
+
+        # SQLite rebuilds the messages table on some schema changes, which drops the FTS triggers
+        from .search import ensure_search_index
+        post_migrate.connect(ensure_search_index, sender=self, dispatch_uid='messenger_search_index')
@@ -0,0 +1,272 @@
+"""
+Cold storage for inactive rooms.
+A room's messages (with their reports) are written to a compressed NDJSON file,
+indexed by an ArchivedRoom row, and removed from the message tables. History
+reads are served from the file; the first new message rehydrates the room.
+"""
+import gzip
+import itertools
+import json
+import logging
+import os
+from datetime import timedelta
+from pathlib import Path
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .models import ArchivedRoom, Message, MessageReport, Room, Session
+from .sharding import shard_for_room
+from .db import preserve_timestamps
+from .utils import get_cached_room, invalidate_cached_rooms
+
+try:
+    import zstandard
+except ImportError:  # optional; archives fall back to gzip
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_SUFFIXES = {'zstd': '.ndjson.zst', 'gzip': '.ndjson.gz'}
+ARCHIVE_BATCH_SIZE = 1000
+
+
+def default_codec():
+    codec = settings.ARCHIVE_CODEC or ('zstd' if zstandard is not None else 'gzip')
+    if codec == 'zstd' and zstandard is None:
+        raise RuntimeError('ARCHIVE_CODEC is zstd but the zstandard package is not installed.')
+    return codec
+
+
+def open_archive(path, mode, codec):
+    """Open an archive file in text mode ('rt' or 'wt')."""
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError(f'{path} is zstd-compressed but the zstandard package is not installed.')
+        return zstandard.open(path, mode, encoding='utf-8')
+    return gzip.open(path, mode, encoding='utf-8')
+
+
+def inactive_rooms(inactive_days):
+    """Unarchived rooms created before the cutoff with no message since it."""
+    cutoff = timezone.now() - timedelta(days=inactive_days)
+    for room in Room.objects.filter(is_archived=False, created_at__lt=cutoff).order_by('id').iterator():
+        last_message_at = Message.objects.for_room(room).aggregate(last=Max('timestamp'))['last']
+        if last_message_at is None or last_message_at < cutoff:
+            yield room, last_message_at
+
+
+def _message_batches(queryset, batch_size):
+    """Yield batches of archive rows (message fields plus nickname and reports)."""
+    batch = []
+
+    def finish(rows):
+        ids = [row['id'] for row in rows]
+        reports = {}
+        for report in MessageReport.objects.using(queryset.db).filter(message_id__in=ids).values(
+            'message_id', 'reporter_id', 'reason', 'created_at'
+        ):
+            reports.setdefault(report.pop('message_id'), []).append(
+                {**report, 'created_at': report['created_at'].isoformat()}
+            )
+        nicknames = dict(Session.objects.filter(
+            id__in={row['session_id'] for row in rows}
+        ).values_list('id', 'nickname'))
+        for row in rows:
+            row['timestamp'] = row['timestamp'].isoformat()
+            row['nickname'] = nicknames.get(row['session_id'], 'Unknown')
+            row['reports'] = reports.get(row['id'], [])
+        return rows
+
+    for row in queryset.iterator(chunk_size=batch_size):
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield finish(batch)
+            batch = []
+    if batch:
+        yield finish(batch)
+
+
+def archive_room(room, directory=None, codec=None, batch_size=ARCHIVE_BATCH_SIZE):
+    """
+    Move a room's messages into an archive file.
+    Returns the ArchivedRoom, or None if messages arrived while archiving.
+    """
+    codec = codec or default_codec()
+    directory = Path(directory or settings.ARCHIVE_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f'{room.code}{ARCHIVE_SUFFIXES[codec]}'
+    partial = path.with_name(path.name + '.partial')
+
+    messages = Message.objects.for_room(room)
+    db = messages.db
+    queryset = messages.using(db).order_by('id').values(
+        'id', 'timestamp', 'session_id', 'content', 'is_deleted', 'reported_count', 'report_status'
+    )
+
+    last_message_at = messages.using(db).aggregate(last=Max('timestamp'))['last']
+    message_count = visible_count = 0
+    last_id = 0
+    with open_archive(partial, 'wt', codec) as archive:
+        for rows in _message_batches(queryset, batch_size):
+            for row in rows:
+                archive.write(json.dumps(row) + '\n')
+                message_count += 1
+                visible_count += not row['is_deleted']
+                last_id = row['id']
+    os.replace(partial, path)
+
+    with transaction.atomic(), transaction.atomic(using=db):
+        # The lock rehydrate_room() takes, so the two never interleave for a room
+        Room.objects.select_for_update().get(pk=room.pk)
+        if Message.objects.using(db).filter(room_id=room.id, id__gt=last_id).exists():
+            # Someone wrote to the room meanwhile; leave it hot
+            transaction.on_commit(lambda: path.unlink(missing_ok=True))
+            return None
+        entry, _ = ArchivedRoom.objects.update_or_create(room=room, defaults={
+            'path': str(path),
+            'codec': codec,
+            'message_count': message_count,
+            'visible_count': visible_count,
+            'size_bytes': path.stat().st_size,
+            'last_message_at': last_message_at,
+        })
+        Room.objects.filter(pk=room.pk).update(is_archived=True)
+        while True:
+            # Only what went into the file: a message sent meanwhile must not be lost
+            ids = list(Message.objects.using(db).filter(room_id=room.id, id__lte=last_id)
+                       .values_list('id', flat=True)[:batch_size])
+            if not ids:
+                break
+            # Cascades to the room's message reports
+            Message.objects.using(db).filter(id__in=ids).delete()
+
+    room.is_archived = True
+    invalidate_cached_rooms([room.code])
+    if Message.objects.using(db).filter(room_id=room.id, id__gt=last_id).exists():
+        # A sender that saw the room hot just before the commit; bring it back rather than hide the message
+        rehydrate_room(room)
+        return None
+    return entry
+
+
+def iter_archive(entry):
+    """Yield archived message rows in their original order."""
+    with open_archive(entry.path, 'rt', entry.codec) as archive:
+        for line in archive:
+            yield json.loads(line)
+
+
+def archived_messages_page(room, page, page_size):
+    """
+    Return (rows, count) for one newest-first page of an archived room's visible
+    messages, shaped like MessageSerializer output. Streams the file once.
+    """
+    entry = room.archive
+    count = entry.visible_count
+    end = count - (page - 1) * page_size
+    start = max(end - page_size, 0)
+    rows = []
+    position = 0
+    for row in iter_archive(entry):
+        if row['is_deleted']:
+            continue
+        if position >= end:
+            break
+        if position >= start:
+            rows.append({
+                'id': row['id'],
+                'room': room.id,
+                'room_code': room.code,
+                'session': row['session_id'],
+                'session_nickname': row['nickname'],
+                'content': row['content'],
+                'timestamp': row['timestamp'],
+                'is_deleted': False,
+                'reported_count': row['reported_count'],
+            })
+        position += 1
+    rows.reverse()
+    return rows, count
+
+
+def archived_export_batches(room, batch_size=ARCHIVE_BATCH_SIZE):
+    """Yield batches of visible archived rows with the fields used by exports."""
+    batch = []
+    for row in iter_archive(room.archive):
+        if row['is_deleted']:
+            continue
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def rehydrate_room(room, batch_size=ARCHIVE_BATCH_SIZE):
+    """Load an archived room's messages back into its message database. Returns the count."""
+    db = shard_for_room(room.code)
+    restored = 0
+    with transaction.atomic():
+        room = Room.objects.select_for_update().get(pk=room.pk)
+        if not room.is_archived:
+            return 0
+        entry = room.archive
+
+        with transaction.atomic(using=db), preserve_timestamps([Message, MessageReport]):
+            rows = iter_archive(entry)
+            while batch := list(itertools.islice(rows, batch_size)):
+                restored += _restore_batch(room, db, batch)
+
+        path = entry.path
+        entry.delete()
+        Room.objects.filter(pk=room.pk).update(is_archived=False)
+        transaction.on_commit(lambda: Path(path).unlink(missing_ok=True))
+
+    invalidate_cached_rooms([room.code])
+    logger.info('Rehydrated %d archived message(s) for room %s', restored, room.code)
+    return restored
+
+
+def _restore_batch(room, db, rows):
+    # Sessions may have been cleaned up since archiving
+    session_ids = {row['session_id'] for row in rows}
+    session_ids |= {report['reporter_id'] for row in rows for report in row['reports']}
+    existing = set(Session.objects.filter(id__in=session_ids).values_list('id', flat=True))
+
+    messages = [
+        Message(
+            room_id=room.id,
+            session_id=row['session_id'] if row['session_id'] in existing else None,
+            content=row['content'],
+            is_deleted=row['is_deleted'],
+            reported_count=row['reported_count'],
+            report_status=row['report_status'],
+            timestamp=parse_datetime(row['timestamp']),
+        )
+        for row in rows
+    ]
+    # Ids are not reused; restored messages get new ones
+    Message.objects.using(db).bulk_create(messages)
+
+    reports = [
+        MessageReport(message_id=message.pk, reporter_id=report['reporter_id'], reason=report['reason'],
+                      created_at=parse_datetime(report['created_at']))
+        for message, row in zip(messages, rows)
+        for report in row['reports']
+        if report['reporter_id'] in existing
+    ]
+    MessageReport.objects.using(db).bulk_create(reports)
+    return len(messages)
+
+
+def ensure_hot(room):
+    """Rehydrate an archived room before it receives a new message."""
+    # The caller's Room may be long-lived (a WebSocket consumer's); archive_room() invalidates
+    # the cached one, so that reflects an archive made since
+    cached = get_cached_room(room.code)
+    if room.is_archived or (cached is not None and cached.is_archived):
+        rehydrate_room(room)
+    room.is_archived = False
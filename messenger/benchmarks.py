@@ -0,0 +1,547 @@
+"""
+Benchmark scenarios run by the `benchmark` management command.
+Each scenario takes the parsed command options and returns a dict of results.
+REST scenarios go through the full middleware stack with the test client;
+WebSocket scenarios use the configured channel layer (in-memory unless
+REDIS_URLS is set) and run against scratch databases; group_send builds its
+own layers to compare configurations.
+"""
+import asyncio
+import math
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.cache import cache
+from django.test.utils import (
+    setup_databases, setup_test_environment, teardown_databases, teardown_test_environment,
+)
+from .db import sqlite_pragma_statements
+
+SCENARIOS = {}
+
+
+def scenario(name):
+    """Register a benchmark scenario under the given name."""
+    def register(func):
+        SCENARIOS[name] = func
+        return func
+    return register
+
+
+def percentile(sorted_samples, fraction):
+    """Return the sample at the given fraction (0-1) of a sorted list."""
+    if not sorted_samples:
+        return 0.0
+    index = min(len(sorted_samples) - 1, int(round(fraction * (len(sorted_samples) - 1))))
+    return sorted_samples[index]
+
+
+def summarize(samples, elapsed):
+    """Summarize latency samples (seconds) into throughput and percentiles in ms."""
+    samples = sorted(samples)
+    return {
+        'ops': len(samples),
+        'ops_per_sec': round(len(samples) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(samples, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(samples, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(samples, 0.99) * 1000, 3),
+    }
+
+
+@contextmanager
+def scratch_database():
+    """Run the block against freshly created test databases, destroyed afterwards."""
+    old_config = setup_databases(verbosity=0, interactive=False)
+    try:
+        yield
+    finally:
+        teardown_databases(old_config, verbosity=0)
+
+
+@contextmanager
+def rest_client():
+    """Yield a test Client that can be used outside the test runner."""
+    from django.test import Client
+
+    setup_test_environment(debug=False)
+    try:
+        yield Client()
+    finally:
+        teardown_test_environment()
+
+
+def client_ip(index):
+    """A distinct address per request so per-IP rate limits do not skew results."""
+    return f'10.{(index >> 16) & 255}.{(index >> 8) & 255}.{index & 255}'
+
+
+def _timed_requests(count, request):
+    """Call request(i) count times; return a summary with non-2xx responses counted as errors."""
+    samples = []
+    errors = 0
+    started = time.perf_counter()
+    for i in range(count):
+        start = time.perf_counter()
+        response = request(i)
+        samples.append(time.perf_counter() - start)
+        if response.status_code >= 300:
+            errors += 1
+    result = summarize(samples, time.perf_counter() - started)
+    result['errors'] = errors
+    return result
+
+
+def _sizes(value):
+    return [int(size) for size in str(value).split(',') if size.strip()]
+
+
+async def _timed_connects(application, paths, concurrency, subprotocols=None):
+    """Open one WebSocket per path (at most `concurrency` at once); return samples and communicators."""
+    from channels.testing import WebsocketCommunicator
+
+    semaphore = asyncio.Semaphore(concurrency)
+    samples, communicators = [], []
+
+    async def open_one(path):
+        async with semaphore:
+            communicator = WebsocketCommunicator(application, path, subprotocols=subprotocols)
+            start = time.perf_counter()
+            connected, _ = await communicator.connect()
+            samples.append(time.perf_counter() - start)
+            if connected:
+                communicators.append(communicator)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(open_one(path) for path in paths))
+    return samples, time.perf_counter() - started, communicators
+
+
+async def _close_all(communicators):
+    await asyncio.gather(*(communicator.disconnect() for communicator in communicators))
+
+
+def _run_sqlite_workload(path, pragmas, readers, writers, duration):
+    """Hammer a SQLite file with concurrent readers and writers for `duration` seconds."""
+    setup = sqlite3.connect(path)
+    setup.execute('CREATE TABLE IF NOT EXISTS messages '
+                  '(id INTEGER PRIMARY KEY, room_id INTEGER, content TEXT, timestamp REAL)')
+    setup.execute('CREATE INDEX IF NOT EXISTS messages_room_ts ON messages (room_id, timestamp)')
+    setup.commit()
+    setup.close()
+
+    read_samples, write_samples, errors = [], [], []
+    deadline = time.perf_counter() + duration
+
+    def connect():
+        # Baseline mirrors Django's defaults: deferred transactions, 5s busy handler
+        conn = sqlite3.connect(path, timeout=5, isolation_level='IMMEDIATE' if pragmas else 'DEFERRED')
+        for statement in sqlite_pragma_statements(pragmas):
+            conn.execute(statement)
+        return conn
+
+    def writer(worker_id):
+        conn = connect()
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                conn.execute('INSERT INTO messages (room_id, content, timestamp) VALUES (?, ?, ?)',
+                             (worker_id % 4, 'x' * 120, time.time()))
+                conn.commit()
+                write_samples.append(time.perf_counter() - start)
+            except sqlite3.OperationalError as exc:
+                conn.rollback()
+                errors.append(str(exc))
+        conn.close()
+
+    def reader(worker_id):
+        conn = connect()
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                conn.execute('SELECT id, content FROM messages WHERE room_id = ? '
+                             'ORDER BY timestamp DESC LIMIT 50', (worker_id % 4,)).fetchall()
+                read_samples.append(time.perf_counter() - start)
+            except sqlite3.OperationalError as exc:
+                errors.append(str(exc))
+        conn.close()
+
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+    threads += [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return {
+        'reads': summarize(read_samples, elapsed),
+        'writes': summarize(write_samples, elapsed),
+        'errors': len(errors),
+    }
+
+
+@scenario('sqlite_concurrency')
+def sqlite_concurrency(options):
+    """Compare concurrent reader/writer throughput with and without SQLITE_PRAGMAS."""
+    results = {}
+    profiles = {'default': {}, 'tuned': settings.SQLITE_PRAGMAS}
+    for label, pragmas in profiles.items():
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'bench.sqlite3')
+            results[label] = _run_sqlite_workload(
+                path, pragmas, options['readers'], options['writers'], options['duration'],
+            )
+    return results
+
+
+@scenario('connect_storm')
+def connect_storm(options):
+    """Measure ChatConsumer connects/sec for cold connects, reconnect storms and rejected tokens."""
+    from channels.routing import URLRouter
+    from .models import Room, Session
+    from .routing import websocket_urlpatterns
+
+    count = options['connections']
+    with scratch_database():
+        owner = Session.objects.create(nickname='bench-owner')
+        room = Room.objects.create(name='bench', owner_session=owner)
+        sessions = Session.objects.bulk_create(Session(nickname=f'user{i}') for i in range(count))
+        valid_paths = [f'/ws/chat/{room.code}/?token={session.session_token}' for session in sessions]
+        unknown_paths = [f'/ws/chat/{room.code}/?token={uuid.uuid4()}' for _ in range(count)]
+        application = URLRouter(websocket_urlpatterns)
+
+        async def storm():
+            results = {}
+            cache.clear()
+            samples, elapsed, open_sockets = await _timed_connects(application, valid_paths, options['concurrency'])
+            results['cold_connect'] = summarize(samples, elapsed)
+            await _close_all(open_sockets)
+
+            # Every client reconnects at once, as after a deploy or network blip
+            samples, elapsed, open_sockets = await _timed_connects(application, valid_paths, options['concurrency'])
+            results['reconnect_storm'] = summarize(samples, elapsed)
+            results['accepted'] = len(open_sockets)
+            await _close_all(open_sockets)
+
+            await _timed_connects(application, unknown_paths, options['concurrency'])
+            samples, elapsed, _ = await _timed_connects(application, unknown_paths, options['concurrency'])
+            results['rejected_token'] = summarize(samples, elapsed)
+            return results
+
+        return asyncio.run(storm())
+
+
+@scenario('spam_filter')
+def spam_filter(options):
+    """Per-message latency of the configured spam pipeline over a mixed workload."""
+    from .spam import SpamPipeline
+
+    pipeline = SpamPipeline.from_settings()
+    workload = [
+        'hello there, how is everyone doing today?',
+        'check https://a.example https://b.example https://c.example https://d.example',
+        'buy now!!!!!!!!!!!!!!!!!!!!!!!!!!',
+        'x' * 1000,
+        'the same message again',
+    ]
+    samples = []
+    sessions = max(1, options['connections'])
+    started = time.perf_counter()
+    for i in range(options['messages']):
+        content = workload[i % len(workload)] if i % 7 else f'unique message number {i}'
+        start = time.perf_counter()
+        pipeline.check(f'session-{i % sessions}', f'ROOM{i % 50:02d}', content)
+        samples.append(time.perf_counter() - start)
+    result = summarize(samples, time.perf_counter() - started)
+    result['budget_p99_ms'] = 1.0
+    result['within_budget'] = result['p99_ms'] < 1.0
+    return result
+
+
+@scenario('create_session')
+def create_session(options):
+    """POST /api/session/create/ through the full middleware stack."""
+    with scratch_database(), rest_client() as client:
+        return _timed_requests(options['requests'], lambda i: client.post(
+            '/api/session/create/', {'nickname': f'bench{i}'},
+            content_type='application/json', REMOTE_ADDR=client_ip(i),
+        ))
+
+
+@scenario('join_room')
+def join_room(options):
+    """POST /api/rooms/join/ for an existing room."""
+    from .models import Room, Session
+
+    with scratch_database(), rest_client() as client:
+        owner = Session.objects.create(nickname='bench-owner')
+        room = Room.objects.create(name='bench', owner_session=owner)
+        sessions = Session.objects.bulk_create(Session(nickname=f'user{i}') for i in range(options['requests']))
+        return _timed_requests(options['requests'], lambda i: client.post(
+            '/api/rooms/join/', {'room_code': room.code},
+            content_type='application/json', REMOTE_ADDR=client_ip(i),
+            HTTP_X_SESSION_TOKEN=str(sessions[i].session_token),
+        ))
+
+
+@scenario('get_room_messages')
+def get_room_messages(options):
+    """GET /api/rooms/<code>/messages/ first and last page for each --history-sizes room."""
+    from .models import Message, Room, Session
+
+    results = {}
+    with scratch_database(), rest_client() as client:
+        sender = Session.objects.create(nickname='bench-sender')
+        for size in _sizes(options['history_sizes']):
+            room = Room.objects.create(name=f'bench {size}', owner_session=sender)
+            for offset in range(0, size, 5000):
+                Message.objects.for_room(room).bulk_create(
+                    Message(room=room, session=sender, content=f'history message {n}')
+                    for n in range(offset, min(size, offset + 5000))
+                )
+            path = f'/api/rooms/{room.code}/messages/'
+            last_page = max(1, math.ceil(size / 50))
+            results[str(size)] = {
+                'first_page': _timed_requests(options['requests'], lambda i: client.get(
+                    path, {'page': 1, 'page_size': 50}, REMOTE_ADDR=client_ip(i),
+                )),
+                'last_page': _timed_requests(options['requests'], lambda i: client.get(
+                    path, {'page': last_page, 'page_size': 50}, REMOTE_ADDR=client_ip(i),
+                )),
+            }
+    return results
+
+
+@scenario('send_message')
+def send_message(options):
+    """POST /api/messages/send/, spread over rooms and sessions to stay under spam limits."""
+    from .models import Room, Session
+
+    count = options['requests']
+    with scratch_database(), rest_client() as client:
+        sessions = Session.objects.bulk_create(Session(nickname=f'user{i}') for i in range(50))
+        # RoomBurstFilter allows 30 messages per room per window by default
+        rooms = [Room.objects.create(name=f'bench {i}', owner_session=sessions[0])
+                 for i in range(max(1, math.ceil(count / 25)))]
+        cache.clear()
+        return _timed_requests(count, lambda i: client.post(
+            '/api/messages/send/',
+            {'room_code': rooms[i % len(rooms)].code, 'content': f'benchmark message {i}'},
+            content_type='application/json', REMOTE_ADDR=client_ip(i),
+            HTTP_X_SESSION_TOKEN=str(sessions[i % len(sessions)].session_token),
+        ))
+
+
+@scenario('fanout')
+def fanout(options):
+    """ChatConsumer broadcast latency to every socket in rooms of --fanout-sizes sockets."""
+    from channels.routing import URLRouter
+    from .models import Room, Session
+    from .protocol import CODECS
+    from .routing import websocket_urlpatterns
+
+    application = URLRouter(websocket_urlpatterns)
+    messages = options['fanout_messages']
+    subprotocol = options.get('subprotocol') or 'messenger.json'
+    if subprotocol not in CODECS:
+        return {'error': f'Unavailable subprotocol: {subprotocol}; available: {", ".join(CODECS)}'}
+    codec = CODECS[subprotocol]
+
+    async def measure(paths):
+        samples, connect_elapsed, sockets = await _timed_connects(
+            application, paths, options['concurrency'], subprotocols=[subprotocol],
+        )
+        delivery, complete, frame_bytes = [], [], []
+
+        async def receive(socket):
+            # Skip roster updates from sockets still joining
+            while True:
+                output = await socket.receive_output(timeout=30)
+                if codec.decode(output.get('text'), output.get('bytes'))['type'] == 'chat_message':
+                    break
+            frame_bytes.append(len((output.get('text') or '').encode()) or len(output.get('bytes') or b''))
+            return time.perf_counter()
+
+        started = time.perf_counter()
+        for i in range(messages):
+            # Rotate senders to stay under the per-session WebSocket rate limit
+            sender = sockets[i % len(sockets)]
+            sent = time.perf_counter()
+            frame = {'type': 'chat_message', 'content': f'fanout message {i}'}
+            text_data, bytes_data = codec.serialize(codec.to_wire(frame))
+            await sender.send_to(text_data=text_data, bytes_data=bytes_data)
+            received = await asyncio.gather(*(receive(socket) for socket in sockets))
+            delivery.extend(at - sent for at in received)
+            complete.append(max(received) - sent)
+        elapsed = time.perf_counter() - started
+        await _close_all(sockets)
+        return {
+            'sockets': len(sockets),
+            'subprotocol': subprotocol,
+            'bytes_per_frame': round(sum(frame_bytes) / len(frame_bytes), 1) if frame_bytes else None,
+            'connect': summarize(samples, connect_elapsed),
+            'broadcast': summarize(complete, elapsed),
+            'delivery': summarize(delivery, elapsed),
+        }
+
+    results = {}
+    with scratch_database():
+        for size in _sizes(options['fanout_sizes']):
+            cache.clear()
+            owner = Session.objects.create(nickname='bench-owner')
+            room = Room.objects.create(name=f'fanout {size}', owner_session=owner)
+            sessions = Session.objects.bulk_create(Session(nickname=f'fan{size}-{i}') for i in range(size))
+            paths = [f'/ws/chat/{room.code}/?token={session.session_token}' for session in sessions]
+            results[str(size)] = asyncio.run(measure(paths))
+    return results
+
+
+def channel_layer_configs():
+    """Layer configurations group_send compares: in-memory, plus Redis variants for the configured hosts."""
+    default = settings.CHANNEL_LAYERS['default']
+    hosts = default.get('CONFIG', {}).get('hosts', [])
+    options = {
+        'capacity': settings.CHANNEL_LAYER_CAPACITY,
+        'expiry': settings.CHANNEL_LAYER_EXPIRY,
+        'group_expiry': settings.CHANNEL_LAYER_GROUP_EXPIRY,
+    }
+    configs = {'memory': ('channels.layers.InMemoryChannelLayer', options)}
+    if hosts:
+        configs['redis'] = ('channels_redis.core.RedisChannelLayer', {'hosts': hosts[:1], **options})
+        if len(hosts) > 1:
+            configs['redis_sharded'] = ('channels_redis.core.RedisChannelLayer', {'hosts': hosts, **options})
+        configs['redis_pubsub'] = ('channels_redis.pubsub.RedisPubSubChannelLayer', {'hosts': hosts})
+    return configs
+
+
+async def _measure_group_send(layer, size, messages, stall_timeout=2.0):
+    """group_send `messages` events to a group of `size` channels that drain concurrently."""
+    group = f'bench-{uuid.uuid4().hex}'
+    channels = [await layer.new_channel() for _ in range(size)]
+    await asyncio.gather(*(layer.group_add(group, channel) for channel in channels))
+    counts = [0] * size
+    last_received = [0.0]
+
+    async def drain(index, channel):
+        while counts[index] < messages:
+            await layer.receive(channel)
+            counts[index] += 1
+            last_received[0] = time.perf_counter()
+
+    receivers = {asyncio.ensure_future(drain(index, channel)) for index, channel in enumerate(channels)}
+    # Let receivers subscribe (pub/sub) or start polling before the first send
+    await asyncio.sleep(0.1)
+    samples = []
+    started = time.perf_counter()
+    for i in range(messages):
+        start = time.perf_counter()
+        await layer.group_send(group, {
+            'type': 'chat_message',
+            'message': {'id': i, 'session_nickname': 'bench', 'content': 'x' * 100},
+        })
+        samples.append(time.perf_counter() - start)
+    send_elapsed = time.perf_counter() - started
+
+    # Events still missing once deliveries stall were dropped (capacity, expiry)
+    pending, delivered = receivers, -1
+    while pending and sum(counts) != delivered:
+        delivered = sum(counts)
+        _, pending = await asyncio.wait(pending, timeout=stall_timeout)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    delivered = sum(counts)
+    await asyncio.gather(*(layer.group_discard(group, channel) for channel in channels))
+    deliver_elapsed = last_received[0] - started if delivered else 0.0
+    return {
+        'group_send': summarize(samples, send_elapsed),
+        'deliveries_per_sec': round(delivered / deliver_elapsed, 1) if deliver_elapsed else 0.0,
+        'delivered': delivered,
+        'dropped': size * messages - delivered,
+    }
+
+
+@scenario('group_send')
+def group_send(options):
+    """Channel-layer group_send throughput and drops for groups of --group-sizes channels, per layer config."""
+    from django.utils.module_loading import import_string
+
+    configs = channel_layer_configs()
+    names = [name for name in str(options['layers'] or ','.join(configs)).split(',') if name]
+    unknown = [name for name in names if name not in configs]
+    if unknown:
+        return {'error': f'Unavailable layer config(s): {", ".join(unknown)}; set REDIS_URLS for Redis ones'}
+
+    results = {}
+    for name in names:
+        backend, config = configs[name]
+        results[name] = {'backend': backend.rsplit('.', 1)[-1], 'hosts': len(config.get('hosts', ())) or None}
+        for size in _sizes(options['group_sizes']):
+            layer_config = dict(config)
+            if 'hosts' in config:
+                # A fresh prefix keeps runs apart and lets flush() clear only this run's keys
+                layer_config['prefix'] = f'bench{uuid.uuid4().hex[:8]}'
+            layer = import_string(backend)(**layer_config)
+
+            async def run():
+                try:
+                    return await _measure_group_send(layer, size, options['group_messages'])
+                finally:
+                    await layer.flush()
+
+            results[name][str(size)] = asyncio.run(run())
+    return results
+
+
+def run_metadata():
+    """Describe the environment a benchmark run was taken in."""
+    import platform
+    import subprocess
+    from django.db import connection
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=settings.BASE_DIR, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'database': connection.vendor,
+        'channel_layer': settings.CHANNEL_LAYERS['default']['BACKEND'].rsplit('.', 1)[-1],
+        'cache': settings.CACHES['default']['BACKEND'].rsplit('.', 1)[-1],
+    }
+
+
+def latency_summaries(results, prefix=''):
+    """Yield (path, summary) for every summarize() dict nested in a result."""
+    for key, value in results.items():
+        if not isinstance(value, dict):
+            continue
+        path = f'{prefix}.{key}' if prefix else key
+        if 'p99_ms' in value:
+            yield path, value
+        else:
+            yield from latency_summaries(value, path)
+
+
+def compare_results(baseline, current):
+    """Return rows of (path, metric, before, after, change %) for summaries present in both runs."""
+    before = dict(latency_summaries(baseline))
+    rows = []
+    for path, summary in latency_summaries(current):
+        if path not in before:
+            continue
+        for metric in ('ops_per_sec', 'p50_ms', 'p95_ms', 'p99_ms'):
+            old, new = before[path].get(metric), summary.get(metric)
+            if old is None or new is None:
+                continue
+            change = round((new - old) / old * 100, 1) if old else 0.0
+            rows.append((path, metric, old, new, change))
+    return rows
@@ -1,10 +1,62 @@
-import json
+import asyncio
+import logging
+import time
+import weakref
+from collections import Counter
+from functools import partial
+from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from django.conf import settings
 from django.core.cache import cache
 from django.utils import timezone
 from .models import Session, Room, Message, AuditLog
-from .utils import sanitize_input, log_audit_event
+from .utils import (
+    sanitize_input, log_audit_event, parse_session_token, is_token_denied,
+    get_cached_session, get_cached_room, touch_session, get_scope_client_ip,
+)
+from .routers import mark_recent_write, read_from_replica
+from .moderation import banned_tokens, ip_bans, session_group_name
+from .spam import spam_pipeline, ALLOW, SHADOW_DROP, THROTTLE
+from .archive import ensure_hot
+from .drain import is_draining, open_consumers
+from .fanout import get_room_fanout
+from .protocol import ProtocolError, negotiate
+from . import roster
+from .outbox import Outbox, SLOW_CONSUMER_CLOSE_CODE, WS_SLOW_CONSUMERS
+from .tracing import mark_persisted, record_broadcast, record_delivery, start_trace
+from .metrics import (
+    MESSAGES, REJECTED_REQUESTS, SPAM_ACTIONS, WS_BROADCAST_SECONDS, WS_CONNECTED, WS_CONNECTS, WS_DISCONNECTS,
+    WS_BYTES_OUT, WS_FRAMES_IN, WS_FRAMES_OUT,
+)
+
+logger = logging.getLogger(__name__)
+
+# Read-only lookups that may run concurrently in worker threads
+parallel_database_sync_to_async = partial(database_sync_to_async, thread_sensitive=False)
+
+# One roster heartbeat task per event loop, started by the first socket to join a roster
+_roster_heartbeats = weakref.WeakKeyDictionary()
+
+
+def start_roster_heartbeat():
+    loop = asyncio.get_running_loop()
+    if loop not in _roster_heartbeats:
+        _roster_heartbeats[loop] = asyncio.ensure_future(roster_heartbeat())
+
+
+async def roster_heartbeat():
+    """Refresh the roster connection counts of this worker's sockets before they expire."""
+    while True:
+        await asyncio.sleep(settings.ROOM_ROSTER_HEARTBEAT)
+        held = Counter(
+            (consumer.room_code, consumer.participant_id, consumer.session.nickname)
+            for consumer in list(open_consumers) if getattr(consumer, 'in_roster', False)
+        )
+        try:
+            await parallel_database_sync_to_async(roster.heartbeat)(held)
+        except Exception:
+            logger.exception('Roster heartbeat failed; retrying')
 
 
 class ChatConsumer(AsyncWebsocketConsumer):
@@ -13,93 +65,174 @@ class ChatConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         """Handle WebSocket connection."""
         self.room_code = self.scope['url_route']['kwargs']['room_code']
-        # Parse query string for session token
-        query_string = self.scope.get('query_string', b'').decode()
-        self.session_token = None
-        for param in query_string.split('&'):
-            if param.startswith('token='):
-                self.session_token = param.split('=', 1)[1]
-                break
-        
-        # Validate session
-        self.session = await self.get_session(self.session_token)
-        if not self.session:
+        
+        # Reject banned addresses/networks before any other work
+        if ip_bans.is_stale():
+            await parallel_database_sync_to_async(ip_bans.refresh)()
+        client_ip = get_scope_client_ip(self.scope)
+        if client_ip and ip_bans.is_banned(client_ip):
+            WS_CONNECTS.inc(result='ip_ban')
+            REJECTED_REQUESTS.inc(reason='ip_ban', scope='websocket')
+            await self.close()
+            return
+        
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        self.session_token = parse_session_token(query.get('token', [None])[0])
+        
+        # Reject malformed and recently denied tokens without touching the DB
+        if not self.session_token or await parallel_database_sync_to_async(is_token_denied)(self.session_token):
+            WS_CONNECTS.inc(result='bad_token')
             await self.close()
             return
         
-        # Get room
-        self.room = await self.get_room(self.room_code)
-        if not self.room or not self.room.is_active:
+        # Resolve session and room concurrently (cache first, then DB)
+        self.session, self.room = await asyncio.gather(
+            self.get_session(self.session_token),
+            self.get_room(self.room_code),
+        )
+        # get_cached_session() already rejects banned and expired sessions
+        if not self.session or not self.room:
+            WS_CONNECTS.inc(result='no_session' if not self.session else 'no_room')
             await self.close()
             return
         
-        # Check if session is banned
-        if self.session.is_banned:
-            if self.session.banned_until and self.session.banned_until > timezone.now():
-                await self.close()
-                return
-            elif not self.session.banned_until:  # Permanent ban
-                await self.close()
-                return
-        
-        # Join room group
-        self.room_group_name = f'chat_{self.room_code}'
+        # Room events are queued per socket so a slow reader cannot stall this consumer
+        self.outbox = Outbox(self.write_frame, self.slow_consumer, self.write_failed,
+                             settings.WS_OUTBOX_SIZE, settings.WS_OUTBOX_POLICY)
+        
+        # A draining worker takes no new sockets; the client retries another one
+        if is_draining():
+            WS_CONNECTS.inc(result='draining')
+            await self.close()
+            return
+        
+        # Short per-room id that room frames use instead of the nickname (see messenger.roster)
+        self.participant_id = await parallel_database_sync_to_async(roster.assign_participant_id)(
+            self.room_code, self.session,
+        )
+        
+        # Frame encoding from the client's offered subprotocols (see messenger.protocol)
+        offered = self.scope.get('subprotocols', [])
+        self.codec = negotiate(offered)
+        await self.accept(subprotocol=self.codec.subprotocol if self.codec.subprotocol in offered else None)
+        WS_CONNECTS.inc(result='accepted')
+        WS_CONNECTED.inc()
+        open_consumers.add(self)
+        
+        # Join the room (local fan-out registry), plus the session group used to revoke it on ban.
+        # Only after accept(): the local fan-out calls this consumer's handlers as soon as it joins,
+        # and the frames they queue are written straight away
+        self.room_fanout = get_room_fanout()
+        self.session_group_name = session_group_name(self.session_token)
+        await self.room_fanout.join(self.room_code, self)
         await self.channel_layer.group_add(
-            self.room_group_name,
+            self.session_group_name,
             self.channel_name
         )
+        await self.join_roster()
         
-        await self.accept()
-        
-        # Log connection
+        # Defer last_active and audit writes until after the handshake
+        self.connect_task = asyncio.ensure_future(self.record_connect())
+    
+    async def join_roster(self):
+        """Send this socket the room roster; announce the participant if this is its first connection."""
+        self.in_roster = True
+        start_roster_heartbeat()
+        joined = await parallel_database_sync_to_async(roster.join)(
+            self.room_code, self.participant_id, self.session.nickname,
+        )
+        participants = await parallel_database_sync_to_async(roster.snapshot)(self.room_code)
+        await self.send_frame({
+            'type': 'roster',
+            'participant_id': self.participant_id,
+            'participants': participants,
+        })
+        if joined:
+            await self.room_fanout.broadcast(self.room_code, {
+                'type': 'participant_joined',
+                'participant_id': self.participant_id,
+                'nickname': self.session.nickname,
+            })
+    
+    async def leave_roster(self):
+        """Announce the participant's departure once its last connection to the room closes."""
+        self.in_roster = False
+        if await parallel_database_sync_to_async(roster.leave)(self.room_code, self.participant_id):
+            await self.room_fanout.broadcast(self.room_code, {
+                'type': 'participant_left',
+                'participant_id': self.participant_id,
+            })
+    
+    async def record_connect(self):
+        """Update session activity and log the join outside the connect path."""
+        await database_sync_to_async(touch_session)(self.session)
         await self.log_audit_async('room_join', self.session, self.room)
     
     async def disconnect(self, close_code):
         """Handle WebSocket disconnection."""
-        if hasattr(self, 'room_group_name'):
+        open_consumers.discard(self)
+        if hasattr(self, 'outbox'):
+            self.outbox.close()
+        if hasattr(self, 'room_fanout'):
+            WS_DISCONNECTS.inc()
+            WS_CONNECTED.dec()
+            await self.room_fanout.leave(self.room_code, self)
             await self.channel_layer.group_discard(
-                self.room_group_name,
+                self.session_group_name,
                 self.channel_name
             )
+            if getattr(self, 'in_roster', False):
+                await self.leave_roster()
     
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
         """Handle message received from WebSocket."""
+        trace = start_trace()
+        # Backstop for missed revocations: in-memory lookup, refreshed periodically
+        if banned_tokens.is_stale():
+            await parallel_database_sync_to_async(banned_tokens.refresh)()
+        if self.session_token in banned_tokens:
+            await self.session_revoked({})
+            return
+        
         try:
-            data = json.loads(text_data)
+            data = self.codec.decode(text_data, bytes_data)
             message_type = data.get('type')
+            WS_FRAMES_IN.inc(type=message_type if message_type in ('chat_message', 'typing') else 'other')
             
             if message_type == 'chat_message':
-                await self.handle_chat_message(data)
+                await self.handle_chat_message(data, trace)
             elif message_type == 'typing':
                 await self.handle_typing(data)
-        except json.JSONDecodeError:
-            await self.send(text_data=json.dumps({
+        except ProtocolError:
+            WS_FRAMES_IN.inc(type='invalid')
+            await self.send_frame({
                 'type': 'error',
-                'message': 'Invalid JSON format'
-            }))
+                'message': 'Invalid message format'
+            })
     
-    async def handle_chat_message(self, data):
+    async def handle_chat_message(self, data, trace=None):
         """Handle incoming chat message."""
         content = data.get('content', '').strip()
         
         # Validate and sanitize
         if not content or len(content) > 1000:
-            await self.send(text_data=json.dumps({
+            await self.send_frame({
                 'type': 'error',
                 'message': 'Invalid message content'
-            }))
+            })
             return
         
         # Rate limiting check
         cache_key = f"ratelimit:ws:{self.session.session_token}"
         count = cache.get(cache_key, 0)
         if count >= 10:  # 10 messages per minute
+            REJECTED_REQUESTS.inc(reason='rate_limit', scope='websocket')
             await self.log_audit_async('rate_limit', self.session, self.room, 
                                       {'source': 'websocket'})
-            await self.send(text_data=json.dumps({
+            await self.send_frame({
                 'type': 'error',
                 'message': 'Rate limit exceeded. Please slow down.'
-            }))
+            })
             return
         
         cache.set(cache_key, count + 1, 60)  # 60 seconds
@@ -107,23 +240,55 @@ class ChatConsumer(AsyncWebsocketConsumer):
         # Sanitize content
         sanitized_content = sanitize_input(content, max_length=1000)
         
+        # Spam scoring (in-memory, bounded work per message); off the event loop, as check() takes a lock
+        action, reasons = await parallel_database_sync_to_async(spam_pipeline.check)(
+            self.session_token, self.room_code, sanitized_content,
+        )
+        if action != ALLOW:
+            SPAM_ACTIONS.inc(action=action, source='websocket')
+        if action == THROTTLE:
+            await self.log_audit_async('rate_limit', self.session, self.room,
+                                      {'source': 'spam', 'reasons': reasons})
+            await self.send_frame({
+                'type': 'error',
+                'message': 'Message looks like spam. Please slow down.'
+            })
+            return
+        if action == SHADOW_DROP:
+            # Echo to the sender only; nothing is stored or broadcast
+            logger.info('Shadow-dropped message from %s in %s: %s', self.session_token, self.room_code, reasons)
+            await self.chat_message({'message': {
+                'id': None,
+                'participant_id': self.participant_id,
+                'session_nickname': self.session.nickname,
+                'content': sanitized_content,
+                'timestamp': timezone.now().isoformat(),
+            }})
+            return
+        
         # Save message to database
         message = await self.save_message(sanitized_content)
         
         if message:
+            MESSAGES.inc(source='websocket')
+            span = mark_persisted(trace, self.room_code)
             # Broadcast message to room group
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'chat_message',
-                    'message': {
-                        'id': message['id'],
-                        'session_nickname': self.session.nickname,
-                        'content': sanitized_content,
-                        'timestamp': message['timestamp'],
+            with WS_BROADCAST_SECONDS.time():
+                await self.room_fanout.broadcast(
+                    self.room_code,
+                    {
+                        'type': 'chat_message',
+                        'message': {
+                            'id': message['id'],
+                            'participant_id': self.participant_id,
+                            'session_nickname': self.session.nickname,
+                            'content': sanitized_content,
+                            'timestamp': message['timestamp'],
+                        },
+                        'trace': trace,
                     }
-                }
-            )
+                )
+            record_broadcast(trace, span)
             
             # Log message sent
             await self.log_audit_async('message_send', self.session, self.room)
@@ -131,62 +296,118 @@ class ChatConsumer(AsyncWebsocketConsumer):
     async def handle_typing(self, data):
         """Handle typing indicator."""
         # Broadcast typing indicator to room group (excluding sender)
-        await self.channel_layer.group_send(
-            self.room_group_name,
+        await self.room_fanout.broadcast(
+            self.room_code,
             {
                 'type': 'typing_indicator',
+                'participant_id': self.participant_id,
                 'nickname': self.session.nickname,
                 'is_typing': data.get('is_typing', False)
             }
         )
     
+    async def send_frame(self, frame, key=None, on_sent=None):
+        """Queue one frame for this socket; frames with the same key may be coalesced."""
+        self.outbox.put(frame, key, on_sent)
+    
+    async def write_frame(self, frame):
+        """Encode and send one frame to this socket."""
+        WS_FRAMES_OUT.inc(type=frame['type'])
+        text_data, bytes_data = self.codec.encode(frame)
+        WS_BYTES_OUT.inc(len(text_data) if text_data is not None else len(bytes_data), protocol=self.codec.subprotocol)
+        await self.send(text_data=text_data, bytes_data=bytes_data)
+    
+    def write_failed(self):
+        """The outbox writer stopped on an error; close rather than keep a socket that gets no frames."""
+        asyncio.ensure_future(self.close_after_write_error())
+    
+    async def close_after_write_error(self):
+        try:
+            await self.close(code=1011)
+        except Exception:
+            # Usually the client is already gone
+            logger.debug('Could not close socket after a failed write', exc_info=True)
+    
+    def slow_consumer(self):
+        """Outbox overflow under the disconnect policy."""
+        WS_SLOW_CONSUMERS.inc()
+        asyncio.ensure_future(self.close_slow_consumer())
+    
+    async def close_slow_consumer(self):
+        """Tell the client where its stream stopped, then close; it reloads history and reconnects."""
+        await self.write_frame({
+            'type': 'resync',
+            'reason': 'slow_consumer',
+            'last_message_id': self.outbox.last_message_id,
+        })
+        await self.close(code=SLOW_CONSUMER_CLOSE_CODE)
+    
     async def chat_message(self, event):
         """Send message to WebSocket."""
-        await self.send(text_data=json.dumps({
+        trace = event.get('trace')
+        await self.send_frame({
             'type': 'chat_message',
             'data': event['message']
-        }))
+        }, on_sent=trace and partial(record_delivery, trace, time.time(), self.room_code))
+    
+    async def session_revoked(self, event):
+        """Close the socket after the session was banned."""
+        # Bypasses the outbox so the notice is written before the close
+        await self.write_frame({
+            'type': 'error',
+            'message': 'Your session has been banned.'
+        })
+        await self.close(code=4003)
     
     async def typing_indicator(self, event):
         """Send typing indicator to WebSocket."""
         # Don't send typing indicator back to the sender
-        if event['nickname'] != self.session.nickname:
-            await self.send(text_data=json.dumps({
+        if event['participant_id'] != self.participant_id:
+            await self.send_frame({
                 'type': 'typing',
+                'participant_id': event['participant_id'],
                 'nickname': event['nickname'],
                 'is_typing': event['is_typing']
-            }))
+            }, key=('typing', event['participant_id']))
     
-    @database_sync_to_async
+    async def participant_joined(self, event):
+        """Add a participant to this socket's roster."""
+        if event['participant_id'] != self.participant_id:
+            await self.send_frame({
+                'type': 'participant_joined',
+                'participant_id': event['participant_id'],
+                'nickname': event['nickname'],
+            }, key=('participant', event['participant_id']))
+    
+    async def participant_left(self, event):
+        """Remove a participant from this socket's roster."""
+        if event['participant_id'] != self.participant_id:
+            await self.send_frame({
+                'type': 'participant_left',
+                'participant_id': event['participant_id'],
+            }, key=('participant', event['participant_id']))
+    
+    @parallel_database_sync_to_async
     def get_session(self, token):
-        """Get session from token."""
-        try:
-            session = Session.objects.get(session_token=token)
-            if not session.is_active():
-                return None
-            # Update last_active
-            session.last_active = timezone.now()
-            session.save(update_fields=['last_active'])
-            return session
-        except Session.DoesNotExist:
-            return None
+        """Get an active session from token."""
+        return get_cached_session(token)
     
-    @database_sync_to_async
+    @parallel_database_sync_to_async
     def get_room(self, code):
         """Get room by code."""
-        try:
-            return Room.objects.get(code=code, is_active=True)
-        except Room.DoesNotExist:
-            return None
+        with read_from_replica(self.session_token):
+            return get_cached_room(code)
     
     @database_sync_to_async
     def save_message(self, content):
         """Save message to database."""
+        ensure_hot(self.room)
         message = Message.objects.create(
             room=self.room,
             session=self.session,
             content=content
         )
+        mark_recent_write(self.session_token)
         return {
             'id': message.id,
             'timestamp': message.timestamp.isoformat()
@@ -195,9 +416,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
     @database_sync_to_async
     def log_audit_async(self, event_type, session=None, room=None, details=None):
         """Log audit event asynchronously."""
-        ip_address = None
-        if hasattr(self.scope, 'client'):
-            ip_address = self.scope['client'][0] if self.scope.get('client') else None
+        ip_address = get_scope_client_ip(self.scope) or None
         
         AuditLog.objects.create(
             event_type=event_type,
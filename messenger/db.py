@@ -0,0 +1,71 @@
+"""Database connection hooks for the messenger app."""
+import contextvars
+import re
+from contextlib import contextmanager
+from django.conf import settings
+
+ALLOWED_SQLITE_PRAGMAS = {
+    'journal_mode', 'synchronous', 'busy_timeout', 'mmap_size',
+    'cache_size', 'temp_store', 'foreign_keys', 'wal_autocheckpoint',
+}
+_PRAGMA_VALUE = re.compile(r'^-?\w+$')
+
+
+def sqlite_pragma_statements(pragmas):
+    """Build PRAGMA statements for a profile, rejecting unknown names or unsafe values."""
+    statements = []
+    for name, value in pragmas.items():
+        if name not in ALLOWED_SQLITE_PRAGMAS:
+            raise ValueError(f'Unsupported SQLite pragma: {name}')
+        if not _PRAGMA_VALUE.match(str(value)):
+            raise ValueError(f'Invalid value for SQLite pragma {name}: {value!r}')
+        statements.append(f'PRAGMA {name}={value}')
+    return statements
+
+
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    """Apply settings.SQLITE_PRAGMAS to every new SQLite connection."""
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = getattr(settings, 'SQLITE_PRAGMAS', {})
+    if not pragmas:
+        return
+    with connection.cursor() as cursor:
+        for statement in sqlite_pragma_statements(pragmas):
+            cursor.execute(statement)
+
+
+# Models whose auto_now/auto_now_add fields keep assigned values, in the current thread/task
+_preserving = contextvars.ContextVar('preserving_timestamps', default=frozenset())
+
+
+@contextmanager
+def preserve_timestamps(models):
+    """
+    Let copied rows keep their timestamps: auto_now/auto_now_add fields of these
+    models keep the value already set on the instance. Only saves made in the
+    current thread or task are affected, so it is safe inside a running server.
+    """
+    for model in models:
+        _install_timestamp_hook(model)
+    token = _preserving.set(_preserving.get() | {model._meta.concrete_model for model in models})
+    try:
+        yield
+    finally:
+        _preserving.reset(token)
+
+
+def _install_timestamp_hook(model):
+    for field in model._meta.concrete_fields:
+        if not (getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)):
+            continue
+        if getattr(field, '_preserve_hook', False):
+            continue
+
+        def pre_save(model_instance, add, field=field, original=field.pre_save):
+            if model_instance._meta.concrete_model in _preserving.get():
+                return getattr(model_instance, field.attname)
+            return original(model_instance, add)
+
+        field.pre_save = pre_save
+        field._preserve_hook = True
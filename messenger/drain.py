@@ -0,0 +1,106 @@
+"""
+Graceful drain of a worker's WebSockets on shutdown.
+When a worker is told to stop, it first marks itself draining (readiness fails
+and new sockets are refused), queues a `reconnect` frame behind whatever each
+open socket still has buffered, waits for the outboxes to flush, and closes the
+sockets with 1012 (service restart). Clients reconnect after the jittered
+`retry_after_ms` in the frame, landing on the remaining or replacement workers.
+
+Drain runs on SIGTERM/SIGINT ahead of the ASGI server's own handler (so sockets
+are drained before the server starts closing them) and again, as a no-op if
+already done, on ASGI lifespan shutdown. Both need a server that speaks the
+lifespan protocol, such as uvicorn (see config/gunicorn.conf.py); daphne does not.
+"""
+import asyncio
+import logging
+import os
+import random
+import signal
+import threading
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+SERVICE_RESTART_CLOSE_CODE = 1012
+
+open_consumers = set()
+_drained = None
+
+
+def is_draining():
+    return _drained is not None
+
+
+async def drain_connections(reason='server_restart'):
+    """Send every open socket a reconnect hint, flush its outbox and close it. Runs once per process."""
+    global _drained
+    if _drained is not None:
+        await _drained.wait()
+        return
+    _drained = asyncio.Event()
+    consumers = list(open_consumers)
+    logger.info('Draining %d WebSocket connection(s)', len(consumers))
+    try:
+        await asyncio.gather(*(_drain_one(consumer, reason) for consumer in consumers), return_exceptions=True)
+    finally:
+        _drained.set()
+
+
+async def _drain_one(consumer, reason):
+    consumer.outbox.put({
+        'type': 'reconnect',
+        'reason': reason,
+        # Spread reconnects so the remaining workers are not hit all at once
+        'retry_after_ms': random.randint(0, settings.DRAIN_RECONNECT_SPREAD_MS),
+    })
+    try:
+        await asyncio.wait_for(consumer.outbox.flushed(), settings.DRAIN_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.info('Outbox of %s not flushed within %ss', consumer.channel_name, settings.DRAIN_TIMEOUT)
+    consumer.outbox.close(reason='drain')
+    await consumer.close(code=SERVICE_RESTART_CLOSE_CODE)
+
+
+def install_signal_handlers(loop):
+    """Run drain_connections() on SIGTERM/SIGINT before handing the signal to the server."""
+    if threading.current_thread() is not threading.main_thread():
+        return
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        previous = signal.getsignal(signum)
+
+        def handle(signum, frame, previous=previous):
+            if is_draining():
+                # A second signal skips the drain
+                _forward(signum, frame, previous)
+                return
+            loop.call_soon_threadsafe(_drain_then_forward, signum, frame, previous)
+
+        signal.signal(signum, handle)
+
+
+def _drain_then_forward(signum, frame, previous):
+    task = asyncio.ensure_future(drain_connections())
+    task.add_done_callback(lambda _: _forward(signum, frame, previous))
+
+
+def _forward(signum, frame, previous):
+    if callable(previous):
+        previous(signum, frame)
+    elif previous != signal.SIG_IGN:
+        signal.signal(signum, previous)
+        os.kill(os.getpid(), signum)
+
+
+class LifespanApp:
+    """ASGI lifespan handler: install the drain signal handlers, drain on shutdown."""
+
+    async def __call__(self, scope, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                install_signal_handlers(asyncio.get_running_loop())
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await drain_connections()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
@@ -0,0 +1,111 @@
+"""
+Streaming export of room history.
+Messages are read with a server-side cursor and encoded batch by batch, so memory
+use stays flat however large the room is.
+"""
+import csv
+import io
+import json
+import zlib
+from asgiref.sync import sync_to_async
+from django.db import router
+from .archive import archived_export_batches
+from .models import Message, Session
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+EXPORT_FIELDS = ['id', 'timestamp', 'nickname', 'content', 'reported_count']
+EXPORT_CHUNK_SIZE = 1000
+MAX_CACHED_NICKNAMES = 10000
+
+
+def room_export_queryset(room):
+    """Visible messages of a room, oldest first, pinned to the database chosen now."""
+    queryset = Message.objects.for_room(room).filter(is_deleted=False)
+    # Streaming continues after the view returns, outside any read_from_replica() block
+    return queryset.using(queryset.db).order_by('timestamp', 'id').values(
+        'id', 'timestamp', 'session_id', 'content', 'reported_count'
+    )
+
+
+def iter_message_batches(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield lists of export rows, resolving nicknames once per batch."""
+    # Sessions may live on another database than sharded messages, so no join
+    session_db = router.db_for_read(Session) or 'default'
+    nicknames = {}
+    batch = []
+
+    def resolve(rows):
+        missing = {row['session_id'] for row in rows} - nicknames.keys() - {None}
+        if len(nicknames) + len(missing) > MAX_CACHED_NICKNAMES:
+            nicknames.clear()
+        nicknames.update(Session.objects.using(session_db).filter(id__in=missing).values_list('id', 'nickname'))
+        for row in rows:
+            row['nickname'] = nicknames.get(row.pop('session_id'), 'Unknown')
+            row['timestamp'] = row['timestamp'].isoformat()
+        return rows
+
+    for row in queryset.iterator(chunk_size=chunk_size):
+        batch.append(row)
+        if len(batch) >= chunk_size:
+            yield resolve(batch)
+            batch = []
+    if batch:
+        yield resolve(batch)
+
+
+def encode_ndjson(batches):
+    for rows in batches:
+        yield ''.join(json.dumps({field: row[field] for field in EXPORT_FIELDS}) + '\n' for row in rows)
+
+
+def encode_csv(batches):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS, extrasaction='ignore')
+    writer.writeheader()
+    for rows in batches:
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def gzip_stream(chunks, level=6):
+    """Gzip a stream of bytes on the fly."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_room(room, export_format='ndjson', compress=False, chunk_size=EXPORT_CHUNK_SIZE):
+    """Return an iterator of bytes with the room's history in the given format."""
+    encode = encode_csv if export_format == 'csv' else encode_ndjson
+    if room.is_archived:
+        batches = archived_export_batches(room, chunk_size)
+    else:
+        batches = iter_message_batches(room_export_queryset(room), chunk_size)
+    chunks = (text.encode('utf-8') for text in encode(batches))
+    return gzip_stream(chunks) if compress else chunks
+
+
+async def iterate_in_thread(iterator):
+    """
+    Serve a sync iterator to an ASGI response one chunk at a time.
+    Django would otherwise read a sync streaming iterator fully into memory under ASGI.
+    """
+    sentinel = object()
+    # Thread-sensitive so every step uses the same database connection and cursor
+    step = sync_to_async(next, thread_sensitive=True)
+    try:
+        while True:
+            chunk = await step(iterator, sentinel)
+            if chunk is sentinel:
+                return
+            yield chunk
+    finally:
+        await sync_to_async(iterator.close, thread_sensitive=True)()
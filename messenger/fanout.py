@@ -0,0 +1,141 @@
+"""
+Room broadcast with in-process delivery to consumers on the same worker.
+Each worker keeps a registry of its connected ChatConsumers by room. A broadcast
+is handed straight to the local members, then published once to the room's
+channel-layer group, in which each worker (not each socket) holds one membership
+through its relay channel. Every other worker's relay receives the event and
+delivers it to its own members. That makes channel-layer writes per message
+O(workers in the room) instead of O(sockets). With the in-memory layer there are
+no other workers and nothing is published.
+Set WS_LOCAL_FANOUT=False to fall back to one group membership per socket.
+"""
+import asyncio
+import logging
+import weakref
+from channels.layers import InMemoryChannelLayer, get_channel_layer
+from django.conf import settings
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+FANOUT_EVENTS = registry.counter('messenger_fanout_events_total',
+                                 'Room events by how they reached this worker\'s sockets', ['path'])
+
+# One fan-out per event loop: each ASGI worker runs one, tests and benchmarks may start several
+_fanouts = weakref.WeakKeyDictionary()
+
+
+def room_group_name(room_code):
+    return f'chat_{room_code}'
+
+
+def get_room_fanout():
+    """The room fan-out for the running event loop."""
+    loop = asyncio.get_running_loop()
+    fanout = _fanouts.get(loop)
+    if fanout is None:
+        layer = get_channel_layer()
+        fanout = LocalRoomFanout(layer) if settings.WS_LOCAL_FANOUT else ChannelLayerRoomFanout(layer)
+        _fanouts[loop] = fanout
+    return fanout
+
+
+class ChannelLayerRoomFanout:
+    """Every socket is its own group member; the channel layer delivers to each one."""
+
+    def __init__(self, layer):
+        self.layer = layer
+
+    async def join(self, room_code, consumer):
+        await self.layer.group_add(room_group_name(room_code), consumer.channel_name)
+
+    async def leave(self, room_code, consumer):
+        await self.layer.group_discard(room_group_name(room_code), consumer.channel_name)
+
+    async def broadcast(self, room_code, event):
+        await self.layer.group_send(room_group_name(room_code), event)
+
+
+class LocalRoomFanout:
+    """In-process room registry plus one relay channel per worker."""
+
+    def __init__(self, layer):
+        self.layer = layer
+        self.rooms = {}
+        # Membership changes that touch the channel layer must not interleave per room
+        self.lock = asyncio.Lock()
+        self.publish = not isinstance(layer, InMemoryChannelLayer)
+        self.channel = None
+        self.relay_task = None
+        self.refresh_task = None
+
+    async def relay_channel(self):
+        if self.channel is None:
+            self.channel = await self.layer.new_channel('fanout')
+            self.relay_task = asyncio.ensure_future(self.relay())
+            self.refresh_task = asyncio.ensure_future(self.refresh_groups())
+        return self.channel
+
+    async def join(self, room_code, consumer):
+        async with self.lock:
+            members = self.rooms.setdefault(room_code, set())
+            if not members and self.publish:
+                await self.layer.group_add(room_group_name(room_code), await self.relay_channel())
+            members.add(consumer)
+
+    async def leave(self, room_code, consumer):
+        async with self.lock:
+            members = self.rooms.get(room_code)
+            if members is None:
+                return
+            members.discard(consumer)
+            if not members:
+                del self.rooms[room_code]
+                if self.publish:
+                    await self.layer.group_discard(room_group_name(room_code), self.channel)
+
+    async def broadcast(self, room_code, event):
+        await self.deliver(room_code, event, 'local')
+        if self.publish:
+            await self.layer.group_send(room_group_name(room_code), {
+                **event, 'fanout_room': room_code, 'fanout_origin': await self.relay_channel(),
+            })
+            FANOUT_EVENTS.inc(path='published')
+
+    async def deliver(self, room_code, event, path):
+        """Hand an event to every local member of the room (handlers only queue frames)."""
+        handler_name = event['type'].replace('.', '_')
+        for consumer in list(self.rooms.get(room_code, ())):
+            try:
+                await getattr(consumer, handler_name)(event)
+            except Exception:
+                logger.exception('Room event %s not delivered to %s', event['type'], consumer.channel_name)
+        FANOUT_EVENTS.inc(path=path)
+
+    async def relay(self):
+        """Deliver events published by other workers to this worker's members."""
+        while True:
+            try:
+                event = await self.layer.receive(self.channel)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('Fan-out relay receive failed; retrying')
+                await asyncio.sleep(1)
+                continue
+            # Our own publishes were already delivered locally
+            if event.get('fanout_origin') != self.channel:
+                await self.deliver(event['fanout_room'], event, 'relayed')
+
+    async def refresh_groups(self):
+        """Re-add this worker's memberships before the layer's group_expiry drops them."""
+        while True:
+            await asyncio.sleep(settings.CHANNEL_LAYER_GROUP_EXPIRY / 2)
+            for room_code in list(self.rooms):
+                async with self.lock:
+                    if room_code not in self.rooms:
+                        continue
+                    try:
+                        await self.layer.group_add(room_group_name(room_code), self.channel)
+                    except Exception:
+                        logger.exception('Could not refresh fan-out group for room %s', room_code)
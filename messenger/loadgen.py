@@ -0,0 +1,311 @@
+"""
+Synthetic traffic for capacity planning, driven by the `loadgen` command.
+Each simulated client creates a session and joins a room over the real REST
+endpoints, then holds a ws/chat/<code>/ socket, sending messages and typing
+events at random (Poisson) intervals and reconnecting with the configured churn.
+The WebSocket client needs the optional `websockets` package.
+"""
+import asyncio
+import json
+import math
+import random
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from dataclasses import dataclass
+
+try:
+    import websockets
+except ImportError:  # optional; only the loadgen command needs it
+    websockets = None
+
+
+class LatencyHistogram:
+    """Fixed log-spaced buckets: constant memory however many samples are recorded."""
+    BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS_MS) + 1)
+        self.total = 0
+
+    def record(self, seconds):
+        ms = seconds * 1000
+        for index, bound in enumerate(self.BOUNDS_MS):
+            if ms <= bound:
+                break
+        else:
+            index = len(self.BOUNDS_MS)
+        self.counts[index] += 1
+        self.total += 1
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.total += other.total
+
+    def percentile(self, fraction):
+        """Upper bound (ms) of the bucket holding the given fraction of samples."""
+        if not self.total:
+            return 0
+        target = math.ceil(fraction * self.total)
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return self.BOUNDS_MS[index] if index < len(self.BOUNDS_MS) else math.inf
+        return math.inf
+
+    def summary(self):
+        return {
+            'count': self.total,
+            'p50_ms': self.percentile(0.50),
+            'p95_ms': self.percentile(0.95),
+            'p99_ms': self.percentile(0.99),
+        }
+
+    def render(self, width=40):
+        """ASCII bar chart, one line per non-empty bucket."""
+        peak = max(self.counts) or 1
+        lines = []
+        for index, count in enumerate(self.counts):
+            if not count:
+                continue
+            label = f'<={self.BOUNDS_MS[index]}ms' if index < len(self.BOUNDS_MS) else f'>{self.BOUNDS_MS[-1]}ms'
+            lines.append(f'{label:>9} {"#" * max(1, round(count / peak * width)):<{width}} {count}')
+        return lines
+
+
+class LoadStats:
+    """Counters and histograms for the current reporting interval and the whole run."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.interval_started = self.started
+        self.connected = 0
+        self.interval_counters = Counter()
+        self.total_counters = Counter()
+        self.interval_histograms = {}
+        self.total_histograms = {}
+
+    def count(self, name, amount=1):
+        self.interval_counters[name] += amount
+
+    def observe(self, name, seconds):
+        self.interval_histograms.setdefault(name, LatencyHistogram()).record(seconds)
+
+    def rotate(self):
+        """Close the current interval; return (elapsed, counters, histograms) for it."""
+        now = time.perf_counter()
+        elapsed = now - self.interval_started
+        counters, histograms = self.interval_counters, self.interval_histograms
+        self.total_counters.update(counters)
+        for name, histogram in histograms.items():
+            self.total_histograms.setdefault(name, LatencyHistogram()).merge(histogram)
+        self.interval_counters, self.interval_histograms = Counter(), {}
+        self.interval_started = now
+        return elapsed, counters, histograms
+
+    def totals(self):
+        elapsed = time.perf_counter() - self.started
+        return {
+            'elapsed_sec': round(elapsed, 1),
+            'counters': dict(self.total_counters),
+            'rates_per_sec': {name: round(value / elapsed, 1) for name, value in self.total_counters.items()},
+            'latency': {name: histogram.summary() for name, histogram in sorted(self.total_histograms.items())},
+        }
+
+
+@dataclass
+class LoadConfig:
+    base_url: str
+    clients: int
+    rooms: int
+    room_distribution: str
+    zipf_s: float
+    message_rate: float
+    typing_rate: float
+    churn: float
+    ramp_up: float
+    duration: float
+    spoof_ips: bool
+    seed: int
+
+
+def room_weights(config):
+    """Relative room sizes: equal for 'uniform', 1/rank^s for 'zipf'."""
+    if config.room_distribution == 'zipf':
+        return [1 / (rank ** config.zipf_s) for rank in range(1, config.rooms + 1)]
+    return [1.0] * config.rooms
+
+
+def client_ip(index):
+    return f'10.{(index >> 16) & 255}.{(index >> 8) & 255}.{index & 255}'
+
+
+def _http_post(url, payload, headers):
+    request = urllib.request.Request(
+        url, data=json.dumps(payload).encode(), method='POST',
+        headers={'Content-Type': 'application/json', **headers},
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            return response.status, json.loads(response.read() or b'{}')
+    except urllib.error.HTTPError as exc:
+        return exc.code, {}
+
+
+class LoadGenerator:
+    """Runs the simulated clients and periodically reports through a callback."""
+
+    def __init__(self, config, report, report_interval=5.0):
+        self.config = config
+        self.report = report
+        self.report_interval = report_interval
+        self.stats = LoadStats()
+        self.random = random.Random(config.seed)
+        self.ws_url = config.base_url.replace('http://', 'ws://', 1).replace('https://', 'wss://', 1)
+
+    def headers(self, index, token=None):
+        headers = {}
+        if self.config.spoof_ips:
+            # Spread clients over many addresses so per-IP REST limits do not cap the run; the server
+            # only believes this when the load generator's address is in its TRUSTED_PROXIES
+            headers['X-Forwarded-For'] = client_ip(index)
+        if token:
+            headers['X-Session-Token'] = token
+        return headers
+
+    async def post(self, name, index, path, payload, token=None):
+        start = time.perf_counter()
+        status, body = await asyncio.to_thread(
+            _http_post, self.config.base_url + path, payload, self.headers(index, token)
+        )
+        self.stats.observe(f'rest.{name}', time.perf_counter() - start)
+        if status >= 300:
+            self.stats.count(f'error.{name}.{status}')
+            return None
+        return body
+
+    async def create_session(self, index):
+        body = await self.post('create_session', index, '/api/session/create/', {'nickname': f'load{index}'})
+        return body and body.get('session_token')
+
+    async def create_rooms(self):
+        """One owner session per room; returns the room codes."""
+        codes = []
+        for index in range(self.config.rooms):
+            owner_index = self.config.clients + index
+            token = await self.create_session(owner_index)
+            room = token and await self.post('create_room', owner_index, '/api/rooms/create/',
+                                              {'name': f'load room {index}'}, token)
+            if not room:
+                raise RuntimeError(f'Could not create room {index}; is the server up and rate limiting relaxed?')
+            codes.append(room['code'])
+        return codes
+
+    async def run(self):
+        codes = await self.create_rooms()
+        assignments = self.random.choices(codes, weights=room_weights(self.config), k=self.config.clients)
+        stop = asyncio.Event()
+        reporter = asyncio.create_task(self.report_loop(stop))
+        clients = [
+            asyncio.create_task(self.client(index, code, stop,
+                                            delay=self.config.ramp_up * index / max(self.config.clients, 1)))
+            for index, code in enumerate(assignments)
+        ]
+        try:
+            await asyncio.sleep(self.config.duration)
+        finally:
+            stop.set()
+            await asyncio.gather(*clients, return_exceptions=True)
+            await reporter
+        self.stats.rotate()
+        return {'room_sizes': dict(Counter(assignments)), **self.stats.totals()}
+
+    async def report_loop(self, stop):
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), self.report_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.report(self.stats, *self.stats.rotate())
+
+    async def client(self, index, code, stop, delay):
+        await asyncio.sleep(delay)
+        token = await self.create_session(index)
+        if not token or not await self.post('join_room', index, '/api/rooms/join/', {'room_code': code}, token):
+            return
+        url = f'{self.ws_url}/ws/chat/{code}/?token={token}'
+        first = True
+        while not stop.is_set():
+            if not first:
+                self.stats.count('reconnects')
+            first = False
+            try:
+                await self.session(index, url, stop)
+            except (OSError, asyncio.TimeoutError, websockets.exceptions.WebSocketException) as exc:
+                self.stats.count(f'error.ws.{type(exc).__name__}')
+                await asyncio.sleep(1)
+
+    async def session(self, index, url, stop):
+        """One socket lifetime: send until stopped or until churn closes it."""
+        config = self.config
+        start = time.perf_counter()
+        async with websockets.connect(url, origin=config.base_url, open_timeout=30) as socket:
+            self.stats.observe('ws.connect', time.perf_counter() - start)
+            self.stats.connected += 1
+            reader = asyncio.create_task(self.read(index, socket))
+            try:
+                lifetime = self.random.expovariate(config.churn / 60) if config.churn else math.inf
+                closes_at = time.perf_counter() + lifetime
+                next_message = self.next_event(config.message_rate)
+                next_typing = self.next_event(config.typing_rate)
+                sequence = 0
+                while not stop.is_set() and not reader.done():
+                    now = time.perf_counter()
+                    if now >= closes_at:
+                        return
+                    if now >= next_message:
+                        sequence += 1
+                        await socket.send(json.dumps({
+                            'type': 'chat_message',
+                            'content': f'load {index}:{sequence} {time.perf_counter():.6f}',
+                        }))
+                        self.stats.count('messages_sent')
+                        next_message = self.next_event(config.message_rate)
+                    if now >= next_typing:
+                        await socket.send(json.dumps({'type': 'typing', 'is_typing': True}))
+                        self.stats.count('typing_sent')
+                        next_typing = self.next_event(config.typing_rate)
+                    wake = min(next_message, next_typing, closes_at) - time.perf_counter()
+                    try:
+                        await asyncio.wait_for(stop.wait(), max(wake, 0.001))
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                self.stats.connected -= 1
+                reader.cancel()
+
+    def next_event(self, per_minute):
+        if not per_minute:
+            return math.inf
+        return time.perf_counter() + self.random.expovariate(per_minute / 60)
+
+    async def read(self, index, socket):
+        own_prefix = f'load {index}:'
+        async for raw in socket:
+            received = time.perf_counter()
+            if isinstance(raw, bytes):
+                raw = raw.decode()
+            frame = json.loads(raw)
+            kind = frame.get('type')
+            self.stats.count(f'frames.{kind}')
+            if kind == 'chat_message':
+                content = frame.get('data', {}).get('content', '')
+                if not content.startswith('load '):
+                    continue
+                # Clients share one process, so the embedded perf_counter is comparable
+                latency = received - float(content.rsplit(' ', 1)[-1])
+                self.stats.observe('ws.echo' if content.startswith(own_prefix) else 'ws.delivery', latency)
+            elif kind == 'error':
+                self.stats.count('error.ws_frame')
@@ -0,0 +1,76 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from messenger.archive import ARCHIVE_SUFFIXES, archive_room, default_codec, inactive_rooms, rehydrate_room
+from messenger.models import Room
+
+
+class Command(BaseCommand):
+    help = 'Move messages of rooms inactive for N days into compressed archive files'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--inactive-days',
+            type=int,
+            default=settings.ARCHIVE_INACTIVE_DAYS,
+            help='Archive rooms without messages for this many days',
+        )
+        parser.add_argument(
+            '--dir',
+            default=settings.ARCHIVE_DIR,
+            help='Directory for archive files',
+        )
+        parser.add_argument(
+            '--codec',
+            choices=list(ARCHIVE_SUFFIXES),
+            help='Compression codec (default: zstd if installed, else gzip)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Show which rooms would be archived without archiving them',
+        )
+        parser.add_argument(
+            '--restore',
+            metavar='CODE',
+            help='Rehydrate one archived room instead of archiving',
+        )
+
+    def handle(self, *args, **options):
+        if options['restore']:
+            try:
+                room = Room.objects.get(code=options['restore'].upper())
+            except Room.DoesNotExist:
+                raise CommandError(f'Room {options["restore"]} not found.')
+            if not room.is_archived:
+                raise CommandError(f'Room {room.code} is not archived.')
+            count = rehydrate_room(room)
+            self.stdout.write(self.style.SUCCESS(f'Restored {count} message(s) of room {room.code}.'))
+            return
+
+        try:
+            codec = options['codec'] or default_codec()
+        except RuntimeError as exc:
+            raise CommandError(str(exc))
+
+        archived = 0
+        messages = 0
+        for room, last_message_at in inactive_rooms(options['inactive_days']):
+            last_seen = last_message_at.isoformat() if last_message_at else 'never'
+            if options['dry_run']:
+                self.stdout.write(self.style.WARNING(f'Would archive room {room.code} (last message: {last_seen})'))
+                continue
+
+            entry = archive_room(room, options['dir'], codec)
+            if entry is None:
+                self.stdout.write(self.style.WARNING(f'Skipped room {room.code}: new messages while archiving'))
+                continue
+            archived += 1
+            messages += entry.message_count
+            self.stdout.write(
+                f'Archived room {room.code}: {entry.message_count} message(s), {entry.size_bytes} bytes ({codec})'
+            )
+
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING('\nDry run complete.'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'\nArchived {messages} message(s) from {archived} room(s).'))
@@ -0,0 +1,64 @@
+import ipaddress
+import re
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from messenger.moderation import bulk_ban_sessions, select_sessions
+
+
+class Command(BaseCommand):
+    help = 'Ban every session matching an IP range and/or nickname pattern in one transaction'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--ip-range',
+            help='CIDR range to ban, e.g. 203.0.113.0/24',
+        )
+        parser.add_argument(
+            '--nickname-pattern',
+            help='Regular expression matched against nicknames',
+        )
+        parser.add_argument(
+            '--reason',
+            default='Bulk ban',
+            help='Reason stored on each ban record',
+        )
+        parser.add_argument(
+            '--hours',
+            type=int,
+            help='Ban duration in hours (default: permanent)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Show how many sessions would be banned without banning them',
+        )
+
+    def handle(self, *args, **options):
+        ip_range = options['ip_range']
+        nickname_pattern = options['nickname_pattern']
+        if not ip_range and not nickname_pattern:
+            raise CommandError('Provide --ip-range and/or --nickname-pattern.')
+        try:
+            if ip_range:
+                ipaddress.ip_network(ip_range, strict=False)
+            if nickname_pattern:
+                re.compile(nickname_pattern)
+        except (ValueError, re.error) as exc:
+            raise CommandError(str(exc))
+
+        targets = select_sessions(ip_range, nickname_pattern)
+        if options['dry_run']:
+            count = targets.filter(is_banned=False).count()
+            self.stdout.write(self.style.WARNING(f'Would ban {count} session(s).'))
+            return
+
+        expires_at = timezone.now() + timedelta(hours=options['hours']) if options['hours'] else None
+        count = bulk_ban_sessions(
+            targets,
+            reason=options['reason'],
+            banned_by='system',
+            expires_at=expires_at,
+            details={'ip_range': ip_range or '', 'nickname_pattern': nickname_pattern or ''}
+        )
+        self.stdout.write(self.style.SUCCESS(f'Banned {count} session(s).'))
@@ -0,0 +1,153 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from messenger.benchmarks import SCENARIOS, compare_results, run_metadata
+
+
+class Command(BaseCommand):
+    help = 'Run performance benchmark scenarios and report throughput and latency'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'scenarios',
+            nargs='*',
+            help=f'Scenarios to run (default: all). Available: {", ".join(sorted(SCENARIOS))}',
+        )
+        parser.add_argument(
+            '--duration',
+            type=float,
+            default=5.0,
+            help='Seconds to run each timed workload',
+        )
+        parser.add_argument(
+            '--readers',
+            type=int,
+            default=4,
+            help='Concurrent reader threads for database scenarios',
+        )
+        parser.add_argument(
+            '--writers',
+            type=int,
+            default=4,
+            help='Concurrent writer threads for database scenarios',
+        )
+        parser.add_argument(
+            '--connections',
+            type=int,
+            default=200,
+            help='WebSocket clients opened by connection scenarios',
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=50,
+            help='Maximum in-flight WebSocket handshakes',
+        )
+        parser.add_argument(
+            '--messages',
+            type=int,
+            default=100000,
+            help='Messages processed by per-message scenarios',
+        )
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=500,
+            help='Requests issued by each REST scenario',
+        )
+        parser.add_argument(
+            '--history-sizes',
+            default='100,1000,10000',
+            help='Comma-separated room history sizes for get_room_messages',
+        )
+        parser.add_argument(
+            '--fanout-sizes',
+            default='10,100,1000',
+            help='Comma-separated sockets per room for fanout',
+        )
+        parser.add_argument(
+            '--fanout-messages',
+            type=int,
+            default=20,
+            help='Messages broadcast per fanout room',
+        )
+        parser.add_argument(
+            '--subprotocol',
+            default='messenger.json',
+            help='Frame encoding for fanout sockets: messenger.json, messenger.compact.v1, messenger.msgpack.v1',
+        )
+        parser.add_argument(
+            '--group-sizes',
+            default='100,1000',
+            help='Comma-separated channels per group for group_send',
+        )
+        parser.add_argument(
+            '--group-messages',
+            type=int,
+            default=50,
+            help='Events sent to each group_send group',
+        )
+        parser.add_argument(
+            '--layers',
+            help='Comma-separated layer configs for group_send: memory, redis, redis_sharded, redis_pubsub '
+                 '(default: all available)',
+        )
+        parser.add_argument(
+            '--output',
+            help='Write results and run metadata to this JSON file',
+        )
+        parser.add_argument(
+            '--compare',
+            metavar='BASELINE',
+            help='JSON file from an earlier --output run to compare against',
+        )
+        parser.add_argument(
+            '--max-regression',
+            type=float,
+            help='Fail if any p99 latency grows by more than this percentage over the baseline',
+        )
+
+    def handle(self, *args, **options):
+        names = options['scenarios'] or sorted(SCENARIOS)
+        unknown = [name for name in names if name not in SCENARIOS]
+        if unknown:
+            raise CommandError(f'Unknown scenario(s): {", ".join(unknown)}')
+
+        baseline = None
+        if options['compare']:
+            try:
+                with open(options['compare']) as f:
+                    baseline = json.load(f)['results']
+            except (OSError, ValueError, KeyError) as exc:
+                raise CommandError(f'Cannot read baseline {options["compare"]}: {exc}')
+
+        results = {}
+        over_budget = []
+        for name in names:
+            self.stdout.write(self.style.MIGRATE_HEADING(f'Running {name}...'))
+            result = SCENARIOS[name](options)
+            results[name] = result
+            self.stdout.write(json.dumps(result, indent=2))
+            if result.get('within_budget') is False:
+                over_budget.append(name)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({'meta': run_metadata(), 'results': results}, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f'Results written to {options["output"]}'))
+
+        regressions = []
+        if baseline is not None:
+            self.stdout.write(self.style.MIGRATE_HEADING(f'Compared with {options["compare"]}:'))
+            for path, metric, before, after, change in compare_results(baseline, results):
+                # Higher is better for throughput, lower for latency
+                worse = change < 0 if metric == 'ops_per_sec' else change > 0
+                style = self.style.ERROR if worse and abs(change) >= 10 else self.style.SUCCESS
+                self.stdout.write(style(f'{path:45} {metric:12} {before:>12} -> {after:>12} ({change:+.1f}%)'))
+                if (metric == 'p99_ms' and options['max_regression'] is not None
+                        and change > options['max_regression']):
+                    regressions.append(path)
+
+        if over_budget:
+            raise CommandError(f'Latency budget exceeded: {", ".join(over_budget)}')
+        if regressions:
+            raise CommandError(f'p99 regressed more than {options["max_regression"]}%: {", ".join(regressions)}')
@@ -28,8 +28,7 @@ class Command(BaseCommand):
             cutoff_date = timezone.now() - timedelta(days=retention_days)
             
             # Find messages older than retention period
-            old_messages = Message.objects.filter(
-                room=room,
+            old_messages = Message.objects.for_room(room).filter(
                 timestamp__lt=cutoff_date,
                 is_deleted=False
             )
@@ -0,0 +1,55 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from messenger.export import EXPORT_CHUNK_SIZE, EXPORT_FORMATS, export_room
+from messenger.models import Room
+
+
+class Command(BaseCommand):
+    help = 'Stream a room\'s message history to a file or stdout as NDJSON or CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('code', help='Room code')
+        parser.add_argument(
+            '--format',
+            dest='export_format',
+            choices=list(EXPORT_FORMATS),
+            default='ndjson',
+            help='Output format (default ndjson)',
+        )
+        parser.add_argument(
+            '--gzip',
+            action='store_true',
+            help='Gzip the output while streaming',
+        )
+        parser.add_argument(
+            '--output',
+            help='File to write (default stdout)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=EXPORT_CHUNK_SIZE,
+            help='Rows fetched from the database cursor per batch',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            room = Room.objects.get(code=options['code'].upper())
+        except Room.DoesNotExist:
+            raise CommandError(f'Room {options["code"]} not found.')
+
+        chunks = export_room(room, options['export_format'], options['gzip'], options['chunk_size'])
+        output = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        try:
+            written = 0
+            for chunk in chunks:
+                output.write(chunk)
+                written += len(chunk)
+        finally:
+            if options['output']:
+                output.close()
+            else:
+                output.flush()
+
+        if options['output']:
+            self.stdout.write(self.style.SUCCESS(f'Exported room {room.code} to {options["output"]} ({written} bytes).'))
@@ -0,0 +1,148 @@
+import asyncio
+import json
+from django.core.management.base import BaseCommand, CommandError
+from messenger import loadgen
+
+
+class Command(BaseCommand):
+    help = 'Simulate anonymous clients against a running server and report live throughput and latency'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--base-url',
+            default='http://localhost:8000',
+            help='Server to load (REST and WebSocket)',
+        )
+        parser.add_argument(
+            '--clients',
+            type=int,
+            default=1000,
+            help='Simulated clients',
+        )
+        parser.add_argument(
+            '--rooms',
+            type=int,
+            default=50,
+            help='Rooms the clients are spread over',
+        )
+        parser.add_argument(
+            '--room-distribution',
+            choices=['uniform', 'zipf'],
+            default='zipf',
+            help='How clients are spread over rooms (zipf: a few large rooms, many small ones)',
+        )
+        parser.add_argument(
+            '--zipf-s',
+            type=float,
+            default=1.1,
+            help='Zipf exponent for --room-distribution zipf',
+        )
+        parser.add_argument(
+            '--message-rate',
+            type=float,
+            default=2.0,
+            help='Messages per client per minute',
+        )
+        parser.add_argument(
+            '--typing-rate',
+            type=float,
+            default=4.0,
+            help='Typing events per client per minute',
+        )
+        parser.add_argument(
+            '--churn',
+            type=float,
+            default=0.5,
+            help='Reconnects per client per minute (0 keeps sockets open)',
+        )
+        parser.add_argument(
+            '--ramp-up',
+            type=float,
+            default=30.0,
+            help='Seconds over which clients are started',
+        )
+        parser.add_argument(
+            '--duration',
+            type=float,
+            default=120.0,
+            help='Seconds to run after the rooms are created',
+        )
+        parser.add_argument(
+            '--report-interval',
+            type=float,
+            default=5.0,
+            help='Seconds between live reports',
+        )
+        parser.add_argument(
+            '--no-spoof-ips',
+            action='store_false',
+            dest='spoof_ips',
+            help='Do not send a distinct X-Forwarded-For per client (only honoured when this host is in the '
+                 'server\'s TRUSTED_PROXIES; otherwise per-IP rate limits apply regardless)',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=1,
+            help='Random seed for room assignment and event timing',
+        )
+        parser.add_argument(
+            '--output',
+            help='Write the final totals to this JSON file',
+        )
+
+    def handle(self, *args, **options):
+        if loadgen.websockets is None:
+            raise CommandError('loadgen needs the websockets package: pip install websockets')
+
+        config = loadgen.LoadConfig(
+            base_url=options['base_url'].rstrip('/'),
+            clients=options['clients'],
+            rooms=options['rooms'],
+            room_distribution=options['room_distribution'],
+            zipf_s=options['zipf_s'],
+            message_rate=options['message_rate'],
+            typing_rate=options['typing_rate'],
+            churn=options['churn'],
+            ramp_up=options['ramp_up'],
+            duration=options['duration'],
+            spoof_ips=options['spoof_ips'],
+            seed=options['seed'],
+        )
+        generator = loadgen.LoadGenerator(config, self.report, options['report_interval'])
+        try:
+            totals = asyncio.run(generator.run())
+        except RuntimeError as exc:
+            raise CommandError(str(exc))
+
+        self.stdout.write(self.style.MIGRATE_HEADING('Totals'))
+        self.stdout.write(json.dumps(totals, indent=2))
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({'config': vars(config), 'totals': totals}, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f'Totals written to {options["output"]}'))
+
+    def report(self, stats, elapsed, counters, histograms):
+        """Print one interval: rates, errors and a latency histogram per metric."""
+        uptime = stats.interval_started - stats.started
+        rates = ' '.join(
+            f'{name}={counters[name] / elapsed:.1f}/s'
+            for name in ('messages_sent', 'typing_sent', 'frames.chat_message', 'frames.typing')
+        )
+        errors = sum(value for name, value in counters.items() if name.startswith('error'))
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f'[{uptime:6.0f}s] connected={stats.connected} {rates} '
+            f'reconnects={counters["reconnects"]} errors={errors}'
+        ))
+        for name, histogram in sorted(histograms.items()):
+            summary = histogram.summary()
+            self.stdout.write(
+                f'  {name:22} n={summary["count"]:<7} p50<={summary["p50_ms"]}ms '
+                f'p95<={summary["p95_ms"]}ms p99<={summary["p99_ms"]}ms'
+            )
+            if name in ('ws.echo', 'ws.delivery'):
+                for line in histogram.render(width=30):
+                    self.stdout.write(f'    {line}')
+        for name, value in sorted(counters.items()):
+            if name.startswith('error'):
+                self.stdout.write(self.style.WARNING(f'  {name}: {value}'))
@@ -0,0 +1,94 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connections, transaction
+from messenger.db import preserve_timestamps
+
+
+def sort_by_foreign_keys(models):
+    """Order models so every model comes after the models it references."""
+    remaining = list(models)
+    ordered = []
+    while remaining:
+        for model in remaining:
+            targets = {
+                field.related_model for field in model._meta.concrete_fields
+                if field.is_relation and field.related_model is not model
+            }
+            if not targets & set(remaining):
+                ordered.append(model)
+                remaining.remove(model)
+                break
+        else:
+            raise CommandError('Circular foreign keys between models; cannot order copy.')
+    return ordered
+
+
+class Command(BaseCommand):
+    help = 'Copy messenger data from an existing SQLite database into the configured default database'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'source',
+            help='Path to the SQLite database file to copy from',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=2000,
+            help='Number of rows read and inserted per batch',
+        )
+        parser.add_argument(
+            '--database',
+            default='default',
+            help='Target database alias (must already be migrated)',
+        )
+
+    def handle(self, *args, **options):
+        target = options['database']
+        batch_size = options['batch_size']
+        if connections[target].vendor == 'sqlite':
+            raise CommandError(f'Target database "{target}" is SQLite; set DATABASE_URL first.')
+
+        connections.databases['sqlite_source'] = {
+            **connections.databases[target],
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': options['source'],
+            'OPTIONS': {},
+            'CONN_MAX_AGE': 0,
+        }
+
+        models = sort_by_foreign_keys(apps.get_app_config('messenger').get_models())
+        try:
+            with preserve_timestamps(models), transaction.atomic(using=target):
+                for model in models:
+                    copied = self.copy_model(model, target, batch_size)
+                    self.stdout.write(f'Copied {copied} row(s) into {model._meta.db_table}')
+
+                # Advance sequences past the copied primary keys
+                sql = connections[target].ops.sequence_reset_sql(no_style(), models)
+                with connections[target].cursor() as cursor:
+                    for statement in sql:
+                        cursor.execute(statement)
+        finally:
+            connections['sqlite_source'].close()
+            del connections.databases['sqlite_source']
+
+        self.stdout.write(self.style.SUCCESS('\nCopy complete.'))
+
+    def copy_model(self, model, target, batch_size):
+        """Stream one table from the SQLite source into the target in batches."""
+        rows = model._base_manager.using('sqlite_source').order_by('pk').iterator(chunk_size=batch_size)
+        batch = []
+        copied = 0
+        for obj in rows:
+            obj._state.db = target
+            batch.append(obj)
+            if len(batch) >= batch_size:
+                model._base_manager.using(target).bulk_create(batch)
+                copied += len(batch)
+                batch = []
+        if batch:
+            model._base_manager.using(target).bulk_create(batch)
+            copied += len(batch)
+        return copied
@@ -0,0 +1,90 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from messenger.db import preserve_timestamps
+from messenger.models import Message, MessageReport, Room
+from messenger.sharding import message_databases, shard_for_room, sharding_enabled
+
+
+class Command(BaseCommand):
+    help = 'Move room messages to the shard that owns them after MESSAGE_SHARDS changes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Show which rooms would move without moving them',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of messages copied and deleted per batch',
+        )
+
+    def handle(self, *args, **options):
+        if not sharding_enabled():
+            raise CommandError('Sharding is disabled; set MESSAGE_SHARD_URLS first.')
+
+        dry_run = options['dry_run']
+        rooms_moved = 0
+        messages_moved = 0
+
+        # Include the primary so messages written before sharding are moved off it
+        for source in ['default'] + message_databases():
+            room_ids = list(Message.objects.using(source).values_list('room_id', flat=True).order_by().distinct())
+            codes = dict(Room.objects.filter(id__in=room_ids).values_list('id', 'code'))
+
+            for room_id in room_ids:
+                code = codes.get(room_id)
+                if code is None:
+                    self.stdout.write(self.style.WARNING(f'Skipping messages of unknown room id {room_id} on {source}'))
+                    continue
+                target = shard_for_room(code)
+                if target == source:
+                    continue
+
+                if dry_run:
+                    count = Message.objects.using(source).filter(room_id=room_id).count()
+                    self.stdout.write(
+                        self.style.WARNING(f'Would move {count} message(s) of room {code} from {source} to {target}')
+                    )
+                    continue
+
+                count = self.move_room(room_id, source, target, options['batch_size'])
+                rooms_moved += 1
+                messages_moved += count
+                self.stdout.write(
+                    self.style.SUCCESS(f'Moved {count} message(s) of room {code} from {source} to {target}')
+                )
+
+        if dry_run:
+            self.stdout.write(self.style.WARNING('\nDry run complete.'))
+        else:
+            self.stdout.write(
+                self.style.SUCCESS(f'\nRebalance complete. Moved {messages_moved} message(s) in {rooms_moved} room(s).')
+            )
+
+    def move_room(self, room_id, source, target, batch_size):
+        """Copy a room's messages to the target shard batch by batch, deleting each batch from the source."""
+        moved = 0
+        with preserve_timestamps([Message, MessageReport]):
+            while True:
+                batch = list(Message.objects.using(source).filter(room_id=room_id).order_by('id')[:batch_size])
+                if not batch:
+                    return moved
+                source_ids = [message.id for message in batch]
+                reports = list(MessageReport.objects.using(source).filter(message_id__in=source_ids))
+                for obj in batch + reports:
+                    # Ids are per shard; the target assigns new ones
+                    obj.pk = None
+                    obj._state.adding = True
+                    obj._state.db = target
+                with transaction.atomic(using=target), transaction.atomic(using=source):
+                    Message.objects.using(target).bulk_create(batch)
+                    new_ids = dict(zip(source_ids, (message.pk for message in batch)))
+                    for report in reports:
+                        report.message_id = new_ids[report.message_id]
+                    MessageReport.objects.using(target).bulk_create(reports)
+                    # Cascades to the source copies of the reports
+                    Message.objects.using(source).filter(id__in=source_ids).delete()
+                moved += len(batch)
@@ -0,0 +1,326 @@
+"""
+In-process metrics exposed at /metrics in Prometheus text format.
+Each thread writes to its own shard of every metric, so recording takes no lock;
+collection sums the shards. With several worker processes, set METRICS_DIR to a
+shared directory: each process writes periodic snapshots there and /metrics
+merges them.
+"""
+import atexit
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _ShardOwner:
+    """Lives in a thread's local storage; folds the shard into the metric when the thread exits."""
+
+    def __init__(self, metric, values):
+        self.metric = metric
+        self.values = values
+
+    def __del__(self):
+        self.metric._retire(self.values)
+
+
+class Metric:
+    """Base class: per-thread value shards keyed by a tuple of label values."""
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards = []
+        self._retired = {}
+        # Taken on a thread's first record, at thread exit and on collection only
+        self._lock = threading.RLock()
+
+    def _shard(self):
+        try:
+            return self._local.owner.values
+        except AttributeError:
+            values = {}
+            with self._lock:
+                self._shards.append(values)
+            self._local.owner = _ShardOwner(self, values)
+            return values
+
+    def _retire(self, values):
+        with self._lock:
+            self._merge(self._retired, values)
+            self._shards = [shard for shard in self._shards if shard is not values]
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    @staticmethod
+    def _combine(total, value):
+        return total + value
+
+    def _merge(self, totals, shard):
+        for key, value in shard.copy().items():
+            totals[key] = self._combine(totals[key], value) if key in totals else self._copy(value)
+
+    @staticmethod
+    def _copy(value):
+        return value
+
+    def collect(self):
+        with self._lock:
+            totals = {}
+            self._merge(totals, self._retired)
+            for shard in self._shards:
+                self._merge(totals, shard)
+        return totals
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        shard = self._shard()
+        key = self._key(labels)
+        shard[key] = shard.get(key, 0) + amount
+
+
+class Gauge(Counter):
+    """Sum of per-thread deltas, so inc()/dec() from any thread stay lock-free."""
+    kind = 'gauge'
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        shard = self._shard()
+        key = self._key(labels)
+        state = shard.get(key)
+        if state is None:
+            # Per-bucket (non-cumulative) counts, plus +Inf, sum and count
+            state = shard[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+        state[bisect.bisect_left(self.buckets, value)] += 1
+        state[-2] += value
+        state[-1] += 1
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    @staticmethod
+    def _combine(total, value):
+        return [a + b for a, b in zip(total, value)]
+
+    @staticmethod
+    def _copy(value):
+        return list(value)
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self._flusher = None
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def snapshot(self):
+        """This process's metrics as plain JSON-serializable data."""
+        return {
+            name: {
+                'kind': metric.kind,
+                'help': metric.documentation,
+                'labels': list(metric.labelnames),
+                'buckets': list(getattr(metric, 'buckets', ())),
+                'values': [[list(key), value] for key, value in metric.collect().items()],
+            }
+            for name, metric in self.metrics.items()
+        }
+
+    def write_snapshot(self, directory):
+        path = os.path.join(directory, f'metrics-{os.getpid()}.json')
+        partial = f'{path}.partial'
+        with open(partial, 'w') as f:
+            json.dump({'pid': os.getpid(), 'written_at': time.time(), 'metrics': self.snapshot()}, f)
+        os.replace(partial, path)
+
+    def start_flusher(self):
+        """Write snapshots to METRICS_DIR every METRICS_FLUSH_INTERVAL seconds (once per process)."""
+        directory = settings.METRICS_DIR
+        if not directory or (self._flusher and self._flusher.is_alive() and self._flusher.pid == os.getpid()):
+            return
+        os.makedirs(directory, exist_ok=True)
+
+        def flush_forever():
+            while True:
+                time.sleep(settings.METRICS_FLUSH_INTERVAL)
+                try:
+                    self.write_snapshot(directory)
+                except OSError:
+                    logger.exception('Could not write metrics snapshot to %s', directory)
+
+        self._flusher = threading.Thread(target=flush_forever, name='metrics-flusher', daemon=True)
+        self._flusher.pid = os.getpid()
+        self._flusher.start()
+        # Keep an exiting worker's final counts
+        atexit.register(self.write_snapshot, directory)
+
+    def merged_snapshots(self):
+        """Snapshots of every worker: this process live, others from METRICS_DIR."""
+        snapshots = [(os.getpid(), self.snapshot())]
+        directory = settings.METRICS_DIR
+        if not directory or not os.path.isdir(directory):
+            return snapshots
+        for filename in os.listdir(directory):
+            if not (filename.startswith('metrics-') and filename.endswith('.json')):
+                continue
+            try:
+                with open(os.path.join(directory, filename)) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if data.get('pid') != os.getpid():
+                snapshots.append((data.get('pid'), data.get('metrics', {})))
+        return snapshots
+
+    def render(self):
+        """All workers' metrics in Prometheus text exposition format."""
+        merged = {}
+        for pid, snapshot in self.merged_snapshots():
+            alive = pid == os.getpid() or _pid_alive(pid)
+            for name, data in snapshot.items():
+                # Gauges of exited workers no longer describe anything live
+                if data['kind'] == 'gauge' and not alive:
+                    continue
+                entry = merged.setdefault(name, {**data, 'values': {}})
+                for key, value in data['values']:
+                    key = tuple(key)
+                    if key not in entry['values']:
+                        entry['values'][key] = value
+                    elif data['kind'] == 'histogram':
+                        entry['values'][key] = [a + b for a, b in zip(entry['values'][key], value)]
+                    else:
+                        entry['values'][key] += value
+
+        lines = []
+        for name, data in sorted(merged.items()):
+            lines.append(f'# HELP {name} {data["help"]}')
+            lines.append(f'# TYPE {name} {data["kind"]}')
+            for key, value in sorted(data['values'].items()):
+                labels = dict(zip(data['labels'], key))
+                if data['kind'] != 'histogram':
+                    lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(data['buckets'] + ['+Inf'], value[:-2]):
+                    cumulative += count
+                    le = bound if bound == '+Inf' else _format_value(bound)
+                    lines.append(f'{name}_bucket{_format_labels({**labels, "le": le})} {cumulative}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(value[-2])}')
+                lines.append(f'{name}_count{_format_labels(labels)} {value[-1]}')
+        return '\n'.join(lines) + '\n'
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except (OSError, TypeError):
+        return False
+    return True
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+        for name, value in labels.items()
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return str(value)
+
+
+registry = Registry()
+
+# WebSocket
+WS_CONNECTS = registry.counter('messenger_ws_connects_total', 'WebSocket connection attempts', ['result'])
+WS_DISCONNECTS = registry.counter('messenger_ws_disconnects_total', 'Accepted WebSocket connections closed')
+WS_CONNECTED = registry.gauge('messenger_ws_connected', 'Currently open WebSocket connections')
+WS_FRAMES_IN = registry.counter('messenger_ws_frames_in_total', 'Frames received from clients', ['type'])
+WS_FRAMES_OUT = registry.counter('messenger_ws_frames_out_total', 'Frames sent to clients', ['type'])
+WS_BYTES_OUT = registry.counter('messenger_ws_bytes_out_total',
+                                'Encoded frame bytes sent to clients (characters for text frames)', ['protocol'])
+WS_BROADCAST_SECONDS = registry.histogram('messenger_ws_broadcast_seconds',
+                                          'Time to deliver a room message to local sockets and publish it')
+
+# Messaging and abuse controls
+MESSAGES = registry.counter('messenger_messages_total', 'Messages stored', ['source'])
+SPAM_ACTIONS = registry.counter('messenger_spam_actions_total', 'Messages throttled or dropped by spam filters',
+                                ['action', 'source'])
+REJECTED_REQUESTS = registry.counter('messenger_rejected_total', 'Requests rejected before reaching a handler',
+                                     ['reason', 'scope'])
+
+# HTTP and database
+HTTP_REQUESTS = registry.counter('messenger_http_requests_total', 'HTTP requests handled',
+                                 ['view', 'method', 'status'])
+HTTP_REQUEST_SECONDS = registry.histogram('messenger_http_request_seconds', 'HTTP request latency', ['view'])
+DB_QUERIES = registry.counter('messenger_db_queries_total', 'Database queries executed', ['alias'])
+DB_QUERY_SECONDS = registry.histogram('messenger_db_query_seconds', 'Database query latency', ['alias'])
+
+
+def instrument_connection(sender, connection, **kwargs):
+    """connection_created hook: time every query on this connection."""
+    if db_query_timer not in connection.execute_wrappers:
+        connection.execute_wrappers.append(db_query_timer)
+
+
+def db_query_timer(execute, sql, params, many, context):
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        alias = context['connection'].alias
+        DB_QUERIES.inc(alias=alias)
+        DB_QUERY_SECONDS.observe(time.perf_counter() - start, alias=alias)
@@ -1,10 +1,35 @@
+from django.conf import settings
 from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
 from django.http import JsonResponse
 from django.utils import timezone
 from .models import AuditLog
+from .moderation import ip_bans
+from .utils import get_client_ip
+from .metrics import HTTP_REQUESTS, HTTP_REQUEST_SECONDS, REJECTED_REQUESTS, registry
 import time
 
 
+class MetricsMiddleware:
+    """Count and time every request, labelled by the resolved view."""
+    
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        registry.start_flusher()
+    
+    def __call__(self, request):
+        start = time.perf_counter()
+        response = self.get_response(request)
+        match = getattr(request, 'resolver_match', None)
+        # Unresolved paths share one label so scanners cannot blow up cardinality
+        view = match.view_name if match else 'unmatched'
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, view=view)
+        HTTP_REQUESTS.inc(view=view, method=request.method, status=response.status_code)
+        return response
+
+
 class RateLimitMiddleware:
     """Rate limiting middleware for API endpoints."""
     
@@ -17,7 +42,14 @@ class RateLimitMiddleware:
             return self.get_response(request)
         
         # Get client IP
-        ip_address = self.get_client_ip(request)
+        ip_address = get_client_ip(request)
+        
+        # Reject banned addresses/networks (in-memory trie, no DB query per request)
+        if ip_bans.is_stale():
+            ip_bans.refresh()
+        if ip_bans.is_banned(ip_address):
+            REJECTED_REQUESTS.inc(reason='ip_ban', scope='http')
+            return JsonResponse({'error': 'Access denied.'}, status=403)
         
         # Rate limit rules
         rate_limits = {
@@ -33,6 +65,7 @@ class RateLimitMiddleware:
                 count = cache.get(cache_key, 0)
                 
                 if count >= config['limit']:
+                    REJECTED_REQUESTS.inc(reason='rate_limit', scope='http')
                     # Log rate limit hit
                     AuditLog.objects.create(
                         event_type='rate_limit',
@@ -51,15 +84,6 @@ class RateLimitMiddleware:
         response = self.get_response(request)
         return response
     
-    def get_client_ip(self, request):
-        """Get client IP address from request."""
-        x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-        if x_forwarded_for:
-            ip = x_forwarded_for.split(',')[0]
-        else:
-            ip = request.META.get('REMOTE_ADDR')
-        return ip
-
 
 class SecurityHeadersMiddleware:
     """Add security headers to responses."""
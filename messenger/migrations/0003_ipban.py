@@ -0,0 +1,30 @@
+# Generated by Django 5.2.10 on 2026-10-19 06:08
+
+import messenger.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messenger', '0002_message_shard_fks'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IPBan',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('network', models.CharField(max_length=49, validators=[messenger.models.validate_network])),
+                ('reason', models.TextField(blank=True)),
+                ('banned_by', models.CharField(blank=True, max_length=100)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('expires_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'ip_bans',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['expires_at'], name='ip_bans_expires_78e3d7_idx')],
+            },
+        ),
+    ]
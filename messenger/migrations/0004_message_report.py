@@ -0,0 +1,29 @@
+# Generated by Django 5.2.10 on 2026-10-19 06:09
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messenger', '0003_ipban'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageReport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('reason', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('message', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reports', to='messenger.message')),
+                ('reporter', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='reports', to='messenger.session')),
+            ],
+            options={
+                'db_table': 'message_reports',
+                'ordering': ['-created_at'],
+                'constraints': [models.UniqueConstraint(fields=('message', 'reporter'), name='unique_message_report')],
+            },
+        ),
+    ]
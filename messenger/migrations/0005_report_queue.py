@@ -0,0 +1,34 @@
+# Generated by Django 5.2.10 on 2026-10-19 06:10
+
+from django.db import migrations, models
+
+
+def open_existing_reports(apps, schema_editor):
+    Message = apps.get_model('messenger', 'Message')
+    Message.objects.using(schema_editor.connection.alias).filter(
+        reported_count__gt=0
+    ).update(report_status='open')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messenger', '0004_message_report'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='report_status',
+            field=models.CharField(blank=True, choices=[('', 'Not reported'), ('open', 'Open'), ('resolved', 'Resolved')], default='', max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['room', 'report_status', '-reported_count', '-timestamp', '-id'], name='messages_room_report_queue'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['report_status', '-reported_count', '-timestamp', '-id'], name='messages_report_queue'),
+        ),
+        migrations.RunPython(open_existing_reports, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    from messenger.search import install_search_index
+    install_search_index(schema_editor.connection)
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        for trigger in ['insert', 'delete', 'update']:
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS messages_fts_{trigger}')
+        schema_editor.execute('DROP TABLE IF EXISTS messages_fts')
+    elif vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS messages_content_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messenger', '0005_report_queue'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
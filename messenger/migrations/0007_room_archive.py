@@ -0,0 +1,36 @@
+# Generated by Django 5.2.10 on 2026-10-19 06:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messenger', '0006_message_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='is_archived',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='ArchivedRoom',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=500)),
+                ('codec', models.CharField(choices=[('zstd', 'Zstandard'), ('gzip', 'Gzip')], max_length=10)),
+                ('message_count', models.IntegerField(default=0)),
+                ('visible_count', models.IntegerField(default=0)),
+                ('size_bytes', models.BigIntegerField(default=0)),
+                ('last_message_at', models.DateTimeField(blank=True, null=True)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('room', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='archive', to='messenger.room')),
+            ],
+            options={
+                'db_table': 'archived_rooms',
+            },
+        ),
+    ]
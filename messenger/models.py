@@ -1,9 +1,12 @@
 import uuid
 import string
 import random
+import ipaddress
 from django.db import models
 from django.utils import timezone
+from django.core.exceptions import ValidationError
 from django.core.validators import MaxLengthValidator, MinLengthValidator
+from .sharding import shard_for_room, sharding_enabled
 
 
 def generate_room_code():
@@ -15,6 +18,14 @@ def generate_room_code():
             return code
 
 
+def validate_network(value):
+    """Validate an IP address or CIDR network."""
+    try:
+        ipaddress.ip_network(value, strict=False)
+    except ValueError:
+        raise ValidationError(f'{value} is not a valid IP address or CIDR network.')
+
+
 class Session(models.Model):
     """Anonymous user session model."""
     session_token = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
@@ -59,6 +70,8 @@ class Room(models.Model):
     message_retention_days = models.IntegerField(default=30)
     is_active = models.BooleanField(default=True)
     max_participants = models.IntegerField(null=True, blank=True)
+    # Messages moved to cold storage; see ArchivedRoom
+    is_archived = models.BooleanField(default=False)
 
     class Meta:
         db_table = 'rooms'
@@ -77,14 +90,81 @@ class Room(models.Model):
         super().save(*args, **kwargs)
 
 
+class MessageManager(models.Manager):
+    """Manager that knows which shard holds a room's messages."""
+
+    def for_room(self, room):
+        """Messages of a room, read from the shard that owns it."""
+        queryset = self.filter(room=room)
+        if sharding_enabled():
+            queryset = queryset.using(shard_for_room(room.code))
+        return queryset
+
+    def create(self, **kwargs):
+        """Create a message on the shard owning its room."""
+        if sharding_enabled() and 'room' in kwargs:
+            return self.using(shard_for_room(kwargs['room'].code)).create(**kwargs)
+        return super().create(**kwargs)
+
+    def locate(self, message_id, room_code=None, **filters):
+        """
+        Fetch a message by id, within room_code when given. Ids are assigned per
+        shard, so with sharding the room is required to tell the shard's message
+        with that id from another's.
+        """
+        if room_code:
+            room_id = Room.objects.filter(code=room_code.upper()).values_list('id', flat=True).first()
+            if room_id is None:
+                raise self.model.DoesNotExist(f'Message {message_id} not found')
+            filters['room_id'] = room_id
+        if not sharding_enabled():
+            return self.get(id=message_id, **filters)
+        if not room_code:
+            raise ValueError('room_code is required when messages are sharded')
+        return self.using(shard_for_room(room_code.upper())).get(id=message_id, **filters)
+
+
+class ArchivedRoom(models.Model):
+    """Index entry for a room whose messages live in a compressed archive file."""
+    CODECS = [
+        ('zstd', 'Zstandard'),
+        ('gzip', 'Gzip'),
+    ]
+
+    room = models.OneToOneField(Room, on_delete=models.CASCADE, related_name='archive')
+    path = models.CharField(max_length=500)
+    codec = models.CharField(max_length=10, choices=CODECS)
+    message_count = models.IntegerField(default=0)
+    visible_count = models.IntegerField(default=0)
+    size_bytes = models.BigIntegerField(default=0)
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'archived_rooms'
+
+    def __str__(self):
+        return f"Archive of {self.room.code} ({self.message_count} messages)"
+
+
 class Message(models.Model):
     """Chat message model."""
-    room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name='messages')
-    session = models.ForeignKey(Session, on_delete=models.SET_NULL, null=True, related_name='messages')
+    # No FK constraints: messages may live on a shard apart from rooms/sessions
+    room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name='messages', db_constraint=False)
+    session = models.ForeignKey(Session, on_delete=models.SET_NULL, null=True, related_name='messages',
+                                db_constraint=False)
     content = models.TextField(validators=[MaxLengthValidator(1000)])
     timestamp = models.DateTimeField(auto_now_add=True)
     is_deleted = models.BooleanField(default=False)
     reported_count = models.IntegerField(default=0)
+    REPORT_STATUSES = [
+        ('', 'Not reported'),
+        ('open', 'Open'),
+        ('resolved', 'Resolved'),
+    ]
+    report_status = models.CharField(max_length=10, choices=REPORT_STATUSES, default='', blank=True)
+
+    objects = MessageManager()
 
     class Meta:
         db_table = 'messages'
@@ -92,6 +172,11 @@ class Message(models.Model):
             models.Index(fields=['room', 'timestamp']),
             models.Index(fields=['session']),
             models.Index(fields=['is_deleted', 'timestamp']),
+            # Moderation queues, in queue order (per room and global)
+            models.Index(fields=['room', 'report_status', '-reported_count', '-timestamp', '-id'],
+                         name='messages_room_report_queue'),
+            models.Index(fields=['report_status', '-reported_count', '-timestamp', '-id'],
+                         name='messages_report_queue'),
         ]
         ordering = ['timestamp']
 
@@ -99,6 +184,25 @@ class Message(models.Model):
         return f"Message from {self.session.nickname if self.session else 'Unknown'} in {self.room.code}"
 
 
+class MessageReport(models.Model):
+    """A session's report of a message; each session may report a message once."""
+    # Stored on the message's shard; the reporter lives on the primary
+    message = models.ForeignKey(Message, on_delete=models.CASCADE, related_name='reports')
+    reporter = models.ForeignKey(Session, on_delete=models.CASCADE, related_name='reports', db_constraint=False)
+    reason = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'message_reports'
+        constraints = [
+            models.UniqueConstraint(fields=['message', 'reporter'], name='unique_message_report'),
+        ]
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Report on message {self.message_id} by session {self.reporter_id}"
+
+
 class AuditLog(models.Model):
     """Security audit log model."""
     EVENT_TYPES = [
@@ -157,3 +261,33 @@ class BannedSession(models.Model):
         if self.expires_at is None:
             return True  # Permanent ban
         return self.expires_at > timezone.now()
+
+
+class IPBan(models.Model):
+    """Banned IP address or CIDR network."""
+    network = models.CharField(max_length=49, validators=[validate_network])  # e.g. 203.0.113.0/24
+    reason = models.TextField(blank=True)
+    banned_by = models.CharField(max_length=100, blank=True)  # Admin username or 'system'
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(null=True, blank=True)  # None for permanent ban
+
+    class Meta:
+        db_table = 'ip_bans'
+        indexes = [
+            models.Index(fields=['expires_at']),
+        ]
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"IP ban {self.network} by {self.banned_by}"
+
+    def save(self, *args, **kwargs):
+        # Store the canonical network form so lookups and admin search agree
+        self.network = str(ipaddress.ip_network(self.network, strict=False))
+        super().save(*args, **kwargs)
+
+    def is_active(self):
+        """Check if ban is still active."""
+        if self.expires_at is None:
+            return True  # Permanent ban
+        return self.expires_at > timezone.now()
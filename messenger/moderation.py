@@ -0,0 +1,363 @@
+"""Session ban enforcement shared by views, the admin and WebSocket consumers."""
+import base64
+import ipaddress
+import time
+from datetime import datetime
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from .models import Session, Message, BannedSession, AuditLog, IPBan
+from .sharding import message_databases, sharding_enabled
+from .utils import invalidate_cached_session
+
+BANNED_TOKENS_KEY = 'bans:tokens'
+BANNED_TOKENS_VERSION_KEY = 'bans:version'
+IP_BANS_VERSION_KEY = 'ipbans:version'
+
+# Rows per UPDATE ... WHERE id IN (...) statement, within SQLite's variable limit
+BULK_CHUNK_SIZE = 500
+
+
+def session_group_name(session_token):
+    """Channel-layer group every socket of a session joins, used to revoke them."""
+    return f"session_{session_token}"
+
+
+def load_banned_tokens():
+    """Read active bans from the database as {token: expiry timestamp or None}."""
+    now = timezone.now()
+    rows = Session.objects.filter(is_banned=True).filter(
+        Q(banned_until__isnull=True) | Q(banned_until__gt=now)
+    ).values_list('session_token', 'banned_until')
+    return {str(token): until.timestamp() if until else None for token, until in rows}
+
+
+def publish_banned_tokens():
+    """Rebuild the shared banned-token map from the database and bump its version."""
+    cache.set(BANNED_TOKENS_KEY, load_banned_tokens(), None)
+    try:
+        cache.incr(BANNED_TOKENS_VERSION_KEY)
+    except ValueError:
+        cache.set(BANNED_TOKENS_VERSION_KEY, 1, None)
+
+
+def revoke_session_sockets(session_token):
+    """Close every open WebSocket of a session, on every worker."""
+    channel_layer = get_channel_layer()
+    async_to_sync(channel_layer.group_send)(
+        session_group_name(session_token),
+        {'type': 'session_revoked'}
+    )
+
+
+def ban_session(session, reason, banned_by, expires_at=None):
+    """Ban a session, record the ban and disconnect its live sockets."""
+    session.is_banned = True
+    session.banned_until = expires_at
+    session.save(update_fields=['is_banned', 'banned_until'])
+    ban = BannedSession.objects.create(
+        session=session,
+        reason=reason,
+        banned_by=banned_by,
+        expires_at=expires_at
+    )
+    invalidate_cached_session(session.session_token)
+    publish_banned_tokens()
+    revoke_session_sockets(session.session_token)
+    return ban
+
+
+def unban_session(session):
+    """Lift a session's ban."""
+    session.is_banned = False
+    session.banned_until = None
+    session.save(update_fields=['is_banned', 'banned_until'])
+    invalidate_cached_session(session.session_token)
+    publish_banned_tokens()
+
+
+QUEUE_ORDERING = ['-reported_count', '-timestamp', '-id']
+
+
+def encode_queue_cursor(message):
+    """Opaque cursor pointing just after a message in queue order."""
+    raw = f"{message.reported_count}|{message.timestamp.isoformat()}|{message.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_queue_cursor(cursor):
+    """Decode a queue cursor into (reported_count, timestamp, id); raises ValueError if malformed."""
+    count, timestamp, message_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+    return int(count), datetime.fromisoformat(timestamp), int(message_id)
+
+
+def _queue_page(queryset, status, cursor, limit):
+    """One page of a report queue using keyset pagination over the queue index."""
+    if status:
+        queryset = queryset.filter(report_status=status)
+    else:
+        queryset = queryset.exclude(report_status='')
+    if cursor:
+        count, timestamp, message_id = cursor
+        queryset = queryset.filter(
+            Q(reported_count__lt=count)
+            | Q(reported_count=count, timestamp__lt=timestamp)
+            | Q(reported_count=count, timestamp=timestamp, id__lt=message_id)
+        )
+    return list(queryset.order_by(*QUEUE_ORDERING).prefetch_related('session', 'room')[:limit])
+
+
+def report_queue(room=None, status='open', cursor=None, limit=50):
+    """
+    Reported messages in moderation order (most reported, then newest).
+    status is 'open', 'resolved' or None for both; room=None gives the global
+    queue, merged across message shards. Returns (messages, next_cursor).
+    """
+    decoded = decode_queue_cursor(cursor) if cursor else None
+    if room is not None:
+        messages = _queue_page(Message.objects.for_room(room), status, decoded, limit)
+    elif not sharding_enabled():
+        messages = _queue_page(Message.objects.all(), status, decoded, limit)
+    else:
+        messages = []
+        for alias in message_databases():
+            messages.extend(_queue_page(Message.objects.using(alias), status, decoded, limit))
+        messages.sort(key=lambda m: (m.reported_count, m.timestamp, m.id), reverse=True)
+        messages = messages[:limit]
+    next_cursor = encode_queue_cursor(messages[-1]) if len(messages) == limit else None
+    return messages, next_cursor
+
+
+def resolve_report(message, remove=False):
+    """Close a message's reports, optionally hiding the message."""
+    updates = {'report_status': 'resolved'}
+    if remove:
+        updates['is_deleted'] = True
+    Message.objects.using(message._state.db).filter(pk=message.pk).update(**updates)
+
+
+def _chunks(items, size=BULK_CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _ip_prefix(network):
+    """Leading text shared by every address in an IPv4 network, for a LIKE prefilter."""
+    if network.version != 4:
+        return ''
+    return ''.join(f'{octet}.' for octet in network.network_address.packed[:network.prefixlen // 8])
+
+
+def select_sessions(ip_range=None, nickname_pattern=None):
+    """
+    Sessions matching a CIDR range and/or a nickname regex.
+    IP ranges are narrowed in SQL by their octet prefix, then matched exactly.
+    """
+    queryset = Session.objects.all()
+    if nickname_pattern:
+        queryset = queryset.filter(nickname__regex=nickname_pattern)
+    if ip_range:
+        network = ipaddress.ip_network(ip_range, strict=False)
+        candidates = queryset.filter(
+            ip_address__isnull=False,
+            ip_address__startswith=_ip_prefix(network)
+        ).values_list('id', 'ip_address')
+        ids = []
+        for pk, ip in candidates.iterator(chunk_size=2000):
+            address = ipaddress.ip_address(ip)
+            if address.version == network.version and address in network:
+                ids.append(pk)
+        queryset = Session.objects.filter(id__in=ids)
+    return queryset
+
+
+def bulk_ban_sessions(queryset, reason, banned_by, expires_at=None, details=None):
+    """
+    Ban every not-yet-banned session in queryset in one transaction:
+    chunked UPDATEs, one bulk INSERT of ban records and one audit entry.
+    Returns the number of sessions banned.
+    """
+    with transaction.atomic():
+        targets = list(queryset.filter(is_banned=False).values_list('id', 'session_token'))
+        ids = [pk for pk, _ in targets]
+        for chunk in _chunks(ids):
+            Session.objects.filter(id__in=chunk).update(is_banned=True, banned_until=expires_at)
+        BannedSession.objects.bulk_create(
+            [BannedSession(session_id=pk, reason=reason, banned_by=banned_by, expires_at=expires_at)
+             for pk in ids],
+            batch_size=BULK_CHUNK_SIZE
+        )
+        AuditLog.objects.create(
+            event_type='session_ban',
+            details={'action': 'bulk_ban', 'count': len(ids), 'banned_by': banned_by,
+                     'reason': reason, **(details or {})}
+        )
+
+    tokens = [token for _, token in targets]
+    for token in tokens:
+        invalidate_cached_session(token)
+    publish_banned_tokens()
+    for token in tokens:
+        revoke_session_sockets(token)
+    return len(ids)
+
+
+def bulk_unban_sessions(queryset, unbanned_by):
+    """Lift bans on every banned session in queryset; returns the number unbanned."""
+    with transaction.atomic():
+        targets = list(queryset.filter(is_banned=True).values_list('id', 'session_token'))
+        ids = [pk for pk, _ in targets]
+        for chunk in _chunks(ids):
+            Session.objects.filter(id__in=chunk).update(is_banned=False, banned_until=None)
+        AuditLog.objects.create(
+            event_type='admin_action',
+            details={'action': 'bulk_unban', 'count': len(ids), 'unbanned_by': unbanned_by}
+        )
+
+    for _, token in targets:
+        invalidate_cached_session(token)
+    publish_banned_tokens()
+    return len(ids)
+
+
+class BannedTokenSet:
+    """
+    Process-local copy of the shared banned-token map.
+    Membership checks are plain dict lookups; the map is re-read from the
+    cache only when its version changes, checked at most every refresh_interval.
+    """
+
+    def __init__(self, refresh_interval):
+        self.refresh_interval = refresh_interval
+        self._tokens = {}
+        self._version = None
+        self._checked_at = float('-inf')
+
+    def __contains__(self, session_token):
+        if session_token not in self._tokens:
+            return False
+        expires = self._tokens[session_token]
+        return expires is None or expires > time.time()
+
+    def is_stale(self):
+        """True when it is time to compare the local copy with the shared version."""
+        return time.monotonic() - self._checked_at >= self.refresh_interval
+
+    def refresh(self):
+        """Reload the map if another process published a change (may hit the DB)."""
+        self._checked_at = time.monotonic()
+        version = cache.get(BANNED_TOKENS_VERSION_KEY)
+        if version is not None and version == self._version:
+            return
+        tokens = cache.get(BANNED_TOKENS_KEY)
+        if tokens is None:
+            # Shared copy evicted or never published: rebuild it from the DB
+            tokens = load_banned_tokens()
+            cache.set(BANNED_TOKENS_KEY, tokens, None)
+            cache.add(BANNED_TOKENS_VERSION_KEY, 0, None)
+            version = cache.get(BANNED_TOKENS_VERSION_KEY)
+        self._tokens = tokens
+        self._version = version
+
+
+class IPPrefixTrie:
+    """
+    Binary radix trie of IP networks, one trie per address family.
+    Each node is [zero_child, one_child, expiry]; expiry is set on nodes
+    ending a banned prefix (None = permanent, missing = not a prefix end).
+    """
+    _NOT_TERMINAL = object()
+
+    def __init__(self):
+        self._roots = {4: self._node(), 6: self._node()}
+
+    def _node(self):
+        return [None, None, self._NOT_TERMINAL]
+
+    def insert(self, network, expires=None):
+        """Add a network; expires is a unix timestamp or None for permanent."""
+        node = self._roots[network.version]
+        bits = int(network.network_address)
+        width = network.max_prefixlen
+        for depth in range(network.prefixlen):
+            bit = (bits >> (width - 1 - depth)) & 1
+            if node[bit] is None:
+                node[bit] = self._node()
+            node = node[bit]
+        current = node[2]
+        if current is self._NOT_TERMINAL or (current is not None and (expires is None or expires > current)):
+            node[2] = expires
+
+    def contains(self, address, now):
+        """True if any unexpired network in the trie contains address."""
+        node = self._roots[address.version]
+        bits = int(address)
+        width = address.max_prefixlen
+        depth = 0
+        while node is not None:
+            expires = node[2]
+            if expires is not self._NOT_TERMINAL and (expires is None or expires > now):
+                return True
+            if depth == width:
+                return False
+            node = node[(bits >> (width - 1 - depth)) & 1]
+            depth += 1
+        return False
+
+
+def publish_ip_bans(sender=None, **kwargs):
+    """Signal every worker to rebuild its IP ban trie (connected to IPBan save/delete)."""
+    try:
+        cache.incr(IP_BANS_VERSION_KEY)
+    except ValueError:
+        cache.set(IP_BANS_VERSION_KEY, 1, None)
+
+
+class IPBanIndex:
+    """
+    Process-local IP ban trie, loaded once from the database and rebuilt
+    only when the shared version changes (checked every refresh_interval).
+    """
+
+    def __init__(self, refresh_interval):
+        self.refresh_interval = refresh_interval
+        self._trie = IPPrefixTrie()
+        self._version = None
+        self._loaded = False
+        self._checked_at = float('-inf')
+
+    def is_stale(self):
+        """True when it is time to compare the local trie with the shared version."""
+        return time.monotonic() - self._checked_at >= self.refresh_interval
+
+    def refresh(self):
+        """Rebuild the trie from the database if bans changed (may hit the DB)."""
+        self._checked_at = time.monotonic()
+        version = cache.get(IP_BANS_VERSION_KEY)
+        if self._loaded and version == self._version:
+            return
+        trie = IPPrefixTrie()
+        now = timezone.now()
+        bans = IPBan.objects.filter(Q(expires_at__isnull=True) | Q(expires_at__gt=now))
+        for network, expires_at in bans.values_list('network', 'expires_at'):
+            trie.insert(ipaddress.ip_network(network, strict=False),
+                        expires_at.timestamp() if expires_at else None)
+        self._trie = trie
+        self._version = version
+        self._loaded = True
+
+    def is_banned(self, ip):
+        """Check an address string against the loaded bans (no DB access)."""
+        try:
+            address = ipaddress.ip_address(ip.strip())
+        except (ValueError, AttributeError):
+            return False
+        return self._trie.contains(address, time.time())
+
+
+banned_tokens = BannedTokenSet(settings.BANNED_TOKENS_REFRESH_INTERVAL)
+ip_bans = IPBanIndex(settings.BANNED_TOKENS_REFRESH_INTERVAL)
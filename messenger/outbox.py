@@ -0,0 +1,153 @@
+"""
+Bounded per-connection outbound queue for WebSocket frames.
+Channel-layer handlers enqueue frames and return at once; a writer task drains the
+queue into the socket. A slow reader therefore backs up only its own queue rather
+than the consumer's channel-layer inbox (where the layer would silently drop room
+messages once it reached capacity). When the queue is full, WS_OUTBOX_POLICY
+decides what gives:
+
+    drop_oldest  discard the oldest queued frame
+    coalesce     a newer frame replaces a queued one with the same key (typing
+                 indicators and roster updates per participant), whether or
+                 not the queue is full;
+                 beyond that, drop the oldest
+    disconnect   close the socket with SLOW_CONSUMER_CLOSE_CODE after a `resync`
+                 frame carrying the id of the last message delivered, so the
+                 client can reload history and reconnect
+
+A chat message is never dropped silently: once the queue has drained, a socket
+that lost one gets a `resync` frame (reason `dropped`) with the id of the last
+message delivered before the gap, and stays open while the client reloads
+history.
+"""
+import asyncio
+import logging
+from collections import deque
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+DROP_OLDEST = 'drop_oldest'
+COALESCE = 'coalesce'
+DISCONNECT = 'disconnect'
+POLICIES = (DROP_OLDEST, COALESCE, DISCONNECT)
+
+SLOW_CONSUMER_CLOSE_CODE = 4008
+
+WS_FRAMES_DROPPED = registry.counter('messenger_ws_frames_dropped_total',
+                                     'Outbound frames discarded for slow sockets', ['type', 'reason'])
+WS_SLOW_CONSUMERS = registry.counter('messenger_ws_slow_consumer_disconnects_total',
+                                     'Sockets closed because their outbound queue overflowed')
+WS_RESYNCS = registry.counter('messenger_ws_resyncs_total',
+                              'Resync frames sent to sockets that lost chat messages')
+WS_OUTBOX_HIGH_WATER = registry.histogram('messenger_ws_outbox_high_water_frames',
+                                          'Deepest outbound queue reached per connection',
+                                          buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000))
+
+
+class Outbox:
+    """FIFO of frames for one socket, drained by its own writer task."""
+
+    def __init__(self, write, overflow, failed, max_frames, policy):
+        self.write = write
+        self.overflow = overflow
+        # Called when a frame cannot be written; the socket must not stay open without a writer
+        self.failed = failed
+        self.max_frames = max_frames
+        self.policy = policy
+        # Entries are [key, frame, on_sent]; `keyed` points at the queued entry for each coalesce key
+        self.entries = deque()
+        self.keyed = {}
+        self.high_water = 0
+        self.last_message_id = None
+        # Set (to the last message delivered before it) when a chat message was dropped
+        self.gap = False
+        self.gap_after = None
+        self.closed = False
+        self.ready = asyncio.Event()
+        # Set while nothing is queued or being written
+        self.idle = asyncio.Event()
+        self.idle.set()
+        self.task = asyncio.ensure_future(self.drain())
+
+    def put(self, frame, key=None, on_sent=None):
+        if self.closed:
+            return
+        if key is not None and self.policy == COALESCE and key in self.keyed:
+            WS_FRAMES_DROPPED.inc(type=frame['type'], reason='coalesced')
+            self.keyed[key][1:] = [frame, on_sent]
+            return
+        if len(self.entries) >= self.max_frames:
+            if self.policy == DISCONNECT:
+                WS_FRAMES_DROPPED.inc(type=frame['type'], reason='disconnect')
+                self.close(reason='disconnect')
+                self.overflow()
+                return
+            self._discard(self.entries[0])
+            dropped = self.entries.popleft()[1]
+            WS_FRAMES_DROPPED.inc(type=dropped['type'], reason='drop_oldest')
+            if dropped['type'] == 'chat_message' and not self.gap:
+                self.gap = True
+                self.gap_after = self.last_message_id
+        entry = [key, frame, on_sent]
+        self.entries.append(entry)
+        if key is not None:
+            self.keyed[key] = entry
+        self.high_water = max(self.high_water, len(self.entries))
+        self.idle.clear()
+        self.ready.set()
+
+    def _discard(self, entry):
+        if entry[0] is not None and self.keyed.get(entry[0]) is entry:
+            del self.keyed[entry[0]]
+
+    async def drain(self):
+        while True:
+            await self.ready.wait()
+            while self.entries:
+                self._discard(self.entries[0])
+                _, frame, on_sent = self.entries.popleft()
+                if not await self._write(frame):
+                    return
+                if on_sent is not None:
+                    on_sent()
+                if frame['type'] == 'chat_message' and frame['data'].get('id') is not None:
+                    self.last_message_id = frame['data']['id']
+            if self.gap:
+                # Sent only now, so the reload it triggers follows every queued message
+                self.gap = False
+                if not await self._write({'type': 'resync', 'reason': 'dropped', 'last_message_id': self.gap_after}):
+                    return
+                WS_RESYNCS.inc()
+                if self.entries:
+                    continue
+            self.ready.clear()
+            self.idle.set()
+
+    async def _write(self, frame):
+        try:
+            await self.write(frame)
+        except Exception:
+            logger.info('Outbound %s frame not written; closing the socket', frame['type'], exc_info=True)
+            self.closed = True
+            self.idle.set()
+            self.failed()
+            return False
+        return True
+
+    async def flushed(self):
+        """Wait until every queued frame has been written."""
+        await self.idle.wait()
+
+    def close(self, reason='closed'):
+        """Stop the writer and discard whatever is still queued."""
+        self.closed = True
+        for _, frame, _ in self.entries:
+            WS_FRAMES_DROPPED.inc(type=frame['type'], reason=reason)
+        self.entries.clear()
+        self.keyed.clear()
+        self.idle.set()
+        self.task.cancel()
+        if self.high_water:
+            WS_OUTBOX_HIGH_WATER.observe(self.high_water)
+            self.high_water = 0
@@ -0,0 +1,187 @@
+"""
+Opt-in request profiling and slow-query capture.
+ProfilingMiddleware profiles a sample of requests (PROFILING_SAMPLE_RATE) and any
+staff request sending the PROFILING_HEADER. For each it records query count, DB
+time, serializer time and a cProfile (or pyinstrument) trace; profiles over
+PROFILING_THRESHOLD_MS, and all forced ones, go into a per-process ring shown at
+/admin/profiles/. Queries slower than SLOW_QUERY_MS are logged and kept in a
+second ring whether or not the request is profiled. Serializer time includes the
+lazy queries a serializer triggers, so it overlaps DB time.
+"""
+import cProfile
+import io
+import pstats
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+import logging
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils import timezone
+
+try:
+    from pyinstrument import Profiler as PyinstrumentProfiler
+except ImportError:  # optional; cProfile is used instead
+    PyinstrumentProfiler = None
+
+logger = logging.getLogger(__name__)
+
+_current = ContextVar('request_profile', default=None)
+_ids = iter(range(1, 2 ** 62))
+_ids_lock = threading.Lock()
+
+profiles = deque(maxlen=settings.PROFILING_RING_SIZE)
+slow_queries = deque(maxlen=settings.PROFILING_RING_SIZE)
+
+
+@dataclass
+class RequestProfile:
+    method: str
+    path: str
+    forced: bool
+    started_at: object = field(default_factory=timezone.now)
+    id: int = 0
+    status: int = 0
+    duration_ms: float = 0.0
+    query_count: int = 0
+    db_ms: float = 0.0
+    serializer_ms: float = 0.0
+    queries: list = field(default_factory=list)
+    trace: str = ''
+    # Serializers nest; only the outermost one is timed
+    _serializer_depth: int = 0
+
+    @property
+    def other_ms(self):
+        return max(self.duration_ms - self.db_ms - self.serializer_ms, 0.0)
+
+
+def db_profile_wrapper(execute, sql, params, many, context):
+    """execute_wrapper: time every query, capture slow ones and attribute time to the active profile."""
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        profile = _current.get()
+        if profile is not None:
+            profile.query_count += 1
+            profile.db_ms += elapsed_ms
+            if len(profile.queries) < 200:
+                profile.queries.append((round(elapsed_ms, 3), sql[:500]))
+        if settings.SLOW_QUERY_MS and elapsed_ms >= settings.SLOW_QUERY_MS:
+            alias = context['connection'].alias
+            logger.warning('Slow query on %s (%.1f ms): %s', alias, elapsed_ms, sql[:500])
+            slow_queries.append({
+                'at': timezone.now(),
+                'alias': alias,
+                'ms': round(elapsed_ms, 3),
+                'sql': sql[:2000],
+                'path': profile.path if profile else None,
+            })
+
+
+def instrument_connection(sender, connection, **kwargs):
+    """connection_created hook installing db_profile_wrapper."""
+    if db_profile_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(db_profile_wrapper)
+
+
+@contextmanager
+def profile_section(name):
+    """Attribute the block's time to `<name>_ms` of the active profile (outermost block only)."""
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+    depth_attr = f'_{name}_depth'
+    depth = getattr(profile, depth_attr)
+    setattr(profile, depth_attr, depth + 1)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        setattr(profile, depth_attr, depth)
+        if depth == 0:
+            setattr(profile, f'{name}_ms', getattr(profile, f'{name}_ms') + (time.perf_counter() - start) * 1000)
+
+
+class ProfiledSerializerMixin:
+    """Serializer mixin reporting representation time to the active request profile."""
+
+    def to_representation(self, instance):
+        with profile_section('serializer'):
+            return super().to_representation(instance)
+
+
+class _Tracer:
+    """cProfile or pyinstrument behind one start/stop/report interface."""
+
+    def __init__(self):
+        use_pyinstrument = settings.PROFILING_ENGINE == 'pyinstrument' and PyinstrumentProfiler is not None
+        self.profiler = PyinstrumentProfiler() if use_pyinstrument else cProfile.Profile()
+
+    def start(self):
+        if isinstance(self.profiler, cProfile.Profile):
+            self.profiler.enable()
+        else:
+            self.profiler.start()
+
+    def stop(self):
+        if isinstance(self.profiler, cProfile.Profile):
+            self.profiler.disable()
+        else:
+            self.profiler.stop()
+
+    def report(self, limit=40):
+        if not isinstance(self.profiler, cProfile.Profile):
+            return self.profiler.output_text(unicode=True, color=False)
+        out = io.StringIO()
+        pstats.Stats(self.profiler, stream=out).sort_stats('cumulative').print_stats(limit)
+        return out.getvalue()
+
+
+class ProfilingMiddleware:
+    """Profile sampled or explicitly requested requests; keep the slow ones."""
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def should_profile(self, request):
+        """Return (profile?, forced?)."""
+        user = getattr(request, 'user', None)
+        if request.headers.get(settings.PROFILING_HEADER) and user is not None and user.is_staff:
+            return True, True
+        return random.random() < settings.PROFILING_SAMPLE_RATE, False
+
+    def __call__(self, request):
+        profile_it, forced = self.should_profile(request)
+        if not profile_it:
+            return self.get_response(request)
+
+        profile = RequestProfile(method=request.method, path=request.path, forced=forced)
+        token = _current.set(profile)
+        tracer = _Tracer()
+        start = time.perf_counter()
+        tracer.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            tracer.stop()
+            _current.reset(token)
+        profile.duration_ms = (time.perf_counter() - start) * 1000
+        profile.status = response.status_code
+
+        if forced or profile.duration_ms >= settings.PROFILING_THRESHOLD_MS:
+            profile.trace = tracer.report()
+            with _ids_lock:
+                profile.id = next(_ids)
+            profiles.append(profile)
+            response['X-Profile-Id'] = str(profile.id)
+        return response
@@ -0,0 +1,158 @@
+"""
+WebSocket frame encodings, negotiated with the Sec-WebSocket-Protocol header.
+
+    messenger.json        the verbose JSON frames (also used when the client offers no subprotocol)
+    messenger.compact.v1  JSON with one- or two-letter keys and type codes, `data` flattened
+    messenger.msgpack.v1  the compact frames as MessagePack binary (needs the msgpack package)
+
+Compact frames by type (verbose type -> code, verbose key -> short key):
+
+    chat_message        m   id i, participant_id p, content c, timestamp ts
+    typing              y   participant_id p, is_typing y
+    roster              p   participant_id i (the client's own), participants l
+    participant_joined  pj  participant_id i, nickname n
+    participant_left    pl  participant_id i
+    error               e   message m
+    resync              r   reason r, last_message_id l
+    reconnect           rc  reason r, retry_after_ms d
+
+Compact frames leave out the sender nickname of messages and typing indicators;
+clients look it up in the roster (see messenger.roster). Unknown types and keys
+pass through unchanged. A broadcast hands every recipient
+the same `data` payload, so its encoding is cached and reused across sockets.
+"""
+import json
+from collections import OrderedDict
+
+try:
+    import msgpack
+except ImportError:  # optional; messenger.msgpack.v1 is offered only when installed
+    msgpack = None
+
+JSON = 'messenger.json'
+COMPACT_JSON = 'messenger.compact.v1'
+MSGPACK = 'messenger.msgpack.v1'
+
+# A key mapped to None is left out of compact frames
+COMPACT_FRAMES = {
+    'chat_message': ('m', {'id': 'i', 'participant_id': 'p', 'session_nickname': None, 'content': 'c',
+                           'timestamp': 'ts'}),
+    'typing': ('y', {'participant_id': 'p', 'nickname': None, 'is_typing': 'y'}),
+    'roster': ('p', {'participant_id': 'i', 'participants': 'l'}),
+    'participant_joined': ('pj', {'participant_id': 'i', 'nickname': 'n'}),
+    'participant_left': ('pl', {'participant_id': 'i'}),
+    'error': ('e', {'message': 'm'}),
+    'resync': ('r', {'reason': 'r', 'last_message_id': 'l'}),
+    'reconnect': ('rc', {'reason': 'r', 'retry_after_ms': 'd'}),
+}
+VERBOSE_FRAMES = {
+    code: (frame_type, {short: key for key, short in keys.items() if short is not None})
+    for frame_type, (code, keys) in COMPACT_FRAMES.items()
+}
+
+# Distinct broadcast payloads whose encodings are kept per codec
+SHARED_ENCODINGS = 64
+
+
+class ProtocolError(ValueError):
+    """A client frame that cannot be decoded."""
+
+
+class JsonCodec:
+    subprotocol = JSON
+
+    def __init__(self):
+        self._shared = OrderedDict()
+
+    def encode(self, frame):
+        """Return (text_data, bytes_data) for a verbose frame."""
+        payload = frame.get('data')
+        if payload is None:
+            return self.serialize(self.to_wire(frame))
+        # Keyed by identity; the payload itself is held so its id cannot be reused while cached
+        key = (frame['type'], id(payload))
+        cached = self._shared.get(key)
+        if cached is not None and cached[0] is payload:
+            return cached[1]
+        encoded = self.serialize(self.to_wire(frame))
+        self._shared[key] = (payload, encoded)
+        if len(self._shared) > SHARED_ENCODINGS:
+            self._shared.popitem(last=False)
+        return encoded
+
+    def decode(self, text_data=None, bytes_data=None):
+        """Return the verbose frame a client sent."""
+        try:
+            wire = self.deserialize(text_data, bytes_data)
+        except (ValueError, TypeError) as exc:
+            raise ProtocolError(str(exc)) from exc
+        if not isinstance(wire, dict):
+            raise ProtocolError('Frame is not an object')
+        return self.from_wire(wire)
+
+    def to_wire(self, frame):
+        return frame
+
+    def from_wire(self, wire):
+        return wire
+
+    def serialize(self, wire):
+        return json.dumps(wire), None
+
+    def deserialize(self, text_data, bytes_data):
+        return json.loads(text_data if text_data is not None else bytes_data)
+
+
+class CompactJsonCodec(JsonCodec):
+    subprotocol = COMPACT_JSON
+
+    def to_wire(self, frame):
+        frame_type = frame['type']
+        if frame_type not in COMPACT_FRAMES:
+            return frame
+        code, keys = COMPACT_FRAMES[frame_type]
+        fields = frame['data'] if 'data' in frame else frame
+        wire = {'t': code}
+        for key, value in fields.items():
+            short = keys.get(key, key)
+            if key != 'type' and short is not None:
+                wire[short] = value
+        return wire
+
+    def from_wire(self, wire):
+        if wire.get('t') not in VERBOSE_FRAMES:
+            return wire
+        frame_type, keys = VERBOSE_FRAMES[wire['t']]
+        frame = {'type': frame_type}
+        for key, value in wire.items():
+            if key != 't':
+                frame[keys.get(key, key)] = value
+        return frame
+
+    def serialize(self, wire):
+        return json.dumps(wire, separators=(',', ':'), ensure_ascii=False), None
+
+
+class MsgpackCodec(CompactJsonCodec):
+    subprotocol = MSGPACK
+
+    def serialize(self, wire):
+        return None, msgpack.packb(wire)
+
+    def deserialize(self, text_data, bytes_data):
+        if bytes_data is None:
+            raise ProtocolError('Expected a binary frame')
+        return msgpack.unpackb(bytes_data)
+
+
+CODECS = {JSON: JsonCodec(), COMPACT_JSON: CompactJsonCodec()}
+if msgpack is not None:
+    CODECS[MSGPACK] = MsgpackCodec()
+
+
+def negotiate(offered):
+    """Pick the codec for the client's offered subprotocols (in its order of preference)."""
+    for subprotocol in offered or ():
+        if subprotocol in CODECS:
+            return CODECS[subprotocol]
+    return CODECS[JSON]
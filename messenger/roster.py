@@ -0,0 +1,158 @@
+"""
+Per-room participant ids and the roster of who is connected.
+Each session gets a small integer id the first time it connects to a room, kept
+for ROOM_ROSTER_TTL seconds after its last connect, so room frames can refer to
+`participant_id` instead of repeating nicknames and the sender of a broadcast is
+recognised by id (two people may share a nickname). A client gets the full roster
+once on connect; after that participant_joined/participant_left events keep it
+current.
+
+Ids, per-participant connection counts and the live roster (one id -> nickname
+mapping per room, so reading it costs one lookup for the mapping plus one
+batched lookup of the counts) live in the cache, which must be shared between
+workers (CACHE_REDIS_URL) for ids to agree across them. Roster changes are made
+under a short cache lock, and only when a participant's first connection opens
+or its last one closes.
+
+A worker that is killed never counts its connections down. Connection counts
+therefore expire after ROOM_ROSTER_HEARTBEAT * 3 seconds unless the worker
+holding them refreshes them (heartbeat()), and a participant whose count has
+expired is left out of snapshots and pruned from the mapping on the next join.
+"""
+import logging
+import time
+import uuid
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.cache import cache
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+ROSTER_LOCK_TIMEOUTS = registry.counter('messenger_roster_lock_timeouts_total',
+                                        'Roster updates made without the room lock after waiting for it')
+
+# Seconds a roster lock is held at most (if its holder dies) and waited for
+LOCK_TIMEOUT = 5
+LOCK_WAIT = 1
+
+
+def _sequence_key(room_code):
+    return f'roster:{room_code}:seq'
+
+
+def _session_key(room_code, session_id):
+    return f'roster:{room_code}:session:{session_id}'
+
+
+def _live_key(room_code):
+    return f'roster:{room_code}:live'
+
+
+def _connections_key(room_code, participant_id):
+    return f'roster:{room_code}:connections:{participant_id}'
+
+
+def _connections_ttl():
+    # Three missed heartbeats before a dead worker's connections stop counting
+    return settings.ROOM_ROSTER_HEARTBEAT * 3
+
+
+def _connected(room_code, live):
+    """The entries of `live` whose participant still has a connection count."""
+    counts = cache.get_many([_connections_key(room_code, pid) for pid in live])
+    return {pid: nickname for pid, nickname in live.items() if _connections_key(room_code, pid) in counts}
+
+
+@contextmanager
+def _locked(room_code):
+    key = f'roster:{room_code}:lock'
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + LOCK_WAIT
+    while not cache.add(key, token, LOCK_TIMEOUT):
+        if time.monotonic() > deadline:
+            # Better a roster update racing another than a stalled connect
+            logger.warning('Roster lock for room %s not acquired within %ss', room_code, LOCK_WAIT)
+            ROSTER_LOCK_TIMEOUTS.inc()
+            break
+        time.sleep(0.005)
+    try:
+        yield
+    finally:
+        if cache.get(key) == token:
+            cache.delete(key)
+
+
+def assign_participant_id(room_code, session):
+    """The session's id in this room, assigning the next free one on its first connect."""
+    key = _session_key(room_code, session.pk)
+    assigned = cache.get(key)
+    if assigned is None:
+        cache.add(_sequence_key(room_code), 0, None)
+        # A concurrent connect of the same session may claim the key first; its id wins
+        cache.add(key, cache.incr(_sequence_key(room_code)), settings.ROOM_ROSTER_TTL)
+        assigned = cache.get(key)
+    else:
+        cache.touch(key, settings.ROOM_ROSTER_TTL)
+    return assigned
+
+
+def join(room_code, participant_id, nickname):
+    """Count one more connection for the participant; True for its first (it just joined)."""
+    key = _connections_key(room_code, participant_id)
+    cache.add(key, 0, _connections_ttl())
+    connections = cache.incr(key)
+    cache.touch(key, _connections_ttl())
+    # Also re-added when its entry has expired while it stayed connected
+    if (cache.get(_live_key(room_code)) or {}).get(participant_id) != nickname:
+        with _locked(room_code):
+            # Entries left behind by killed workers are dropped rather than kept alive
+            live = _connected(room_code, cache.get(_live_key(room_code)) or {})
+            live[participant_id] = nickname
+            cache.set(_live_key(room_code), live, settings.ROOM_ROSTER_TTL)
+    return connections == 1
+
+
+def leave(room_code, participant_id):
+    """Count one connection less; True when it was the participant's last (it left)."""
+    key = _connections_key(room_code, participant_id)
+    try:
+        connections = cache.decr(key)
+    except ValueError:
+        # Expired or evicted: nothing left to count down
+        connections = 0
+    if connections > 0:
+        return False
+    cache.delete(key)
+    with _locked(room_code):
+        live = cache.get(_live_key(room_code)) or {}
+        live.pop(participant_id, None)
+        if live:
+            cache.set(_live_key(room_code), live, settings.ROOM_ROSTER_TTL)
+        else:
+            cache.delete(_live_key(room_code))
+    return True
+
+
+def heartbeat(held):
+    """Keep this worker's connection counts alive; `held` maps (room_code, participant_id, nickname) to a count."""
+    rooms = {}
+    for (room_code, participant_id, nickname), connections in held.items():
+        key = _connections_key(room_code, participant_id)
+        if not cache.touch(key, _connections_ttl()):
+            # Expired while connected (a stalled worker, an evicted key): count this worker's again
+            cache.add(key, connections, _connections_ttl())
+        rooms.setdefault(room_code, {})[participant_id] = nickname
+    for room_code, participants in rooms.items():
+        live = cache.get(_live_key(room_code)) or {}
+        if any(live.get(pid) != nickname for pid, nickname in participants.items()):
+            with _locked(room_code):
+                live = cache.get(_live_key(room_code)) or {}
+                live.update(participants)
+                cache.set(_live_key(room_code), live, settings.ROOM_ROSTER_TTL)
+
+
+def snapshot(room_code):
+    """[participant_id, nickname] pairs of everyone connected to the room, in id order."""
+    live = _connected(room_code, cache.get(_live_key(room_code)) or {})
+    return sorted([pid, nickname] for pid, nickname in live.items())
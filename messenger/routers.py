@@ -0,0 +1,127 @@
+"""Database routers for the messenger app."""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from django.conf import settings
+from django.core.cache import cache
+from .sharding import shard_for_room, sharding_enabled
+
+REPLICA_ALIAS = 'replica'
+
+# Models (lowercase names in the messenger app) stored on the message shards
+SHARDED_MODELS = {'message', 'messagereport'}
+
+# Alias reads should go to for the current request/consumer call (None = default)
+_read_alias = ContextVar('messenger_read_alias', default=None)
+
+
+def replica_configured():
+    """Return True when a read replica database alias is configured."""
+    return REPLICA_ALIAS in settings.DATABASES
+
+
+def _pin_key(session_token):
+    return f"dbpin:{session_token}"
+
+
+def mark_recent_write(session_token):
+    """Pin a session's reads to the primary for READ_YOUR_WRITES_WINDOW seconds."""
+    if session_token and replica_configured():
+        cache.set(_pin_key(session_token), True, settings.READ_YOUR_WRITES_WINDOW)
+
+
+def is_pinned_to_primary(session_token):
+    """Check whether a session wrote recently and must read from the primary."""
+    return bool(session_token) and cache.get(_pin_key(session_token), False)
+
+
+@contextmanager
+def read_from_replica(session_token=None):
+    """Route reads inside the block to the replica unless the session wrote recently."""
+    if not replica_configured() or is_pinned_to_primary(session_token):
+        yield
+        return
+    token = _read_alias.set(REPLICA_ALIAS)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+def replica_reads(view):
+    """Decorator for read-only views: serve their queries from the replica."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        session_token = request.headers.get('X-Session-Token') or request.GET.get('session_token')
+        with read_from_replica(session_token):
+            return view(request, *args, **kwargs)
+    return wrapper
+
+
+class PrimaryReplicaRouter:
+    """Send writes to the primary and reads to the replica inside read_from_replica()."""
+
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Primary and replica hold the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica is populated by database replication, never by migrate
+        return db != REPLICA_ALIAS
+
+
+def _is_sharded(model):
+    return model._meta.app_label == 'messenger' and model._meta.model_name in SHARDED_MODELS
+
+
+class MessageShardRouter:
+    """Route sharded models to the shard owning their room when sharding is enabled."""
+
+    def _shard_from_hints(self, hints):
+        instance = hints.get('instance')
+        if instance is None:
+            return None
+        if instance._meta.model_name == 'room':
+            return shard_for_room(instance.code)
+        if instance._meta.model_name == 'messagereport':
+            return instance._state.db or instance.message._state.db
+        if _is_sharded(instance):
+            return instance._state.db or shard_for_room(instance.room.code)
+        return None
+
+    def db_for_read(self, model, **hints):
+        if not sharding_enabled():
+            return None
+        if _is_sharded(model):
+            return self._shard_from_hints(hints)
+        instance = hints.get('instance')
+        if instance is not None and _is_sharded(instance):
+            # Related rooms/sessions of a sharded row live on the primary, not the shard
+            return _read_alias.get() or 'default'
+        return None
+
+    def db_for_write(self, model, **hints):
+        if not sharding_enabled():
+            return None
+        if _is_sharded(model):
+            return self._shard_from_hints(hints)
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Sharded rows reference rooms/sessions on the primary without FK constraints
+        if _is_sharded(obj1) or _is_sharded(obj2):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.MESSAGE_SHARDS:
+            # Shards carry the messenger schema so FK columns resolve; only
+            # sharded tables hold rows there.
+            return app_label == 'messenger'
+        return None
@@ -0,0 +1,139 @@
+"""
+Full-text search over messages.
+SQLite uses an external-content FTS5 table kept in sync by triggers; PostgreSQL
+uses a GIN index on to_tsvector('simple', content). Soft-deleted messages are
+left out of both indexes.
+"""
+import re
+from datetime import timedelta
+from django.db import connections, router
+from django.db.models import BooleanField, FloatField
+from django.db.migrations.recorder import MigrationRecorder
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
+from .models import Message
+
+FTS_TABLE = 'messages_fts'
+SEARCH_MIGRATION = '0006_message_search'
+
+SQLITE_FTS_DDL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    f"content, content='messages', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    f"CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages "
+    f"WHEN NOT new.is_deleted BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.id, new.content); END",
+    f"CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages "
+    f"WHEN NOT old.is_deleted BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) VALUES ('delete', old.id, old.content); END",
+    # One trigger so the delete always runs before the insert for the same rowid
+    f"CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content, is_deleted ON messages BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) "
+    f"SELECT 'delete', old.id, old.content WHERE NOT old.is_deleted; "
+    f"INSERT INTO {FTS_TABLE}(rowid, content) SELECT new.id, new.content WHERE NOT new.is_deleted; END",
+]
+
+POSTGRES_FTS_DDL = [
+    "CREATE INDEX IF NOT EXISTS messages_content_fts ON messages "
+    "USING GIN (to_tsvector('simple', content)) WHERE NOT is_deleted",
+]
+
+_token = re.compile(r'\w+', re.UNICODE)
+
+
+def install_search_index(connection):
+    """Create the search index and its sync triggers if missing (idempotent)."""
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE name = %s", [FTS_TABLE])
+            created = cursor.fetchone() is None
+            for statement in SQLITE_FTS_DDL:
+                cursor.execute(statement)
+            if created:
+                cursor.execute(f"INSERT INTO {FTS_TABLE}(rowid, content) "
+                               f"SELECT id, content FROM messages WHERE NOT is_deleted")
+    elif connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            for statement in POSTGRES_FTS_DDL:
+                cursor.execute(statement)
+
+
+def ensure_search_index(sender, using, **kwargs):
+    """post_migrate hook: SQLite table rebuilds drop triggers, so reinstall them."""
+    if not router.allow_migrate_model(using, Message):
+        return
+    recorder = MigrationRecorder(connections[using])
+    if recorder.has_table() and recorder.migration_qs.filter(app='messenger', name=SEARCH_MIGRATION).exists():
+        install_search_index(connections[using])
+
+
+def fts5_query(query):
+    """Turn free text into a safe FTS5 query: all words required, last one as a prefix."""
+    tokens = _token.findall(query)
+    if not tokens:
+        return ''
+    quoted = [f'"{token}"' for token in tokens]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def search_room_messages(room, query, limit=20, offset=0):
+    """
+    Ranked search within a room's visible, unexpired messages.
+    Returns a list of messages, best match first.
+    """
+    cutoff = timezone.now() - timedelta(days=room.message_retention_days)
+    queryset = Message.objects.for_room(room).filter(is_deleted=False, timestamp__gte=cutoff)
+    alias = queryset.db
+    vendor = connections[alias].vendor
+
+    if vendor == 'sqlite':
+        match = fts5_query(query)
+        if not match:
+            return []
+        with connections[alias].cursor() as cursor:
+            cursor.execute(
+                f"SELECT m.id FROM {FTS_TABLE} JOIN messages m ON m.id = {FTS_TABLE}.rowid "
+                f"WHERE {FTS_TABLE} MATCH %s AND m.room_id = %s AND NOT m.is_deleted AND m.timestamp >= %s "
+                f"ORDER BY bm25({FTS_TABLE}), m.timestamp DESC LIMIT %s OFFSET %s",
+                [match, room.id, cutoff, limit, offset]
+            )
+            ids = [row[0] for row in cursor.fetchall()]
+        found = queryset.prefetch_related('session', 'room').in_bulk(ids)
+        return [found[pk] for pk in ids if pk in found]
+
+    if vendor == 'postgresql':
+        tsquery = "websearch_to_tsquery('simple', %s)"
+        return list(
+            queryset.filter(RawSQL(f"to_tsvector('simple', messages.content) @@ {tsquery}", [query],
+                                   output_field=BooleanField()))
+            .annotate(rank=RawSQL(f"ts_rank(to_tsvector('simple', messages.content), {tsquery})", [query],
+                                  output_field=FloatField()))
+            .order_by('-rank', '-timestamp')
+            .prefetch_related('session', 'room')[offset:offset + limit]
+        )
+
+    # Other backends: unindexed substring match, newest first
+    return list(queryset.filter(content__icontains=query).order_by('-timestamp')
+                .prefetch_related('session', 'room')[offset:offset + limit])
+
+
+def search_message_ids(query, limit=1000, using='default'):
+    """Ids of visible messages matching query in one database (for admin search)."""
+    connection = connections[using]
+    if connection.vendor == 'sqlite':
+        match = fts5_query(query)
+        if not match:
+            return []
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s LIMIT %s", [match, limit])
+            return [row[0] for row in cursor.fetchall()]
+    if connection.vendor == 'postgresql':
+        return list(
+            Message.objects.using(using).filter(
+                RawSQL("to_tsvector('simple', messages.content) @@ websearch_to_tsquery('simple', %s)", [query],
+                       output_field=BooleanField()),
+                is_deleted=False
+            ).values_list('id', flat=True)[:limit]
+        )
+    return list(Message.objects.using(using).filter(content__icontains=query, is_deleted=False)
+                .values_list('id', flat=True)[:limit])
@@ -1,9 +1,13 @@
 from rest_framework import serializers
 from .models import Session, Room, Message, AuditLog, BannedSession
+from .profiling import ProfiledSerializerMixin
+from .sharding import sharding_enabled
 import html
+import ipaddress
+import re
 
 
-class SessionSerializer(serializers.ModelSerializer):
+class SessionSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
     """Serializer for Session model."""
     
     class Meta:
@@ -12,7 +16,7 @@ class SessionSerializer(serializers.ModelSerializer):
         read_only_fields = ['session_token', 'created_at', 'last_active']
 
 
-class RoomSerializer(serializers.ModelSerializer):
+class RoomSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
     """Serializer for Room model."""
     owner_nickname = serializers.CharField(source='owner_session.nickname', read_only=True)
     participant_count = serializers.SerializerMethodField()
@@ -28,7 +32,7 @@ class RoomSerializer(serializers.ModelSerializer):
         return obj.messages.values('session').distinct().count()
 
 
-class MessageSerializer(serializers.ModelSerializer):
+class MessageSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
     """Serializer for Message model."""
     session_nickname = serializers.CharField(source='session.nickname', read_only=True)
     room_code = serializers.CharField(source='room.code', read_only=True)
@@ -89,6 +93,17 @@ class JoinRoomSerializer(serializers.Serializer):
 class ReportMessageSerializer(serializers.Serializer):
     """Serializer for reporting a message."""
     reason = serializers.CharField(max_length=500, required=False, allow_blank=True)
+    room_code = serializers.CharField(max_length=8, min_length=6, required=False)
+    
+    def validate_room_code(self, value):
+        """Validate and normalize room code."""
+        return value.upper().strip()
+    
+    def validate(self, data):
+        # Message ids repeat across shards; only the room says which one is meant
+        if sharding_enabled() and not data.get('room_code'):
+            raise serializers.ValidationError({'room_code': 'This field is required.'})
+        return data
     
     def validate_reason(self, value):
         """Sanitize report reason."""
@@ -97,7 +112,50 @@ class ReportMessageSerializer(serializers.Serializer):
         return value
 
 
-class AuditLogSerializer(serializers.ModelSerializer):
+class ResolveReportSerializer(serializers.Serializer):
+    """Serializer for resolving a reported message."""
+    # Message ids repeat across shards; the room says which message is meant
+    room_code = serializers.CharField(max_length=8, min_length=6)
+    remove = serializers.BooleanField(required=False, default=False)
+    
+    def validate_room_code(self, value):
+        """Validate and normalize room code."""
+        return value.upper().strip()
+
+
+class BulkBanSerializer(serializers.Serializer):
+    """Serializer for banning sessions by IP range and/or nickname pattern."""
+    ip_range = serializers.CharField(max_length=64, required=False, allow_blank=True)
+    nickname_pattern = serializers.CharField(max_length=200, required=False, allow_blank=True)
+    reason = serializers.CharField(max_length=500, required=False, default='Bulk ban by admin')
+    expires_at = serializers.DateTimeField(required=False, allow_null=True, default=None)
+    dry_run = serializers.BooleanField(required=False, default=False)
+    
+    def validate_ip_range(self, value):
+        """Validate CIDR notation (a bare address bans just that address)."""
+        if value:
+            try:
+                ipaddress.ip_network(value.strip(), strict=False)
+            except ValueError:
+                raise serializers.ValidationError("Invalid IP range.")
+        return value.strip()
+    
+    def validate_nickname_pattern(self, value):
+        """Validate the nickname regular expression."""
+        if value:
+            try:
+                re.compile(value)
+            except re.error:
+                raise serializers.ValidationError("Invalid nickname pattern.")
+        return value
+    
+    def validate(self, data):
+        if not data.get('ip_range') and not data.get('nickname_pattern'):
+            raise serializers.ValidationError("ip_range or nickname_pattern required.")
+        return data
+
+
+class AuditLogSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
     """Serializer for AuditLog model."""
     session_nickname = serializers.CharField(source='session.nickname', read_only=True)
     room_code = serializers.CharField(source='room.code', read_only=True)
@@ -110,7 +168,7 @@ class AuditLogSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'timestamp']
 
 
-class BannedSessionSerializer(serializers.ModelSerializer):
+class BannedSessionSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
     """Serializer for BannedSession model."""
     session_nickname = serializers.CharField(source='session.nickname', read_only=True)
     
@@ -0,0 +1,49 @@
+"""Room-based sharding of messages across database aliases."""
+import bisect
+import hashlib
+from functools import lru_cache
+from django.conf import settings
+
+
+class HashRing:
+    """Consistent hash ring mapping keys to nodes via virtual nodes."""
+
+    def __init__(self, nodes, vnodes=100):
+        self.nodes = list(nodes)
+        self._ring = sorted(
+            (self._hash(f"{node}#{replica}"), node)
+            for node in self.nodes
+            for replica in range(vnodes)
+        )
+        self._keys = [point for point, _ in self._ring]
+
+    @staticmethod
+    def _hash(key):
+        return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+    def get_node(self, key):
+        """Return the node owning `key` (first point clockwise on the ring)."""
+        index = bisect.bisect(self._keys, self._hash(key)) % len(self._keys)
+        return self._ring[index][1]
+
+
+@lru_cache(maxsize=8)
+def _ring_for(nodes, vnodes):
+    return HashRing(nodes, vnodes)
+
+
+def sharding_enabled():
+    """Return True when messages are spread over MESSAGE_SHARDS."""
+    return bool(settings.MESSAGE_SHARDS)
+
+
+def shard_for_room(room_code):
+    """Return the database alias holding messages for a room code."""
+    if not settings.MESSAGE_SHARDS:
+        return 'default'
+    return _ring_for(tuple(settings.MESSAGE_SHARDS), settings.MESSAGE_SHARD_VNODES).get_node(room_code)
+
+
+def message_databases():
+    """Return every database alias that may hold messages."""
+    return list(settings.MESSAGE_SHARDS) or ['default']
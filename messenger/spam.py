@@ -0,0 +1,199 @@
+"""
+Spam scoring applied to messages before they are saved and broadcast.
+Filters are configured with settings.SPAM_FILTERS; each returns a score and the
+pipeline maps the total to an action. State is per worker process and every
+filter does bounded work per message.
+"""
+import heapq
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+ALLOW = 'allow'
+THROTTLE = 'throttle'
+SHADOW_DROP = 'shadow_drop'
+
+
+class BoundedState(OrderedDict):
+    """LRU mapping of key -> per-key state, holding at most max_keys entries."""
+
+    def __init__(self, factory, max_keys=10000):
+        super().__init__()
+        self.factory = factory
+        self.max_keys = max_keys
+
+    def get_state(self, key):
+        state = self.get(key)
+        if state is None:
+            state = self[key] = self.factory()
+            if len(self) > self.max_keys:
+                self.popitem(last=False)
+        else:
+            self.move_to_end(key)
+        return state
+
+
+class SpamFilter:
+    """Base class: score() returns 0 for clean content, 1+ for likely spam."""
+    reason = 'spam'
+
+    def score(self, session_key, room_key, content, now):
+        raise NotImplementedError
+
+    def accepted(self, session_key, room_key, content, now):
+        """Called once the pipeline has allowed the message; filters that count sent messages record it here."""
+
+
+class DuplicateMessageFilter(SpamFilter):
+    """
+    Flag a session repeating the same or nearly the same message within a window.
+    Each message is reduced to a sketch: the `sketch_size` smallest Rabin-Karp
+    rolling hashes of its `shingle`-character substrings. Two messages count as
+    repeats when the sketches estimate their shingle overlap (Jaccard) at
+    `similarity` or more, so changing a character or two does not slip past.
+    Messages shorter than `min_length` ("ok", "lol") are never scored, and the
+    first `free_repeats` repeats are allowed.
+    """
+    reason = 'duplicate'
+    _whitespace = re.compile(r'\s+')
+    _base = 257
+    _modulus = (1 << 61) - 1
+
+    def __init__(self, window=60, history=20, min_length=12, free_repeats=1, shingle=4, sketch_size=16,
+                 similarity=0.7, max_sessions=10000):
+        self.window = window
+        self.min_length = min_length
+        self.free_repeats = free_repeats
+        self.shingle = shingle
+        self.sketch_size = sketch_size
+        self.similarity = similarity
+        self._drop = pow(self._base, shingle - 1, self._modulus)
+        self.sessions = BoundedState(lambda: deque(maxlen=history), max_sessions)
+
+    def sketch(self, text):
+        """The smallest rolling hashes over every shingle of the text."""
+        base, modulus, drop, width = self._base, self._modulus, self._drop, self.shingle
+        codes = [ord(char) for char in text]
+        value = 0
+        for code in codes[:width]:
+            value = (value * base + code) % modulus
+        hashes = {value}
+        for i in range(width, len(codes)):
+            value = ((value - codes[i - width] * drop) * base + codes[i]) % modulus
+            hashes.add(value)
+        return frozenset(heapq.nsmallest(self.sketch_size, hashes))
+
+    def similar(self, a, b):
+        # Bottom-k estimate: how many of the union's smallest hashes both sketches share
+        union = heapq.nsmallest(self.sketch_size, a | b)
+        shared = sum(1 for value in union if value in a and value in b)
+        return shared >= self.similarity * len(union)
+
+    def score(self, session_key, room_key, content, now):
+        text = self._whitespace.sub(' ', content.lower()).strip()
+        if len(text) < max(self.min_length, self.shingle):
+            return 0.0
+        sketch = self.sketch(text)
+        recent = self.sessions.get_state(session_key)
+        while recent and now - recent[0][0] > self.window:
+            recent.popleft()
+        repeats = sum(1 for _, seen in recent if self.similar(sketch, seen))
+        recent.append((now, sketch))
+        return float(max(0, repeats - self.free_repeats))
+
+
+class LinkFloodFilter(SpamFilter):
+    """Flag messages carrying more than max_links links."""
+    reason = 'link_flood'
+    _link = re.compile(r'(?:https?://|www\.)\S+', re.IGNORECASE)
+
+    def __init__(self, max_links=3):
+        self.max_links = max_links
+
+    def score(self, session_key, room_key, content, now):
+        links = len(self._link.findall(content))
+        return max(0.0, (links - self.max_links) / self.max_links) if links > self.max_links else 0.0
+
+
+class RepeatedCharacterFilter(SpamFilter):
+    """Flag long runs of one character (e.g. 'aaaaaaaaaaaa' or '!!!!!!!!!!!!')."""
+    reason = 'repeated_characters'
+
+    def __init__(self, max_run=12):
+        self._run = re.compile(r'(.)\1{%d,}' % max_run, re.DOTALL)
+
+    def score(self, session_key, room_key, content, now):
+        return 1.0 if self._run.search(content) else 0.0
+
+
+class RoomBurstFilter(SpamFilter):
+    """
+    Flag the sessions driving a burst: once a room has had more than burst_limit
+    accepted messages within window seconds, a session that sent at least
+    max_share of them is scored. Rejected messages are not counted, so a
+    throttled burst dies down, and other people in the room can keep talking.
+    """
+    reason = 'room_burst'
+
+    def __init__(self, burst_limit=30, window=5, max_share=0.25, max_rooms=10000):
+        self.burst_limit = burst_limit
+        self.window = window
+        self.max_share = max_share
+        self.rooms = BoundedState(lambda: deque(maxlen=burst_limit + 1), max_rooms)
+
+    def score(self, session_key, room_key, content, now):
+        recent = self.rooms.get_state(room_key)
+        while recent and now - recent[0][0] > self.window:
+            recent.popleft()
+        if len(recent) <= self.burst_limit:
+            return 0.0
+        sent = sum(1 for _, sender in recent if sender == session_key)
+        return 1.0 if sent >= self.max_share * len(recent) else 0.0
+
+    def accepted(self, session_key, room_key, content, now):
+        self.rooms.get_state(room_key).append((now, session_key))
+
+
+class SpamPipeline:
+    """Run every configured filter and turn the summed score into an action."""
+
+    def __init__(self, filters, throttle_score, shadow_drop_score):
+        self.filters = filters
+        self.throttle_score = throttle_score
+        self.shadow_drop_score = shadow_drop_score
+        # Filters keep shared state; views and consumers call check() from several threads
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        filters = [
+            import_string(config['class'])(**config.get('options', {}))
+            for config in settings.SPAM_FILTERS
+        ]
+        return cls(filters, settings.SPAM_THROTTLE_SCORE, settings.SPAM_SHADOW_DROP_SCORE)
+
+    def check(self, session_key, room_key, content):
+        """Return (action, reasons) for a message about to be sent."""
+        now = time.monotonic()
+        total = 0.0
+        reasons = []
+        with self._lock:
+            for spam_filter in self.filters:
+                score = spam_filter.score(session_key, room_key, content, now)
+                if score > 0:
+                    total += score
+                    reasons.append(spam_filter.reason)
+            if total < self.throttle_score:
+                for spam_filter in self.filters:
+                    spam_filter.accepted(session_key, room_key, content, now)
+        if total >= self.shadow_drop_score:
+            return SHADOW_DROP, reasons
+        if total >= self.throttle_score:
+            return THROTTLE, reasons
+        return ALLOW, reasons
+
+
+spam_pipeline = SpamPipeline.from_settings()
@@ -22,8 +22,7 @@ def cleanup_old_messages():
         retention_days = room.message_retention_days
         cutoff_date = timezone.now() - timedelta(days=retention_days)
         
-        old_messages = Message.objects.filter(
-            room=room,
+        old_messages = Message.objects.for_room(room).filter(
             timestamp__lt=cutoff_date,
             is_deleted=False
         )
@@ -0,0 +1,131 @@
+"""
+End-to-end latency of chat messages, stage by stage.
+ChatConsumer stamps a message when its frame is received, once it is stored and
+once group_send returns. The stamps travel with the channel-layer event, and every
+recipient adds the time its handler ran and the time its send finished. Each stage
+is observed in messenger_message_stage_seconds:
+
+    persist    frame received -> message stored (rate limits, spam checks, insert)
+    broadcast  message stored -> group_send returned
+    queue      message stored -> recipient handler runs (channel layer delivery)
+    send       recipient handler runs -> frame written to the socket (includes time
+               spent in the connection's outbound queue)
+    total      frame received -> frame written to a recipient's socket
+
+Stamps are wall-clock times because sender and recipient may be different worker
+processes, so cross-process stages are only as good as the hosts' clock sync.
+With TRACING_OTLP_ENDPOINT set and the opentelemetry SDK installed, a sample of
+messages is also exported as spans: one per message with persist/group_send
+children, and one deliver span per recipient.
+"""
+import logging
+import random
+import time
+from django.conf import settings
+from .metrics import registry
+
+try:
+    from opentelemetry import trace as otel_trace
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+except ImportError:  # optional; stage histograms work without it
+    otel_trace = None
+
+logger = logging.getLogger(__name__)
+
+STAGE_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+MESSAGE_STAGE_SECONDS = registry.histogram(
+    'messenger_message_stage_seconds', 'Chat message latency per delivery stage', ['stage'], STAGE_BUCKETS,
+)
+
+_tracer = None
+
+
+def get_tracer():
+    """The OpenTelemetry tracer for message spans, or None when export is off or unavailable."""
+    global _tracer
+    if _tracer is not None or not settings.TRACING_OTLP_ENDPOINT or otel_trace is None:
+        return _tracer or None
+    endpoint = settings.TRACING_OTLP_ENDPOINT
+    if endpoint == 'console':
+        exporter = ConsoleSpanExporter()
+    else:
+        try:
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        except ImportError:
+            logger.warning('TRACING_OTLP_ENDPOINT is set but opentelemetry-exporter-otlp is not installed')
+            _tracer = False
+            return None
+        exporter = OTLPSpanExporter(endpoint=endpoint)
+    # A private provider: the rest of the process keeps whatever global tracing it has
+    provider = TracerProvider(resource=Resource.create({'service.name': settings.TRACING_SERVICE_NAME}))
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    _tracer = provider.get_tracer(__name__)
+    return _tracer
+
+
+def _ns(timestamp):
+    return int(timestamp * 1e9)
+
+
+def start_trace():
+    """Stamp a chat_message frame as it arrives; returns the trace dict carried with the message."""
+    if not settings.MESSAGE_TRACING_ENABLED:
+        return None
+    return {'received': time.time(), 'sampled': random.random() < settings.TRACING_SAMPLE_RATE}
+
+
+def mark_persisted(trace, room_code):
+    """Stamp the stored message; returns the open message span when this one is exported."""
+    if trace is None:
+        return None
+    trace['persisted'] = time.time()
+    MESSAGE_STAGE_SECONDS.observe(trace['persisted'] - trace['received'], stage='persist')
+    tracer = trace['sampled'] and get_tracer()
+    if not tracer:
+        return None
+    root = tracer.start_span('chat_message', start_time=_ns(trace['received']),
+                             attributes={'messenger.room': room_code})
+    tracer.start_span('persist', context=otel_trace.set_span_in_context(root),
+                      start_time=_ns(trace['received'])).end(end_time=_ns(trace['persisted']))
+    span_context = root.get_span_context()
+    # Carried in the event (before group_send copies it) so recipients parent their deliver spans on it,
+    # as hex: msgpack (channels_redis) has no 128-bit integers
+    trace['span'] = [format(span_context.trace_id, '032x'), format(span_context.span_id, '016x')]
+    return root
+
+
+def record_broadcast(trace, span):
+    """Observe the broadcast stage once group_send has returned, and close the message span."""
+    if trace is None:
+        return
+    broadcast = time.time()
+    MESSAGE_STAGE_SECONDS.observe(broadcast - trace['persisted'], stage='broadcast')
+    if span is None:
+        return
+    get_tracer().start_span('group_send', context=otel_trace.set_span_in_context(span),
+                            start_time=_ns(trace['persisted'])).end(end_time=_ns(broadcast))
+    span.end(end_time=_ns(broadcast))
+
+
+def record_delivery(trace, dispatched, room_code):
+    """Observe the recipient-side stages after a chat_message frame was sent to one socket."""
+    if not trace:
+        return
+    delivered = time.time()
+    MESSAGE_STAGE_SECONDS.observe(max(dispatched - trace['persisted'], 0.0), stage='queue')
+    MESSAGE_STAGE_SECONDS.observe(delivered - dispatched, stage='send')
+    MESSAGE_STAGE_SECONDS.observe(max(delivered - trace['received'], 0.0), stage='total')
+    tracer = trace.get('span') and get_tracer()
+    if not tracer:
+        return
+    trace_id, span_id = trace['span']
+    parent = otel_trace.NonRecordingSpan(otel_trace.SpanContext(
+        int(trace_id, 16), int(span_id, 16), is_remote=True, trace_flags=otel_trace.TraceFlags(otel_trace.TraceFlags.SAMPLED),
+    ))
+    span = tracer.start_span('deliver', context=otel_trace.set_span_in_context(parent),
+                             start_time=_ns(dispatched), attributes={'messenger.room': room_code})
+    span.set_attribute('messenger.queue_ms', round((dispatched - trace['persisted']) * 1000, 3))
+    span.end(end_time=_ns(delivered))
@@ -11,6 +11,8 @@ urlpatterns = [
     path('api/rooms/join/', views.join_room, name='join_room'),
     path('api/rooms/<str:code>/', views.get_room, name='get_room'),
     path('api/rooms/<str:code>/messages/', views.get_room_messages, name='get_room_messages'),
+    path('api/rooms/<str:code>/export/', views.export_room_messages, name='export_room_messages'),
+    path('api/rooms/<str:code>/messages/search/', views.search_messages, name='search_messages'),
     
     # Messaging
     path('api/messages/send/', views.send_message, name='send_message'),
@@ -19,4 +21,12 @@ urlpatterns = [
     # Moderation
     path('api/moderation/block-session/', views.block_session, name='block_session'),
     path('api/moderation/reports/', views.get_reports, name='get_reports'),
+    path('api/moderation/reports/<int:message_id>/resolve/', views.resolve_reports, name='resolve_reports'),
+    path('api/moderation/queue/', views.moderation_queue, name='moderation_queue'),
+    path('api/moderation/bulk-ban/', views.bulk_ban, name='bulk_ban'),
+    
+    # Monitoring
+    path('metrics', views.metrics, name='metrics'),
+    path('healthz', views.healthz, name='healthz'),
+    path('readyz', views.readyz, name='readyz'),
 ]
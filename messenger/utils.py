@@ -1,7 +1,12 @@
 """Utility functions for the messenger app."""
 import html
+import ipaddress
+import uuid
+from functools import lru_cache
+from django.conf import settings
+from django.core.cache import cache
 from django.utils import timezone
-from .models import Session, AuditLog
+from .models import Session, Room, AuditLog
 
 
 def sanitize_input(text, max_length=None):
@@ -14,14 +19,51 @@ def sanitize_input(text, max_length=None):
     return sanitized
 
 
+@lru_cache(maxsize=8)
+def _proxy_networks(proxies):
+    return [ipaddress.ip_network(proxy, strict=False) for proxy in proxies]
+
+
+def _is_trusted_proxy(address):
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in _proxy_networks(tuple(settings.TRUSTED_PROXIES)))
+
+
+def resolve_client_ip(remote_addr, forwarded_for=None):
+    """
+    The client's address given the connecting address and any X-Forwarded-For.
+    Forwarded addresses count only as appended by settings.TRUSTED_PROXIES, read
+    right to left, so a client cannot choose its address by sending the header.
+    """
+    address = remote_addr or ''
+    if not forwarded_for or not _is_trusted_proxy(address):
+        return address
+    for hop in reversed(forwarded_for.split(',')):
+        hop = hop.strip()
+        try:
+            ipaddress.ip_address(hop)
+        except ValueError:
+            break
+        address = hop
+        if not _is_trusted_proxy(hop):
+            break
+    return address
+
+
 def get_client_ip(request):
     """Extract client IP address from request."""
-    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-    if x_forwarded_for:
-        ip = x_forwarded_for.split(',')[0].strip()
-    else:
-        ip = request.META.get('REMOTE_ADDR', '')
-    return ip
+    return resolve_client_ip(request.META.get('REMOTE_ADDR', ''), request.META.get('HTTP_X_FORWARDED_FOR'))
+
+
+def get_scope_client_ip(scope):
+    """Extract client IP address from an ASGI (WebSocket) scope."""
+    client = scope.get('client')
+    forwarded_for = dict(scope.get('headers', [])).get(b'x-forwarded-for')
+    return resolve_client_ip(client[0] if client else '',
+                             forwarded_for.decode('latin-1') if forwarded_for else None)
 
 
 def get_session_from_token(token):
@@ -47,3 +89,81 @@ def log_audit_event(event_type, session=None, room=None, ip_address=None, detail
         ip_address=ip_address,
         details=details or {}
     )
+
+
+def parse_session_token(token):
+    """Return the canonical form of a session token, or None if it is not a UUID."""
+    if not token:
+        return None
+    try:
+        return str(uuid.UUID(token))
+    except (ValueError, AttributeError):
+        return None
+
+
+def _session_cache_key(token):
+    return f"session:{token}"
+
+
+def _denied_token_key(token):
+    return f"session:denied:{token}"
+
+
+def is_token_denied(token):
+    """Check the negative cache for tokens recently found missing, expired or banned."""
+    return cache.get(_denied_token_key(token), False)
+
+
+def get_cached_session(token):
+    """
+    Get an active session from cache, falling back to the database.
+    Unknown and inactive tokens are remembered so repeated attempts skip the DB.
+    """
+    session = cache.get(_session_cache_key(token))
+    if session is None:
+        try:
+            session = Session.objects.get(session_token=token)
+        except Session.DoesNotExist:
+            cache.set(_denied_token_key(token), True, settings.SESSION_CACHE_TTL)
+            return None
+        cache.set(_session_cache_key(token), session, settings.SESSION_CACHE_TTL)
+    if not session.is_active():
+        cache.set(_denied_token_key(token), True, settings.SESSION_CACHE_TTL)
+        return None
+    return session
+
+
+def invalidate_cached_session(token):
+    """Drop cached state for a session after it is banned or unbanned."""
+    cache.delete_many([_session_cache_key(token), _denied_token_key(token)])
+
+
+def touch_session(session):
+    """Update last_active, at most once per SESSION_TOUCH_INTERVAL seconds."""
+    now = timezone.now()
+    if (now - session.last_active).total_seconds() < settings.SESSION_TOUCH_INTERVAL:
+        return
+    Session.objects.filter(pk=session.pk).update(last_active=now)
+    session.last_active = now
+    cache.set(_session_cache_key(session.session_token), session, settings.SESSION_CACHE_TTL)
+
+
+def _room_cache_key(code):
+    return f"room:{code}"
+
+
+def get_cached_room(code):
+    """Get an active room by code from cache, falling back to the database."""
+    room = cache.get(_room_cache_key(code))
+    if room is None:
+        try:
+            room = Room.objects.get(code=code, is_active=True)
+        except Room.DoesNotExist:
+            return None
+        cache.set(_room_cache_key(code), room, settings.ROOM_CACHE_TTL)
+    return room
+
+
+def invalidate_cached_rooms(codes):
+    """Drop cached rooms after they are deactivated or changed."""
+    cache.delete_many([_room_cache_key(code) for code in codes])
@@ -1,18 +1,40 @@
+import logging
 from rest_framework import status, viewsets
 from rest_framework.decorators import api_view, action
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny
+from django.conf import settings
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
-from django.db.models import Q, Count
+from django.db import DatabaseError, IntegrityError, connections, transaction
+from django.db.models import Q, Count, F, Case, When, Value
+from django.core.handlers.asgi import ASGIRequest
+from django.core.cache import cache
 from django.core.paginator import Paginator
-from .models import Session, Room, Message, AuditLog, BannedSession
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.crypto import constant_time_compare
+from .models import Session, Room, Message, MessageReport, AuditLog, BannedSession
 from .serializers import (
     SessionSerializer, RoomSerializer, MessageSerializer,
     CreateSessionSerializer, CreateRoomSerializer, JoinRoomSerializer,
-    ReportMessageSerializer, AuditLogSerializer, BannedSessionSerializer
+    ReportMessageSerializer, ResolveReportSerializer, AuditLogSerializer, BannedSessionSerializer,
+    BulkBanSerializer,
 )
-from .utils import get_client_ip, get_session_from_token, log_audit_event, sanitize_input
+from .utils import (
+    get_client_ip, get_session_from_token, log_audit_event, sanitize_input,
+)
+from .moderation import (
+    ban_session, bulk_ban_sessions, select_sessions, report_queue, resolve_report, decode_queue_cursor,
+)
+from .spam import spam_pipeline, ALLOW, SHADOW_DROP, THROTTLE
+from .search import search_room_messages
+from .export import EXPORT_FORMATS, export_room, iterate_in_thread
+from .archive import archived_messages_page, ensure_hot
+from .metrics import MESSAGES, SPAM_ACTIONS, registry
+from .drain import is_draining
+from .routers import mark_recent_write, replica_reads
+
+logger = logging.getLogger(__name__)
 
 
 @api_view(['POST'])
@@ -74,6 +96,7 @@ def create_room(request):
             message_retention_days=serializer.validated_data.get('message_retention_days', 30),
             max_participants=serializer.validated_data.get('max_participants')
         )
+        mark_recent_write(token)
         
         # Log audit event
         log_audit_event('room_create', session=session, room=room, ip_address=get_client_ip(request))
@@ -121,6 +144,7 @@ def join_room(request):
 
 
 @api_view(['GET'])
+@replica_reads
 def get_room(request, code):
     """Get room details."""
     try:
@@ -132,6 +156,7 @@ def get_room(request, code):
 
 
 @api_view(['GET'])
+@replica_reads
 def get_room_messages(request, code):
     """Get message history for a room."""
     try:
@@ -143,7 +168,21 @@ def get_room_messages(request, code):
     page = int(request.query_params.get('page', 1))
     page_size = int(request.query_params.get('page_size', 50))
     
-    messages = Message.objects.filter(room=room, is_deleted=False).order_by('-timestamp')
+    if room.is_archived:
+        # Served from the archive file; the room is rehydrated on its next message
+        total_pages = max((room.archive.visible_count + page_size - 1) // page_size, 1)
+        page = min(max(page, 1), total_pages)
+        results, count = archived_messages_page(room, page, page_size)
+        return Response({
+            'results': results,
+            'count': count,
+            'page': page,
+            'page_size': page_size,
+            'total_pages': total_pages,
+            'archived': True
+        })
+    
+    messages = Message.objects.for_room(room).filter(is_deleted=False).order_by('-timestamp')
     paginator = Paginator(messages, page_size)
     page_obj = paginator.get_page(page)
     
@@ -157,6 +196,79 @@ def get_room_messages(request, code):
     })
 
 
+@api_view(['GET'])
+@replica_reads
+def search_messages(request, code):
+    """Full-text search of a room's message history, best match first."""
+    try:
+        room = Room.objects.get(code=code.upper(), is_active=True)
+    except Room.DoesNotExist:
+        return Response({'error': 'Room not found'}, status=status.HTTP_404_NOT_FOUND)
+
+    query = request.query_params.get('q', '').strip()
+    if not query:
+        return Response({'error': 'q parameter required'}, status=status.HTTP_400_BAD_REQUEST)
+    if len(query) > 200:
+        return Response({'error': 'Search query too long'}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        page = max(int(request.query_params.get('page', 1)), 1)
+        page_size = min(max(int(request.query_params.get('page_size', 20)), 1), 100)
+    except ValueError:
+        return Response({'error': 'Invalid pagination parameters'}, status=status.HTTP_400_BAD_REQUEST)
+
+    # Fetch one extra row to know whether another page exists without counting
+    results = search_room_messages(room, query, limit=page_size + 1, offset=(page - 1) * page_size)
+    serializer = MessageSerializer(results[:page_size], many=True)
+    return Response({
+        'results': serializer.data,
+        'query': query,
+        'page': page,
+        'page_size': page_size,
+        'has_more': len(results) > page_size
+    })
+
+
+@api_view(['GET'])
+@replica_reads
+def export_room_messages(request, code):
+    """Stream a room's full history as NDJSON or CSV (room owner or staff)."""
+    try:
+        room = Room.objects.get(code=code.upper())
+    except Room.DoesNotExist:
+        return Response({'error': 'Room not found'}, status=status.HTTP_404_NOT_FOUND)
+
+    session = None
+    if not request.user.is_staff:
+        token = request.headers.get('X-Session-Token') or request.query_params.get('session_token')
+        if not token:
+            return Response({'error': 'Session token required'}, status=status.HTTP_401_UNAUTHORIZED)
+        session = get_session_from_token(token)
+        if not session:
+            return Response({'error': 'Invalid or expired session'}, status=status.HTTP_401_UNAUTHORIZED)
+        if room.owner_session_id != session.id:
+            return Response({'error': 'Only room owner can export messages'}, status=status.HTTP_403_FORBIDDEN)
+
+    # 'format' is reserved by DRF for renderer selection
+    export_format = request.query_params.get('export_format', 'ndjson')
+    if export_format not in EXPORT_FORMATS:
+        return Response({'error': f'export_format must be one of {", ".join(EXPORT_FORMATS)}'},
+                        status=status.HTTP_400_BAD_REQUEST)
+    compress = request.query_params.get('gzip', '').lower() in ('1', 'true', 'yes')
+
+    log_audit_event('admin_action', session=session, room=room, ip_address=get_client_ip(request),
+                    details={'action': 'room_export', 'format': export_format, 'staff': request.user.is_staff})
+
+    content = export_room(room, export_format, compress)
+    if isinstance(request._request, ASGIRequest):
+        content = iterate_in_thread(content)
+    filename = f'room-{room.code}.{export_format}' + ('.gz' if compress else '')
+    content_type = 'application/gzip' if compress else EXPORT_FORMATS[export_format]
+    response = StreamingHttpResponse(content, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
 @api_view(['POST'])
 def send_message(request):
     """Send a message via REST API (alternative to WebSocket)."""
@@ -184,12 +296,31 @@ def send_message(request):
     if not sanitized_content:
         return Response({'error': 'Message content cannot be empty'}, status=status.HTTP_400_BAD_REQUEST)
     
+    # Spam scoring (in-memory, bounded work per message)
+    action, reasons = spam_pipeline.check(str(session.session_token), room.code, sanitized_content)
+    if action != ALLOW:
+        SPAM_ACTIONS.inc(action=action, source='rest')
+    if action == THROTTLE:
+        log_audit_event('rate_limit', session=session, room=room, ip_address=get_client_ip(request),
+                       details={'source': 'spam', 'reasons': reasons})
+        return Response({'error': 'Message looks like spam. Please slow down.'},
+                       status=status.HTTP_429_TOO_MANY_REQUESTS)
+    if action == SHADOW_DROP:
+        # Answer as if sent; nothing is stored
+        logger.info('Shadow-dropped message from %s in %s: %s', session.session_token, room.code, reasons)
+        message = Message(room=room, session=session, content=sanitized_content, timestamp=timezone.now())
+        return Response(MessageSerializer(message).data, status=status.HTTP_201_CREATED)
+    
+    ensure_hot(room)
+    
     # Create message
     message = Message.objects.create(
         room=room,
         session=session,
         content=sanitized_content
     )
+    mark_recent_write(token)
+    MESSAGES.inc(source='rest')
     
     # Log audit event
     log_audit_event('message_send', session=session, room=room, ip_address=get_client_ip(request))
@@ -209,15 +340,36 @@ def report_message(request, message_id):
     if not session:
         return Response({'error': 'Invalid or expired session'}, status=status.HTTP_401_UNAUTHORIZED)
     
-    try:
-        message = Message.objects.get(id=message_id, is_deleted=False)
-    except Message.DoesNotExist:
-        return Response({'error': 'Message not found'}, status=status.HTTP_404_NOT_FOUND)
-    
     serializer = ReportMessageSerializer(data=request.data)
     if serializer.is_valid():
-        message.reported_count += 1
-        message.save(update_fields=['reported_count'])
+        try:
+            message = Message.objects.locate(message_id, serializer.validated_data.get('room_code'),
+                                             is_deleted=False)
+        except Message.DoesNotExist:
+            return Response({'error': 'Message not found'}, status=status.HTTP_404_NOT_FOUND)
+        
+        db = message._state.db
+        try:
+            with transaction.atomic(using=db):
+                MessageReport.objects.using(db).create(
+                    message=message,
+                    reporter=session,
+                    reason=serializer.validated_data.get('reason', '')
+                )
+        except IntegrityError:
+            return Response({'error': 'You have already reported this message'},
+                           status=status.HTTP_409_CONFLICT)
+        
+        # Atomic increment; the auto-hide threshold is applied in the same UPDATE
+        updates = {'reported_count': F('reported_count') + 1, 'report_status': 'open'}
+        threshold = settings.REPORT_AUTO_HIDE_THRESHOLD
+        if threshold:
+            updates['is_deleted'] = Case(
+                When(reported_count__gte=threshold - 1, then=Value(True)),
+                default=F('is_deleted')
+            )
+        Message.objects.using(db).filter(pk=message.pk).update(**updates)
+        mark_recent_write(token)
         
         # Log audit event
         log_audit_event('message_report', session=session, room=message.room,
@@ -254,15 +406,14 @@ def block_session(request):
                            status=status.HTTP_403_FORBIDDEN)
         
         target_session = Session.objects.get(session_token=target_session_token)
-        target_session.is_banned = True
-        target_session.save(update_fields=['is_banned'])
         
-        # Create ban record
-        BannedSession.objects.create(
-            session=target_session,
+        # Ban, record it and disconnect the target's open sockets
+        ban_session(
+            target_session,
             reason=request.data.get('reason', 'Blocked by room owner'),
             banned_by=session.nickname
         )
+        mark_recent_write(token)
         
         # Log audit event
         log_audit_event('session_ban', session=session, room=room,
@@ -276,9 +427,24 @@ def block_session(request):
         return Response({'error': 'Target session not found'}, status=status.HTTP_404_NOT_FOUND)
 
 
+def _queue_params(request):
+    """Parse status/cursor/limit query parameters shared by the report queues."""
+    status_filter = request.query_params.get('status', 'open')
+    if status_filter not in ('open', 'resolved', 'all'):
+        raise ValueError('status must be open, resolved or all')
+    limit = min(int(request.query_params.get('limit', 50)), 200)
+    if limit < 1:
+        raise ValueError('limit must be positive')
+    cursor = request.query_params.get('cursor') or None
+    if cursor:
+        decode_queue_cursor(cursor)
+    return (None if status_filter == 'all' else status_filter), cursor, limit
+
+
 @api_view(['GET'])
+@replica_reads
 def get_reports(request):
-    """Get reported messages (room owner only)."""
+    """Get the report queue for a room (room owner only)."""
     token = request.headers.get('X-Session-Token') or request.query_params.get('session_token')
     if not token:
         return Response({'error': 'Session token required'}, status=status.HTTP_401_UNAUTHORIZED)
@@ -291,19 +457,131 @@ def get_reports(request):
     if not room_code:
         return Response({'error': 'room_code required'}, status=status.HTTP_400_BAD_REQUEST)
     
+    try:
+        status_filter, cursor, limit = _queue_params(request)
+    except ValueError as exc:
+        return Response({'error': f'Invalid query parameters: {exc}'}, status=status.HTTP_400_BAD_REQUEST)
+    
     try:
         room = Room.objects.get(code=room_code.upper(), is_active=True)
         if room.owner_session != session:
             return Response({'error': 'Only room owner can view reports'}, 
                            status=status.HTTP_403_FORBIDDEN)
         
-        reported_messages = Message.objects.filter(
-            room=room,
-            reported_count__gt=0,
-            is_deleted=False
-        ).order_by('-reported_count', '-timestamp')
-        
+        reported_messages, next_cursor = report_queue(room, status_filter, cursor, limit)
         serializer = MessageSerializer(reported_messages, many=True)
-        return Response(serializer.data)
+        return Response({'results': serializer.data, 'next_cursor': next_cursor})
     except Room.DoesNotExist:
         return Response({'error': 'Room not found'}, status=status.HTTP_404_NOT_FOUND)
+
+
+@api_view(['GET'])
+@replica_reads
+def moderation_queue(request):
+    """Get the report queue across all rooms (staff only)."""
+    if not request.user.is_staff:
+        return Response({'error': 'Staff access required'}, status=status.HTTP_403_FORBIDDEN)
+    
+    try:
+        status_filter, cursor, limit = _queue_params(request)
+    except ValueError as exc:
+        return Response({'error': f'Invalid query parameters: {exc}'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    reported_messages, next_cursor = report_queue(None, status_filter, cursor, limit)
+    serializer = MessageSerializer(reported_messages, many=True)
+    return Response({'results': serializer.data, 'next_cursor': next_cursor})
+
+
+@api_view(['POST'])
+def resolve_reports(request, message_id):
+    """Resolve a reported message, optionally removing it (room owner or staff)."""
+    if not request.user.is_staff:
+        token = request.headers.get('X-Session-Token') or request.data.get('session_token')
+        if not token:
+            return Response({'error': 'Session token required'}, status=status.HTTP_401_UNAUTHORIZED)
+        session = get_session_from_token(token)
+        if not session:
+            return Response({'error': 'Invalid or expired session'}, status=status.HTTP_401_UNAUTHORIZED)
+    
+    serializer = ResolveReportSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        message = Message.objects.locate(message_id, serializer.validated_data['room_code'])
+    except Message.DoesNotExist:
+        return Response({'error': 'Message not found'}, status=status.HTTP_404_NOT_FOUND)
+    
+    if not request.user.is_staff and message.room.owner_session_id != session.id:
+        return Response({'error': 'Only room owner can resolve reports'}, status=status.HTTP_403_FORBIDDEN)
+    
+    remove = serializer.validated_data['remove']
+    resolve_report(message, remove=remove)
+    log_audit_event('admin_action', session=None if request.user.is_staff else session, room=message.room,
+                   ip_address=get_client_ip(request),
+                   details={'action': 'resolve_reports', 'message_id': message_id, 'remove': remove})
+    return Response({'message': 'Reports resolved'}, status=status.HTTP_200_OK)
+
+
+@api_view(['POST'])
+def bulk_ban(request):
+    """Ban all sessions matching an IP range and/or nickname pattern (staff only)."""
+    if not request.user.is_staff:
+        return Response({'error': 'Staff access required'}, status=status.HTTP_403_FORBIDDEN)
+    
+    serializer = BulkBanSerializer(data=request.data)
+    if serializer.is_valid():
+        data = serializer.validated_data
+        targets = select_sessions(data.get('ip_range'), data.get('nickname_pattern'))
+        if data['dry_run']:
+            return Response({'matched': targets.filter(is_banned=False).count(), 'dry_run': True})
+        
+        count = bulk_ban_sessions(
+            targets,
+            reason=data['reason'],
+            banned_by=request.user.username,
+            expires_at=data.get('expires_at'),
+            details={'ip_range': data.get('ip_range', ''),
+                     'nickname_pattern': data.get('nickname_pattern', ''),
+                     'ip_address': get_client_ip(request)}
+        )
+        return Response({'banned': count}, status=status.HTTP_200_OK)
+    
+    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+def metrics(request):
+    """Prometheus scrape endpoint covering every worker that shares METRICS_DIR."""
+    if not settings.METRICS_ENABLED:
+        raise Http404
+    if settings.METRICS_TOKEN and not constant_time_compare(
+        request.headers.get('Authorization', ''), f'Bearer {settings.METRICS_TOKEN}'
+    ):
+        return HttpResponse('Unauthorized', status=401, content_type='text/plain')
+    registry.start_flusher()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def healthz(request):
+    """Liveness: the worker process is up and serving requests."""
+    return HttpResponse('ok', content_type='text/plain')
+
+
+def readyz(request):
+    """Readiness: the database and cache answer and the worker is not draining."""
+    checks = {'draining': is_draining()}
+    try:
+        with connections['default'].cursor() as cursor:
+            cursor.execute('SELECT 1')
+        checks['database'] = True
+    except DatabaseError:
+        logger.exception('Readiness check: database unavailable')
+        checks['database'] = False
+    try:
+        cache.set('readyz', 1, 10)
+        checks['cache'] = cache.get('readyz') == 1
+    except Exception:
+        logger.exception('Readiness check: cache unavailable')
+        checks['cache'] = False
+    ready = checks['database'] and checks['cache'] and not checks['draining']
+    return JsonResponse({'ready': ready, **checks}, status=200 if ready else 503)